@@ -0,0 +1,271 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Plans orders of stacks that give Eliot a chosen symcache hit ratio.
+#
+# Every module in a stack's memoryMap is a cache lookup, so which modules a
+# run hits the cache for depends on which stacks were sent before. This reads
+# the (debug_file, debug_id) pairs of every stack, simulates an LRU cache of an
+# assumed size, and greedily picks each next stack so the hit ratio over the
+# last few stacks stays near the target. Stacks sharing modules with the last
+# one picked are found with a module -> stacks index, so warm orders don't
+# depend on random picks happening to overlap.
+#
+# An order file is one stack file name per line, with "#" comment lines at the
+# top saying how it was planned. Names don't include the directory, so the same
+# order works for a stacks directory and a corpus packed from it.
+
+import collections
+import concurrent.futures
+import os
+
+from stackcorpus import open_stacks
+
+
+# Named targets for --target
+TARGETS = {"cold": 0.0, "mixed": 0.8, "warm": 1.0}
+
+# Stacks the hit ratio is steered over; earlier stacks no longer count, so
+# early misses while the cache fills aren't made up for later
+WINDOW = 100
+
+# Number of stacks considered for each pick
+CANDIDATES = 32
+
+
+class OrderError(Exception):
+    pass
+
+
+def job_modules(payload):
+    """Return the unique "debug_file/debug_id" keys looked up for a stack"""
+    jobs = payload["jobs"] if "jobs" in payload else [payload]
+    keys = {}
+    for job in jobs:
+        for debug_file, debug_id in job.get("memoryMap", []):
+            keys[f"{debug_file}/{debug_id}"] = None
+    return list(keys)
+
+
+def read_modules(path, start, end):
+    """Return module keys for stacks start to end; run in worker processes"""
+    stacks = open_stacks(path)
+    return [job_modules(stacks.payload(index)) for index in range(start, end)]
+
+
+class ModuleIndex:
+    """Modules of each stack and the stacks each module is in
+
+    Modules are numbered in the order they're first seen.
+
+    """
+
+    def __init__(self):
+        self.modules = []
+        self.module_numbers = {}
+        # Stack index -> tuple of module numbers
+        self.stack_modules = []
+        # Module number -> list of stack indexes
+        self.module_stacks = []
+
+    def add(self, keys):
+        numbers = []
+        stack_index = len(self.stack_modules)
+        for key in keys:
+            number = self.module_numbers.get(key)
+            if number is None:
+                number = self.module_numbers[key] = len(self.modules)
+                self.modules.append(key)
+                self.module_stacks.append([])
+            numbers.append(number)
+            self.module_stacks[number].append(stack_index)
+        self.stack_modules.append(tuple(numbers))
+
+    def __len__(self):
+        return len(self.stack_modules)
+
+    @classmethod
+    def build(cls, path, stacks_count, workers=1, chunk_size=1000):
+        """Build an index for the stacks at path, reading them in parallel"""
+        index = cls()
+        ranges = [
+            (start, min(start + chunk_size, stacks_count))
+            for start in range(0, stacks_count, chunk_size)
+        ]
+        if workers > 1 and len(ranges) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                chunks = pool.map(
+                    read_modules,
+                    [path] * len(ranges),
+                    *zip(*ranges, strict=True),
+                )
+                for chunk in chunks:
+                    for keys in chunk:
+                        index.add(keys)
+        else:
+            for start, end in ranges:
+                for keys in read_modules(path, start, end):
+                    index.add(keys)
+        return index
+
+
+class LRUCache:
+    """Cache of module numbers that evicts the least recently used"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def hits(self, modules):
+        """Return how many lookups of modules, in order, would be hits
+
+        This doesn't change the cache. Misses evict the least recently used
+        entries that this stack hasn't looked up yet, so a module can be
+        evicted by an earlier miss in the same stack.
+
+        """
+        hits = 0
+        size = len(self.entries)
+        oldest = iter(self.entries)
+        looked_up = set()
+        evicted = set()
+        for module in modules:
+            if module in self.entries and module not in evicted:
+                hits += 1
+                looked_up.add(module)
+                continue
+
+            looked_up.add(module)
+            size += 1
+            while size > self.size:
+                victim = next(oldest, None)
+                if victim is None:
+                    break
+                if victim not in looked_up:
+                    evicted.add(victim)
+                    size -= 1
+        return hits
+
+    def touch(self, modules):
+        for module in modules:
+            if module in self.entries:
+                self.entries.move_to_end(module)
+            else:
+                self.entries[module] = None
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+
+
+def plan_order(index, target, cache_size, count, rng, reuse=False):
+    """Return (order, hits per stack) that keeps the hit ratio near target
+
+    :param index: ModuleIndex of the stacks
+    :param target: hit ratio to aim for, from 0 to 1
+    :param cache_size: number of modules the server's cache holds
+    :param count: number of stacks in the order
+    :param rng: random.Random to pick candidates with
+    :param reuse: whether stacks can be in the order more than once
+
+    """
+    if not reuse and count > len(index):
+        raise OrderError(f"can't plan {count} stacks from {len(index)} without reuse")
+
+    cache = LRUCache(cache_size)
+    # Unused stacks; removing swaps the last one in so picking stays O(1)
+    unused = list(range(len(index)))
+    positions = list(range(len(index)))
+    window = collections.deque()
+    window_hits = window_lookups = 0
+    order = []
+    hits = []
+
+    def pick_random():
+        if reuse:
+            return rng.randrange(len(index))
+        return unused[rng.randrange(len(unused))]
+
+    def pick_related():
+        # A stack that shares a module with the last stack picked
+        if not order or not index.stack_modules[order[-1]]:
+            return None
+        module = rng.choice(index.stack_modules[order[-1]])
+        stack = rng.choice(index.module_stacks[module])
+        if not reuse and positions[stack] is None:
+            return None
+        return stack
+
+    for _ in range(count):
+        candidates = set()
+        for _ in range(CANDIDATES // 2):
+            candidates.add(pick_random())
+            stack = pick_related()
+            if stack is not None:
+                candidates.add(stack)
+
+        # Ties go to a random candidate, rather than the lowest index every time
+        candidates = sorted(candidates)
+        rng.shuffle(candidates)
+        best = None
+        for stack in candidates:
+            modules = index.stack_modules[stack]
+            stack_hits = cache.hits(modules)
+            lookups = window_lookups + len(modules)
+            ratio = (window_hits + stack_hits) / lookups if lookups else target
+            error = abs(ratio - target)
+            if best is None or error < best[0]:
+                best = (error, stack, stack_hits)
+        _, stack, stack_hits = best
+
+        modules = index.stack_modules[stack]
+        cache.touch(modules)
+        order.append(stack)
+        hits.append(stack_hits)
+
+        window.append((stack_hits, len(modules)))
+        window_hits += stack_hits
+        window_lookups += len(modules)
+        if len(window) > WINDOW:
+            old_hits, old_lookups = window.popleft()
+            window_hits -= old_hits
+            window_lookups -= old_lookups
+
+        if not reuse:
+            position = positions[stack]
+            last = unused.pop()
+            if last != stack:
+                unused[position] = last
+                positions[last] = position
+            positions[stack] = None
+
+    return order, hits
+
+
+def write_order(path, stacks, order, **info):
+    """Write an order file with info in the comment lines at the top"""
+    with open(path, "w", encoding="utf-8") as fp:
+        for key, value in info.items():
+            fp.write(f"# {key}: {value}\n")
+        for index in order:
+            fp.write(f"{os.path.basename(stacks.name(index))}\n")
+
+
+def load_order(path, stacks):
+    """Return the stack indexes listed in an order file
+
+    :raises OrderError: if the file lists a stack that's not in stacks
+
+    """
+    name_to_index = {
+        os.path.basename(stacks.name(index)): index for index in range(len(stacks))
+    }
+    order = []
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            name = line.strip()
+            if not name or name.startswith("#"):
+                continue
+            if name not in name_to_index:
+                raise OrderError(f"{path} has {name!r} which isn't in the stacks")
+            order.append(name_to_index[name])
+    return order
@@ -0,0 +1,385 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Content-addressed on-disk store with a size budget.
+#
+# Values are stored once per distinct content under objects/ by their sha256,
+# so keys with the same content share a file. An sqlite index maps keys to
+# digests and tracks when each key was stored and last used. When the store is
+# over its size budget, the least recently used keys are dropped along with
+# any files no other key refers to.
+#
+# Reads check the content against its digest, so a damaged file is dropped and
+# treated as missing rather than returned.
+#
+# Layout:
+#
+#     ROOT/index.sqlite
+#     ROOT/objects/ab/cdef...  (sha256 hex digest split after 2 characters)
+#     ROOT/tmp/                (files being written)
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+CHUNK_SIZE = 1024 * 1024
+
+SIZE_SUFFIXES = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+"""
+
+
+def parse_size(value):
+    """Parse a size like "500M" or "2g" into bytes
+
+    Plain numbers are bytes. None stays None.
+
+    """
+    if value is None:
+        return None
+    value = str(value).strip().lower().removesuffix("b")
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    if value[-1:] in SIZE_SUFFIXES:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+class Entry:
+    def __init__(self, key, digest, size, created, accessed, meta):
+        self.key = key
+        self.digest = digest
+        self.size = size
+        self.created = created
+        self.accessed = accessed
+        self.meta = meta
+
+    def age(self):
+        return time.time() - self.created
+
+
+class ContentStore:
+    """Content-addressed store of bytes values by string key
+
+    It's safe to share a store between threads. Processes can share a store
+    directory too since sqlite handles the locking.
+
+    :param root: directory for the store; created if it doesn't exist
+    :param max_size: size budget in bytes; None for no budget
+
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"),
+            timeout=60,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def info(self, key):
+        """Return the Entry for key or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.key, e.digest, b.size, e.created, e.accessed, e.meta "
+                + "FROM entries e JOIN blobs b ON b.digest = e.digest WHERE e.key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        meta = json.loads(row[5]) if row[5] else None
+        return Entry(*row[:5], meta)
+
+    def _touch(self, key):
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+
+    def get(self, key):
+        """Return the value for key, or None if it's not in the store"""
+        entry = self.info(key)
+        if entry is None:
+            return None
+        try:
+            with open(self._blob_path(entry.digest), "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            self.delete(key)
+            return None
+        if hashlib.sha256(data).hexdigest() != entry.digest:
+            self._drop_blob(entry.digest)
+            return None
+        self._touch(key)
+        return data
+
+    def get_path(self, key, verify=True):
+        """Return the path of the file holding the value for key, or None
+
+        The file must not be modified. With verify=False, the content isn't
+        checked, which saves reading large files twice.
+
+        """
+        entry = self.info(key)
+        if entry is None:
+            return None
+        path = self._blob_path(entry.digest)
+        if not os.path.exists(path):
+            self.delete(key)
+            return None
+        if verify and file_digest(path) != entry.digest:
+            self._drop_blob(entry.digest)
+            return None
+        self._touch(key)
+        return path
+
+    def put(self, key, data, meta=None):
+        """Store data for key
+
+        :returns: sha256 hex digest of data
+
+        """
+        return self.put_stream(key, [data], meta=meta)
+
+    def put_stream(self, key, chunks, meta=None):
+        """Store the concatenation of an iterable of bytes chunks for key
+
+        :returns: sha256 hex digest of the value
+
+        """
+        with self.writer(key, meta=meta) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        return writer.digest
+
+    def writer(self, key, meta=None):
+        """Return a StoreWriter for writing the value for key a chunk at a time
+
+        Chunks are written to a temporary file and hashed as they go, so values
+        don't have to fit in memory. Use it as a context manager: the value is
+        stored when the block finishes and thrown away if it raises.
+
+        """
+        return StoreWriter(self, key, meta)
+
+    def _commit(self, key, tmp_path, digest, size, meta):
+        """Move a finished temporary file into place and index it"""
+        if self.max_size is not None and size > self.max_size:
+            # It would push everything else out and still not fit
+            os.remove(tmp_path)
+            return
+
+        blob_path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._db.execute(
+                    "SELECT digest FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                self._db.execute(
+                    "INSERT OR IGNORE INTO blobs (digest, size) VALUES (?, ?)",
+                    (digest, size),
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    + "(key, digest, created, accessed, meta) VALUES (?, ?, ?, ?, ?)",
+                    (key, digest, now, now, json.dumps(meta) if meta else None),
+                )
+                orphans = []
+                if old and old[0] != digest:
+                    orphans = self._orphan_blobs([old[0]])
+                orphans += self._evict(keep=key)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self._remove_files(orphans)
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT digest FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            orphans = []
+            if row:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                orphans = self._orphan_blobs([row[0]])
+            self._db.execute("COMMIT")
+        self._remove_files(orphans)
+
+    def _drop_blob(self, digest):
+        """Forget a damaged file and every key that refers to it"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+            self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._db.execute("COMMIT")
+        self._remove_files([(digest, None)])
+
+    def _orphan_blobs(self, digests):
+        """Delete blob rows no key refers to
+
+        Call with the lock held in a transaction.
+
+        :returns: list of (digest, size) for the deleted rows
+
+        """
+        orphans = []
+        for digest in digests:
+            in_use = self._db.execute(
+                "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+            if in_use:
+                continue
+            row = self._db.execute(
+                "SELECT size FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row:
+                self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                orphans.append((digest, row[0]))
+        return orphans
+
+    def _evict(self, keep=None):
+        """Drop least recently used keys until the store fits its budget
+
+        Call with the lock held in a transaction.
+
+        :returns: list of (digest, size) for files to remove after committing
+
+        """
+        if self.max_size is None:
+            return []
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs")
+        total = total.fetchone()[0]
+        orphans = []
+        while total > self.max_size:
+            rows = self._db.execute(
+                "SELECT key, digest FROM entries WHERE key != ? "
+                + "ORDER BY accessed LIMIT 100",
+                (keep or "",),
+            ).fetchall()
+            if not rows:
+                break
+            for key, digest in rows:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                for orphan in self._orphan_blobs([digest]):
+                    orphans.append(orphan)
+                    total -= orphan[1]
+                if total <= self.max_size:
+                    break
+        return orphans
+
+    def _remove_files(self, orphans):
+        for digest, _ in orphans:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._blob_path(digest))
+
+    def stats(self):
+        """Return (number of keys, number of files, total bytes)"""
+        with self._lock:
+            keys = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            blobs, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+        return keys, blobs, size
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class StoreWriter:
+    """Writes one value to a ContentStore; see ContentStore.writer"""
+
+    def __init__(self, store, key, meta):
+        self.store = store
+        self.key = key
+        self.meta = meta
+        self.size = 0
+        self.digest = None
+        self._hasher = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.join(store.root, "tmp"))
+        self._fp = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+        self._fp.write(chunk)
+
+    def commit(self):
+        """Store the value; returns its sha256 hex digest"""
+        self._fp.close()
+        self.digest = self._hasher.hexdigest()
+        try:
+            self.store._commit(
+                self.key, self._tmp_path, self.digest, self.size, self.meta
+            )
+        except BaseException:
+            self.abort()
+            raise
+        return self.digest
+
+    def abort(self):
+        """Throw the value away"""
+        self._fp.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file's content"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
@@ -4,191 +4,453 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-# Goes through symbolication log output for two symbolication sessions,
-# looks at the debug sections in the symbolication responses, and generates a
-# comparison table of download, parse, and save symfile timings between the two
-# symbolication sessions for all the modules that were downloaded by both.
+# Compares the timings of two symbolication sessions and says whether the
+# second one is significantly slower or faster than the first.
 #
-# This is helpful for comparing timings between two environments.
+# Each session is a log or a directory of logs. Logs can be result logs
+# (symbolication-YYYYMMDD.jsonl.gz) or the older text logs
+# (symbolication-YYYYMMDD.log). Result logs are read in parallel in ranges of
+# blocks, and only the timings are kept, so large logs take seconds.
+#
+# Request latencies, server times, cache lookup times, and download, parse, and
+# symcache save times (over all modules and for each module downloaded in both
+# sessions) are compared by their medians with a bootstrap confidence interval
+# for the shift and a Mann-Whitney U test. A change is flagged when it's
+# significant, the confidence interval doesn't include 0, and the median moved
+# by at least --min-change. Module comparisons use a Bonferroni-corrected
+# significance level since there are so many of them.
 #
-# To set the logs, see below.
+# This is helpful for comparing timings between two environments.
 #
-# Usage: python compare_symbolication_logs.py
+# Usage: python compare_symbolication_logs.py [OPTIONS] BASELINE CANDIDATE
 
-import json
+from array import array
+import concurrent.futures
+import math
+import os
 
+import click
+import numpy as np
 from rich import box
 from rich.console import Console
 from rich.table import Table
 
+from resultlog import (
+    is_result_log,
+    iter_records,
+    iter_records_between,
+    iter_responses,
+    split_blocks,
+)
+
+
+# Per-module timings in the debug block: (section, name)
+MODULE_STEPS = [
+    ("downloads", "download"),
+    ("parse_sym", "parse"),
+    ("save_symcache", "save"),
+]
+
+# Per-request timings: name -> function of (latency, debug block). Latency is
+# measured by the client and only result logs have it; server is the time the
+# server says the request took, which both kinds of log have.
+REQUEST_METRICS = {
+    "latency": lambda latency, debug: latency,
+    "server": lambda latency, debug: debug.get("time"),
+    "cache": lambda latency, debug: (debug.get("cache_lookups") or {}).get("time"),
+}
+
+# Bootstrap resamples are drawn from at most this many values per session
+BOOTSTRAP_MAX_SAMPLES = 2_000
+
+
+def session_logs(path):
+    """Return the logs in a session, which is a log or a directory of logs"""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if is_result_log(name) or name.endswith(".log")
+    )
 
-LOG1 = "symbolication-gcp-20230418.log"
-TITLE1 = "gcp prod 20230418"
-LOG2 = "symbolication-gcp-prod-20230424.log"
-TITLE2 = "gcp prod 20230424"
-
-
-def load_data(fn):
-    with open(fn, "r") as fp:
-        return [
-            json.loads(line.strip()[10:])
-            for line in fp.readlines()
-            if line.startswith("RESPONSE")
-        ]
-
-
-def sizeof_fmt(num, suffix="b"):
-    for unit in ["", "k", "m", "g", "t", "p", "e", "z"]:
-        if abs(num) < 1024.0:
-            return f"{num:,.2f} {unit}{suffix}"
-        num /= 1024.0
-    return f"{num:,.2f} Yi{suffix}"
-
-
-def time_fmt(num):
-    if not num:
-        return ""
-    if num > 30:
-        return f"** [red]{num:,.2f} s[/red] **"
-    return f"{num:,.2f} s"
-
-
-def get_module_data(data):
-    all_module_data = {}
-
-    for item in data:
-        debug_data = item.get("debug", {})
-
-        all_modules = set()
-        all_modules |= set(
-            debug_data.get("downloads", {}).get("time_per_module", {}).keys()
-        )
-        all_modules |= set(
-            debug_data.get("parse_sym", {}).get("time_per_module", {}).keys()
-        )
-        all_modules |= set(
-            debug_data.get("save_symcache", {}).get("time_per_module", {}).keys()
-        )
-
-        for module in all_modules:
-            module_data = all_module_data.get(module, {})
-
-            download_time = (
-                debug_data.get("downloads", {})
-                .get("time_per_module", {})
-                .get(module, None)
-            )
-            if download_time is not None:
-                module_data.setdefault("download", []).append(download_time)
-                module_data["size"] = debug_data["downloads"]["size_per_module"][module]
-
-            parse_sym_time = (
-                debug_data.get("parse_sym", {})
-                .get("time_per_module", {})
-                .get(module, None)
-            )
-            if parse_sym_time is not None:
-                module_data.setdefault("parse_sym", []).append(parse_sym_time)
-
-            save_symcache_time = (
-                debug_data.get("save_symcache", {})
-                .get("time_per_module", {})
-                .get(module, None)
-            )
-            if save_symcache_time is not None:
-                module_data.setdefault("save_symcache", []).append(save_symcache_time)
-
-            all_module_data[module] = module_data
-
-    return all_module_data
 
+def _iter_timings(path, start, end):
+    """Yield (latency, debug block) for each request in part of a log
 
-data_aws = load_data(LOG1)
-module_aws = get_module_data(data_aws)
+    Latency is None for text logs.
 
-data_gcp = load_data(LOG2)
-module_gcp = get_module_data(data_gcp)
+    """
+    if start is not None:
+        records = iter_records_between(path, start, end)
+    elif is_result_log(path):
+        records = iter_records(path)
+    else:
+        for response in iter_responses(path):
+            yield None, response["debug"]
+        return
+
+    for record in records:
+        yield record.get("time"), record.get("debug") or {}
+
+
+def collect_timings(path, start=None, end=None):
+    """Return the timings in part of a log
+
+    This runs in the worker processes.
+
+    :arg start: byte offset from split_blocks, or None to read a whole log
+        (which is the only way to read a text log)
+    :returns: ({metric: array}, {step: {module: array}})
+
+    """
+    requests = {metric: array("d") for metric in REQUEST_METRICS}
+    modules = {step: {} for _, step in MODULE_STEPS}
+    for latency, debug in _iter_timings(path, start, end):
+        for metric, get_value in REQUEST_METRICS.items():
+            value = get_value(latency, debug)
+            if value is not None:
+                requests[metric].append(value)
+        for section, step in MODULE_STEPS:
+            per_module = (debug.get(section) or {}).get("time_per_module") or {}
+            step_modules = modules[step]
+            for module, value in per_module.items():
+                if module not in step_modules:
+                    step_modules[module] = array("d")
+                step_modules[module].append(value)
+    return requests, modules
+
+
+def merge_timings(timings, part):
+    requests, modules = part
+    for metric, values in requests.items():
+        timings[0].setdefault(metric, array("d")).extend(values)
+    for step, step_modules in modules.items():
+        merged = timings[1].setdefault(step, {})
+        for module, values in step_modules.items():
+            merged.setdefault(module, array("d")).extend(values)
+
+
+def read_sessions(paths, workers):
+    """Return the timings for each session, reading logs in parallel
+
+    If any log is a text log, latencies aren't returned, since only some of
+    the requests would have them.
+
+    """
+    tasks = []
+    for session, path in enumerate(paths):
+        for log in session_logs(path):
+            if is_result_log(log):
+                for start, end in split_blocks(log, workers):
+                    tasks.append((session, log, start, end))
+            else:
+                tasks.append((session, log, None, None))
+
+    timings = [({}, {}) for _ in paths]
+    if workers > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (session, executor.submit(collect_timings, log, start, end))
+                for session, log, start, end in tasks
+            ]
+            for session, future in futures:
+                merge_timings(timings[session], future.result())
+    else:
+        for session, log, start, end in tasks:
+            merge_timings(timings[session], collect_timings(log, start, end))
 
+    if any(not is_result_log(log) for _, log, _, _ in tasks):
+        for requests, _ in timings:
+            requests.pop("latency", None)
+    return timings
 
-console = Console()
 
-all_rows = []
+def mann_whitney(a, b):
+    """Return the two-sided p-value of a Mann-Whitney U test of a and b
 
-for key in set(module_aws.keys()) & set(module_gcp.keys()):
-    # size
-    if key in module_aws:
-        size = module_aws[key]["size"]
+    Uses the normal approximation with a tie correction and a continuity
+    correction, which is fine for the sample sizes here.
 
-    else:
-        size = module_gcp[key]["size"]
+    """
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    _, inverse, counts = np.unique(
+        np.concatenate([a, b]), return_inverse=True, return_counts=True
+    )
+    # Tied values all get the average of the ranks they span
+    average_ranks = np.cumsum(counts) - (counts - 1) / 2
+    u = average_ranks[inverse[:n1]].sum() - n1 * (n1 + 1) / 2
+
+    ties = float((counts.astype(np.float64) ** 3 - counts).sum())
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = max(0.0, abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(z / math.sqrt(2))
+
+
+def bootstrap_shift(a, b, rng, resamples, confidence=0.95):
+    """Return a bootstrap confidence interval for median(b) - median(a)
+
+    Large samples are bootstrapped from a subsample of BOOTSTRAP_MAX_SAMPLES
+    values and the spread is scaled down to the full sample size (the spread
+    of a median shrinks with the square root of the sample size), around the
+    shift of the full samples.
+
+    """
+    shift = float(np.median(b) - np.median(a))
+    sub_a = a
+    if len(a) > BOOTSTRAP_MAX_SAMPLES:
+        sub_a = rng.choice(a, BOOTSTRAP_MAX_SAMPLES, replace=False)
+    sub_b = b
+    if len(b) > BOOTSTRAP_MAX_SAMPLES:
+        sub_b = rng.choice(b, BOOTSTRAP_MAX_SAMPLES, replace=False)
+    scale = math.sqrt((1 / len(a) + 1 / len(b)) / (1 / len(sub_a) + 1 / len(sub_b)))
+
+    indexes_a = rng.integers(0, len(sub_a), (resamples, len(sub_a)))
+    indexes_b = rng.integers(0, len(sub_b), (resamples, len(sub_b)))
+    shifts = np.median(sub_b[indexes_b], axis=1) - np.median(sub_a[indexes_a], axis=1)
+    sub_shift = float(np.median(sub_b) - np.median(sub_a))
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(shifts - sub_shift, [tail, 100 - tail])
+    return shift + float(low) * scale, shift + float(high) * scale
+
+
+def compare(a, b, rng, resamples, alpha=None, min_change=0.0):
+    """Return a dict comparing two samples
+
+    With alpha, the bootstrap is only done if the comparison is significant
+    and the change is at least min_change, since otherwise it can't be flagged;
+    the confidence interval is None when it's skipped.
+
+    """
+    a = np.frombuffer(a, dtype=np.float64)
+    b = np.frombuffer(b, dtype=np.float64)
+    median_a = float(np.median(a))
+    median_b = float(np.median(b))
+    shift = median_b - median_a
+    result = {
+        "n_a": len(a),
+        "n_b": len(b),
+        "median_a": median_a,
+        "median_b": median_b,
+        "shift": shift,
+        "change": shift / median_a if median_a else math.inf if shift else 0.0,
+        "ci": None,
+        "p": mann_whitney(a, b),
+    }
+    if alpha is None or (result["p"] < alpha and abs(result["change"]) >= min_change):
+        result["ci"] = bootstrap_shift(a, b, rng, resamples)
+    return result
+
+
+def verdict(result, alpha, min_change):
+    """Return "slower", "faster", or "" for a comparison"""
+    if result["ci"] is None:
+        return ""
+    if result["p"] >= alpha or abs(result["change"]) < min_change:
+        return ""
+    low, high = result["ci"]
+    if low > 0:
+        return "slower"
+    if high < 0:
+        return "faster"
+    return ""
 
-    # size (int), module, size
-    row = [size, key, sizeof_fmt(size)]
 
-    # aws download
-    row.append(
-        ", ".join(
-            [time_fmt(item) for item in module_aws.get(key, {}).get("download", [])]
-        )
-    )
-    # gcp download
-    row.append(
-        ", ".join(
-            [time_fmt(item) for item in module_gcp.get(key, {}).get("download", [])]
-        )
+def time_fmt(num):
+    return f"{num:,.3f} s"
+
+
+def shift_fmt(num):
+    return f"{num:+,.3f} s"
+
+
+def change_fmt(change):
+    if math.isinf(change):
+        return "new"
+    return f"{change * 100:+,.1f}%"
+
+
+def verdict_fmt(verdict):
+    if verdict == "slower":
+        return "[red]slower[/red]"
+    if verdict == "faster":
+        return "[green]faster[/green]"
+    return ""
+
+
+def comparison_table(title, label):
+    table = Table(title=title, box=box.MARKDOWN, show_edge=False)
+    table.add_column(label, justify="left", no_wrap=True)
+    table.add_column("n", justify="right")
+    table.add_column("Median 1", justify="right")
+    table.add_column("Median 2", justify="right")
+    table.add_column("Shift", justify="right")
+    table.add_column("95% CI", justify="right")
+    table.add_column("Change", justify="right")
+    table.add_column("p", justify="right")
+    table.add_column("", justify="left")
+    return table
+
+
+def add_comparison_row(table, label, result, flag):
+    low, high = result["ci"]
+    table.add_row(
+        label,
+        f"{result['n_a']:,} / {result['n_b']:,}",
+        time_fmt(result["median_a"]),
+        time_fmt(result["median_b"]),
+        shift_fmt(result["shift"]),
+        f"{shift_fmt(low)} .. {shift_fmt(high)}",
+        change_fmt(result["change"]),
+        f"{result['p']:.2g}",
+        verdict_fmt(flag),
     )
 
-    # aws parse
-    row.append(
-        ", ".join(
-            [time_fmt(item) for item in module_aws.get(key, {}).get("parse_sym", [])]
-        )
-    )
-    # gcp parse
-    row.append(
-        ", ".join(
-            [time_fmt(item) for item in module_gcp.get(key, {}).get("parse_sym", [])]
-        )
-    )
 
-    # aws save
-    row.append(
-        ", ".join(
-            [
-                time_fmt(item)
-                for item in module_aws.get(key, {}).get("save_symcache", [])
-            ]
-        )
+@click.command()
+@click.option("--title1", default=None, help="Name of the first session.")
+@click.option("--title2", default=None, help="Name of the second session.")
+@click.option(
+    "--alpha",
+    default=0.01,
+    type=float,
+    help="Significance level; default=0.01",
+)
+@click.option(
+    "--min-change",
+    default=0.05,
+    type=float,
+    help="Smallest change in the median worth flagging, as a fraction; default=0.05",
+)
+@click.option(
+    "--min-samples",
+    default=5,
+    type=int,
+    help="Fewest timings a module needs in both sessions to compare it; default=5",
+)
+@click.option(
+    "--top",
+    default=20,
+    type=int,
+    help="Most flagged modules to show; 0 for all of them; default=20",
+)
+@click.option(
+    "--bootstrap",
+    default=1000,
+    type=int,
+    help="Number of bootstrap resamples; default=1000",
+)
+@click.option("--seed", default=None, type=int, help="Seed for the bootstrap.")
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of processes reading logs; default=number of CPUs",
+)
+@click.argument("baseline")
+@click.argument("candidate")
+def compare_logs(
+    title1,
+    title2,
+    alpha,
+    min_change,
+    min_samples,
+    top,
+    bootstrap,
+    seed,
+    workers,
+    baseline,
+    candidate,
+):
+    """Compare the timings of two symbolication sessions.
+
+    BASELINE and CANDIDATE are each a log or a directory of logs.
+
+    """
+    console = Console()
+    title1 = title1 or os.path.basename(os.path.normpath(baseline))
+    title2 = title2 or os.path.basename(os.path.normpath(candidate))
+    rng = np.random.default_rng(seed)
+
+    (requests1, modules1), (requests2, modules2) = read_sessions(
+        [baseline, candidate], workers
     )
-    # gcp save
-    row.append(
-        ", ".join(
-            [
-                time_fmt(item)
-                for item in module_gcp.get(key, {}).get("save_symcache", [])
-            ]
+    console.print(f"1: {title1}")
+    console.print(f"2: {title2}")
+    console.print()
+
+    # Overall comparisons
+    overall = comparison_table("Overall", "Timing")
+    overall_flags = {}
+    if "latency" not in requests1:
+        console.print("Latency isn't compared, since text logs don't have it")
+        console.print()
+    for metric in REQUEST_METRICS:
+        if len(requests1.get(metric, ())) and len(requests2.get(metric, ())):
+            result = compare(requests1[metric], requests2[metric], rng, bootstrap)
+            overall_flags[metric] = verdict(result, alpha, min_change)
+            add_comparison_row(overall, metric, result, overall_flags[metric])
+    for _, step in MODULE_STEPS:
+        all1 = array("d")
+        all2 = array("d")
+        for values in modules1.get(step, {}).values():
+            all1.extend(values)
+        for values in modules2.get(step, {}).values():
+            all2.extend(values)
+        if len(all1) and len(all2):
+            result = compare(all1, all2, rng, bootstrap)
+            overall_flags[step] = verdict(result, alpha, min_change)
+            add_comparison_row(overall, step, result, overall_flags[step])
+    console.print(overall)
+    console.print()
+
+    # Per-module comparisons
+    pairs = []
+    for _, step in MODULE_STEPS:
+        step1 = modules1.get(step, {})
+        step2 = modules2.get(step, {})
+        for module in step1.keys() & step2.keys():
+            if len(step1[module]) >= min_samples and len(step2[module]) >= min_samples:
+                pairs.append((module, step, step1[module], step2[module]))
+
+    module_alpha = alpha / len(pairs) if pairs else alpha
+    flagged = []
+    for module, step, values1, values2 in pairs:
+        result = compare(
+            values1, values2, rng, bootstrap, alpha=module_alpha, min_change=min_change
         )
+        flag = verdict(result, module_alpha, min_change)
+        if flag:
+            flagged.append((module, step, result, flag))
+
+    # Most total time gained or lost first
+    flagged.sort(key=lambda item: abs(item[2]["shift"]) * item[2]["n_b"], reverse=True)
+    slower_modules = sum(1 for item in flagged if item[3] == "slower")
+    if flagged:
+        modules_table = comparison_table("Modules", "Module")
+        for module, step, result, flag in flagged[:top] if top else flagged:
+            add_comparison_row(modules_table, f"{module} {step}", result, flag)
+        console.print(modules_table)
+        console.print()
+    console.print(
+        f"{len(flagged):,} of {len(pairs):,} module comparisons flagged "
+        + f"({slower_modules:,} slower, {len(flagged) - slower_modules:,} faster)"
     )
+    console.print()
 
-    all_rows.append(row)
-
-
-table = Table(box=box.MARKDOWN, show_lines=False)
-table.add_column("module")
-table.add_column("size")
-
-table.add_column(f"{TITLE1} download")
-table.add_column(f"{TITLE2} download")
-
-table.add_column(f"{TITLE1} parse")
-table.add_column(f"{TITLE2} parse")
-
-table.add_column(f"{TITLE1} save")
-table.add_column(f"{TITLE2} save")
+    # Verdict
+    slower = [metric for metric, flag in overall_flags.items() if flag == "slower"]
+    faster = [metric for metric, flag in overall_flags.items() if flag == "faster"]
+    if slower:
+        console.print(f"[red]REGRESSION[/red]: 2 is slower in {', '.join(slower)}")
+    if faster:
+        console.print(f"[green]IMPROVEMENT[/green]: 2 is faster in {', '.join(faster)}")
+    if not slower and not faster:
+        console.print("NO SIGNIFICANT DIFFERENCE overall")
 
-# Sort the rows by size, reversed
-all_rows.sort(key=lambda item: item[0], reverse=True)
-for row in all_rows:
-    table.add_row(*row[1:])
 
-console.print(table)
+if __name__ == "__main__":
+    compare_logs()
@@ -0,0 +1,79 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Helpers for talking to the Crash Stats API from several threads at once.
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from httpcache import CachingAdapter
+
+
+USER_AGENT = "tecken-loadtests"
+
+# Retry connection errors and these statuses with backoff before giving up
+RETRIES = 3
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def new_session(pool_size=10, cache=None):
+    """Return a requests session for the Crash Stats API
+
+    The session keeps up to pool_size connections open per host, so it can be
+    shared by that many threads without reconnecting, and retries failed
+    requests with backoff.
+
+    :param cache: CachingAdapter arguments from httpcache.open_cache to cache
+        responses on disk; None for no caching
+
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter_kwargs = {
+        "pool_connections": pool_size,
+        "pool_maxsize": pool_size,
+        "max_retries": retry,
+    }
+    if cache:
+        adapter = CachingAdapter(**cache, **adapter_kwargs)
+    else:
+        adapter = HTTPAdapter(**adapter_kwargs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Spaces out calls across threads so there are at most rate per second
+
+    A rate of None or 0 means no limit.
+
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self):
+        """Block until the caller is allowed to make its request"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_time = max(self._next_time, now)
+            self._next_time = send_time + self.interval
+        if send_time > now:
+            time.sleep(send_time - now)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Finds duplicate and near-duplicate stacks in a stacks directory or corpus
+# file and reports how much of the corpus is really distinct.
+#
+# Each stack is canonicalized so frames refer to modules by debug file and id
+# rather than memoryMap position. Stacks with the same canonical form are exact
+# duplicates. Near duplicates have frame sets with a Jaccard similarity of at
+# least --threshold; they're found with MinHash signatures and locality
+# sensitive hashing, so no pairs of stacks are compared directly. Module sets
+# are clustered the same way with --cluster-threshold to show groups of stacks
+# that need the same symbols.
+#
+# Stacks are read and hashed in parallel by --workers processes. Pass result
+# logs from symbolication.py with --sizes to add up the bytes of symbols the
+# modules need. Pass --output to write the stacks that are left after dropping
+# duplicates to a directory or corpus file.
+#
+# Usage: bin/dedupe-stacks.py [--threshold 0.9] [--sizes LOG] [--output OUTPUT]
+#            [--manifest FILE] STACKS
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+import time
+import zlib
+
+import click
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from resultlog import iter_responses
+from stackcorpus import CorpusWriter, StacksDir, open_stacks
+from symstats import sizeof_fmt
+
+
+# Number of stacks a worker reads at a time
+CHUNK_SIZE = 1000
+
+# MinHash signature length; more is more accurate and uses more memory
+NUM_PERM = 128
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# Hash functions (a * x + b) % MERSENNE_PRIME for MinHash; they're the same in
+# every process and every run
+_perm_rng = np.random.default_rng(1)
+PERM_A = _perm_rng.integers(1, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+PERM_B = _perm_rng.integers(0, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def canonical_stack(payload):
+    """Return (canonical bytes, module keys, frame tokens) for a payload
+
+    Module keys are "debug_file/debug_id". Frames are (module key, offset), so
+    the canonical form doesn't depend on the order of the memoryMap.
+
+    """
+    jobs = payload["jobs"] if "jobs" in payload else [payload]
+    modules = {}
+    stacks = []
+    for job in jobs:
+        keys = [
+            f"{debug_file}/{debug_id}"
+            for debug_file, debug_id in job.get("memoryMap", [])
+        ]
+        modules.update(dict.fromkeys(keys))
+        for stack in job.get("stacks", []):
+            stacks.append(
+                [
+                    [keys[index] if 0 <= index < len(keys) else None, offset]
+                    for index, offset in stack
+                ]
+            )
+
+    module_keys = sorted(modules)
+    canonical = json.dumps(
+        {"modules": module_keys, "stacks": stacks}, separators=(",", ":")
+    ).encode("utf-8")
+    frames = {f"{key}+{offset}" for stack in stacks for key, offset in stack}
+    return canonical, module_keys, frames
+
+
+def minhash(tokens):
+    """Return the MinHash signature of a set of strings"""
+    if not tokens:
+        return np.full(NUM_PERM, MAX_HASH, dtype=np.uint32)
+    hashes = np.fromiter(
+        (zlib.crc32(token.encode("utf-8")) for token in tokens),
+        dtype=np.uint64,
+        count=len(tokens),
+    )
+    values = (PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % MERSENNE_PRIME
+    return (values & MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def analyze_stacks(path, start, end):
+    """Canonicalize and hash stacks start to end
+
+    This runs in worker processes.
+
+    :returns: dict with the digests, frame and module signatures, the modules
+        in the chunk, and the numbers of each stack's modules in that list
+
+    """
+    stacks = open_stacks(path)
+    count = end - start
+    digests = []
+    frame_signatures = np.empty((count, NUM_PERM), dtype=np.uint32)
+    module_signatures = np.empty((count, NUM_PERM), dtype=np.uint32)
+    modules = {}
+    stack_modules = []
+    for row, index in enumerate(range(start, end)):
+        canonical, module_keys, frames = canonical_stack(stacks.payload(index))
+        digests.append(hashlib.blake2b(canonical, digest_size=16).digest())
+        frame_signatures[row] = minhash(frames)
+        module_signatures[row] = minhash(module_keys)
+        stack_modules.append(
+            [modules.setdefault(key, len(modules)) for key in module_keys]
+        )
+    return {
+        "start": start,
+        "digests": digests,
+        "frame_signatures": frame_signatures,
+        "module_signatures": module_signatures,
+        "modules": list(modules),
+        "stack_modules": stack_modules,
+    }
+
+
+def lsh_bands(threshold):
+    """Return (bands, rows) whose LSH threshold is closest to threshold"""
+    best = None
+    for rows in range(1, NUM_PERM + 1):
+        bands = NUM_PERM // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def lsh_clusters(signatures, indexes, threshold):
+    """Return {index: index of its cluster's leader} for indexes
+
+    Indexes are taken in order. Each one joins the leader it's most similar to
+    if their estimated Jaccard similarity is at least threshold, or else
+    becomes a leader. Leaders to compare with are the ones sharing a band of
+    the signature. Joining leaders, rather than any similar stack, keeps
+    clusters from chaining dissimilar stacks together.
+
+    """
+    bands, rows = lsh_bands(threshold)
+    band_columns = [
+        np.ascontiguousarray(signatures[:, band * rows : (band + 1) * rows])
+        for band in range(bands)
+    ]
+    buckets = [{} for _ in range(bands)]
+    leaders = {}
+    for index in indexes:
+        keys = [columns[index].tobytes() for columns in band_columns]
+        candidates = sorted(
+            {
+                leader
+                for bucket, key in zip(buckets, keys, strict=True)
+                for leader in bucket.get(key, ())
+            }
+        )
+        leader = index
+        if candidates:
+            matches = np.count_nonzero(
+                signatures[candidates] == signatures[index], axis=1
+            )
+            best = int(np.argmax(matches))
+            if matches[best] / NUM_PERM >= threshold:
+                leader = candidates[best]
+
+        leaders[index] = leader
+        if leader == index:
+            for bucket, key in zip(buckets, keys, strict=True):
+                bucket.setdefault(key, []).append(index)
+
+    return leaders
+
+
+def read_module_sizes(paths):
+    """Return {module key: bytes downloaded} from result logs"""
+    sizes = {}
+    for path in paths:
+        for response in iter_responses(path):
+            downloads = response["debug"].get("downloads") or {}
+            for key, size in (downloads.get("size_per_module") or {}).items():
+                sizes[key] = max(size, sizes.get(key, 0))
+    return sizes
+
+
+def write_stacks(stacks, indexes, output):
+    """Write stacks to a directory if output is one, or else a corpus file"""
+    if os.path.isdir(output):
+        for index in indexes:
+            name = os.path.basename(stacks.name(index))
+            if isinstance(stacks, StacksDir):
+                shutil.copyfile(stacks.name(index), os.path.join(output, name))
+            else:
+                with open(os.path.join(output, name), "wb") as fp:
+                    fp.write(stacks.payload_bytes(index))
+        return
+
+    with CorpusWriter(output) as writer:
+        for index in indexes:
+            name = os.path.basename(stacks.name(index))
+            writer.add_bytes(name, stacks.payload_bytes(index))
+
+
+def module_summary(console, label, indexes, stack_modules, sizes):
+    modules = set()
+    for index in indexes:
+        modules.update(stack_modules[index])
+    counts = sorted(len(stack_modules[index]) for index in indexes)
+    line = (
+        f"{label}: {len(indexes):,} stacks, {len(modules):,} unique modules, "
+        + f"{counts[len(counts) // 2] if counts else 0} modules per stack (50%)"
+    )
+    if sizes is not None:
+        known = [sizes[module] for module in modules if module in sizes]
+        line += (
+            f", {sizeof_fmt(sum(known))} of symbols for the "
+            + f"{len(known):,} with known sizes"
+        )
+    console.print(line)
+
+
+def print_clusters(console, stacks, clusters, stack_modules, sizes, top):
+    members = {}
+    for index, root in clusters.items():
+        members.setdefault(root, []).append(index)
+    ranked = sorted(members.values(), key=len, reverse=True)
+
+    table = Table(show_edge=False, box=box.MARKDOWN)
+    table.add_column("Stacks", justify="right")
+    table.add_column("Share", justify="right")
+    table.add_column("Modules", justify="right")
+    table.add_column("In all", justify="right")
+    if sizes is not None:
+        table.add_column("Symbols", justify="right")
+    table.add_column("Example", justify="left", no_wrap=True)
+
+    for cluster in ranked[:top]:
+        union = set().union(*(stack_modules[index] for index in cluster))
+        common = set.intersection(*(set(stack_modules[index]) for index in cluster))
+        row = [
+            f"{len(cluster):,}",
+            f"{len(cluster) / len(clusters):.1%}",
+            f"{len(union):,}",
+            f"{len(common):,}",
+        ]
+        if sizes is not None:
+            row.append(sizeof_fmt(sum(sizes.get(module, 0) for module in union)))
+        row.append(os.path.basename(stacks.name(cluster[0])))
+        table.add_row(*row)
+
+    console.print(table)
+    singletons = sum(1 for cluster in ranked if len(cluster) == 1)
+    console.print(
+        f"{len(ranked):,} module-set clusters; {singletons:,} stacks are in "
+        + "clusters of their own"
+    )
+
+
+@click.command()
+@click.option(
+    "--threshold",
+    default=0.9,
+    type=click.FloatRange(0, 1, min_open=True),
+    help=(
+        "Jaccard similarity of frames at which stacks are near duplicates; "
+        + "default=0.9"
+    ),
+)
+@click.option(
+    "--cluster-threshold",
+    default=0.5,
+    type=click.FloatRange(0, 1, min_open=True),
+    help="Jaccard similarity of module sets for clustering; default=0.5",
+)
+@click.option(
+    "--sizes",
+    multiple=True,
+    help="Result log from symbolication.py to get module sizes from; repeatable",
+)
+@click.option(
+    "--top",
+    default=10,
+    type=int,
+    help="Number of module-set clusters to show; default=10",
+)
+@click.option(
+    "--output",
+    default=None,
+    help=(
+        "Write the stacks left after dropping duplicates to this directory (if "
+        + "it exists) or corpus file"
+    ),
+)
+@click.option(
+    "--manifest",
+    default=None,
+    help="Write what happened to each stack to this JSONL file",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of processes reading stacks; default=number of CPUs",
+)
+@click.argument("stacks_path")
+def dedupe_stacks(
+    threshold,
+    cluster_threshold,
+    sizes,
+    top,
+    output,
+    manifest,
+    workers,
+    stacks_path,
+):
+    console = Console()
+    start_time = time.perf_counter()
+
+    stacks = open_stacks(stacks_path)
+    count = len(stacks)
+    if not count:
+        console.print(f"No stacks in {stacks_path}")
+        return
+
+    digests = [None] * count
+    frame_signatures = np.empty((count, NUM_PERM), dtype=np.uint32)
+    module_signatures = np.empty((count, NUM_PERM), dtype=np.uint32)
+    module_numbers = {}
+    stack_modules = [None] * count
+
+    def handle(result):
+        start = result["start"]
+        end = start + len(result["digests"])
+        digests[start:end] = result["digests"]
+        frame_signatures[start:end] = result["frame_signatures"]
+        module_signatures[start:end] = result["module_signatures"]
+        numbers = [
+            module_numbers.setdefault(key, len(module_numbers))
+            for key in result["modules"]
+        ]
+        for offset, local in enumerate(result["stack_modules"]):
+            stack_modules[start + offset] = [numbers[number] for number in local]
+
+    ranges = [
+        (start, min(start + CHUNK_SIZE, count)) for start in range(0, count, CHUNK_SIZE)
+    ]
+    with console.status(f"Reading {count:,} stacks..."):
+        if workers > 1 and len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(
+                    analyze_stacks,
+                    [stacks_path] * len(ranges),
+                    *zip(*ranges, strict=True),
+                ):
+                    handle(result)
+        else:
+            for start, end in ranges:
+                handle(analyze_stacks(stacks_path, start, end))
+    console.print(f"Read {count:,} stacks in {time.perf_counter() - start_time:.2f}s")
+
+    # Exact duplicates: the first stack with a digest is kept
+    duplicate_of = {}
+    first_with_digest = {}
+    for index, digest in enumerate(digests):
+        first = first_with_digest.setdefault(digest, index)
+        if first != index:
+            duplicate_of[index] = (first, "exact")
+    distinct = [index for index in range(count) if index not in duplicate_of]
+
+    # Near duplicates of the distinct stacks: cluster leaders are kept
+    near = lsh_clusters(frame_signatures, distinct, threshold)
+    for index, root in near.items():
+        if root != index:
+            duplicate_of[index] = (root, "near")
+    kept = [index for index in range(count) if index not in duplicate_of]
+
+    exact = sum(1 for _, kind in duplicate_of.values() if kind == "exact")
+    console.print(
+        f"{exact:,} exact duplicates, {len(duplicate_of) - exact:,} near "
+        + f"duplicates (frames {threshold:.0%} similar); {len(kept):,} stacks left "
+        + f"({len(kept) / count:.1%})"
+    )
+
+    module_sizes = None
+    if sizes:
+        sizes_by_key = read_module_sizes(sizes)
+        module_sizes = {
+            module_numbers[key]: size
+            for key, size in sizes_by_key.items()
+            if key in module_numbers
+        }
+        console.print(
+            f"Got sizes of {len(sizes_by_key):,} modules from {len(sizes)} logs"
+        )
+
+    console.print()
+    module_summary(console, "All", list(range(count)), stack_modules, module_sizes)
+    module_summary(console, "Left", kept, stack_modules, module_sizes)
+    console.print()
+
+    clusters = lsh_clusters(module_signatures, kept, cluster_threshold)
+    print_clusters(console, stacks, clusters, stack_modules, module_sizes, top)
+
+    if manifest:
+        cluster_numbers = {}
+        with open(manifest, "w") as fp:
+            for index in range(count):
+                entry = {"name": os.path.basename(stacks.name(index))}
+                if index in duplicate_of:
+                    first, kind = duplicate_of[index]
+                    entry["status"] = kind
+                    entry["duplicate_of"] = os.path.basename(stacks.name(first))
+                else:
+                    entry["status"] = "kept"
+                    root = clusters[index]
+                    entry["cluster"] = cluster_numbers.setdefault(
+                        root, len(cluster_numbers)
+                    )
+                fp.write(json.dumps(entry) + "\n")
+        console.print(f"Manifest saved to {manifest}")
+
+    if output:
+        write_stacks(stacks, kept, output)
+        console.print(f"{len(kept):,} stacks saved to {output}")
+
+
+if __name__ == "__main__":
+    dedupe_stacks()
@@ -0,0 +1,189 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Fake symbol files and the bits for streaming them into upload zips.
+#
+# Used by the upload Locust test and make-fake-symbol-zips.py. Everything is
+# generated from a seed, so the same seed makes the same file.
+
+from datetime import datetime
+import os
+import random
+import textwrap
+from typing import BinaryIO, Optional
+import zipfile
+
+
+FILE_NAME_PREFIX = "tecken-system-tests-"
+
+# Roughly how much FakeSymFile content shrinks when deflated
+SYM_COMPRESSION_RATIO = 0.57
+
+PLATFORMS = ["linux", "mac", "windows"]
+
+
+class Random(random.Random):
+    def hex_str(self, length: int) -> str:
+        return self.randbytes((length + 1) // 2)[:length].hex()
+
+
+class FakeSymFile:
+    DEBUG_FILE_EXTENSIONS = {
+        "linux": ".so",
+        "mac": ".dylib",
+        "windows": ".pdb",
+    }
+    NONSENSE_DIRECTIVES = [
+        "FLIBBERWOCK",
+        "ZINDLEFUMP",
+        "GRUMBLETOCK",
+        "SNORFLEQUIN",
+        "WIBBLESNATCH",
+        "BLORPTANGLE",
+    ]
+
+    def __init__(self, size: int, platform: str, seed: Optional[int] = None):
+        self.size = size
+        self.platform = platform
+        self.seed = seed or random.getrandbits(64)
+
+        rng = Random(self.seed)
+        self.arch = rng.choice(["aarch64", "x86", "x86_64"])
+        self.debug_id = rng.hex_str(33).upper()
+        self.debug_file = (
+            FILE_NAME_PREFIX
+            + rng.hex_str(16)
+            + self.DEBUG_FILE_EXTENSIONS[self.platform]
+        )
+        self.sym_file = self.debug_file.removesuffix(".pdb") + ".sym"
+        if self.platform == "windows":
+            self.code_file = self.debug_file.removesuffix(".pdb") + ".dll"
+        else:
+            self.code_file = ""
+        self.code_id = rng.hex_str(16).upper()
+        self.build_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def key(self) -> str:
+        return f"{self.debug_file}/{self.debug_id}/{self.sym_file}"
+
+    def code_info_key(self) -> str:
+        return f"{self.code_file}/{self.code_id}/{self.sym_file}"
+
+    def header(self) -> bytes:
+        return textwrap.dedent(f"""\
+            MODULE {self.platform} {self.arch} {self.debug_id} {self.debug_file}
+            INFO CODE_ID {self.code_id} {self.code_file}
+            INFO RELEASECHANNEL nightly
+            INFO VERSION 130.0
+            INFO VENDOR Mozilla
+            INFO PRODUCTNAME Firefox
+            INFO BUILDID {self.build_id}
+            INFO GENERATOR tecken-system-tests 1.0
+            """).encode()
+
+    def write(self, file: BinaryIO):
+        header = self.header()
+        file.write(header)
+        written = len(header)
+        rng = Random(self.seed)
+        while written < self.size:
+            line = f"{rng.choice(self.NONSENSE_DIRECTIVES)} {rng.hex_str(16_384)}\n".encode()
+            # The last line is cut short so the file is exactly size bytes
+            if written + len(line) > self.size:
+                line = line[: self.size - written - 1] + b"\n"
+            file.write(line)
+            written += len(line)
+
+
+class FakeBinaryFile(FakeSymFile):
+    """A file that isn't a sym file, like a compressed pdb ("xul.pd_")
+
+    With paired, it's stored next to that sym file, under the same debug file
+    and debug id; otherwise it gets a debug file of its own. It's random bytes,
+    so it doesn't compress, like the real thing.
+
+    """
+
+    def __init__(
+        self,
+        size: int,
+        platform: str,
+        extension: str,
+        seed: Optional[int] = None,
+        paired: Optional[FakeSymFile] = None,
+    ):
+        super().__init__(size, platform, seed=seed)
+        self.extension = extension
+        if paired is not None:
+            self.platform = paired.platform
+            self.debug_file = paired.debug_file
+            self.debug_id = paired.debug_id
+
+    def key(self) -> str:
+        stem = self.debug_file.removesuffix(self.DEBUG_FILE_EXTENSIONS[self.platform])
+        return f"{self.debug_file}/{self.debug_id}/{stem}{self.extension}"
+
+    def write(self, file: BinaryIO):
+        rng = Random(self.seed)
+        written = 0
+        while written < self.size:
+            data = rng.randbytes(min(65_536, self.size - written))
+            file.write(data)
+            written += len(data)
+
+
+def format_file_size(size: int) -> str:
+    for factor, unit in [(2**30, "GiB"), (2**20, "MiB"), (2**10, "KiB")]:
+        if size >= factor:
+            return f"{size / factor:.1f} {unit}"
+    return f"{size} bytes"
+
+
+def write_member(zip: zipfile.ZipFile, fake_file: FakeSymFile):
+    """Stream a fake file into a new zip entry"""
+    force_zip64 = fake_file.size >= zipfile.ZIP64_LIMIT
+    with zip.open(fake_file.key(), "w", force_zip64=force_zip64) as member_f:
+        fake_file.write(member_f)
+
+
+def write_archive(
+    file_name: str, size: int, sym_file_size: int, platform: str, seed: int
+) -> list[FakeSymFile]:
+    """Write a zip of fake sym files that's at least size bytes
+
+    Members are streamed into their zip entries without temporary files. This
+    runs in worker processes.
+
+    :returns: the sym files in the archive
+
+    """
+    rng = Random(seed)
+    members = []
+    with open(file_name, "wb") as f:
+        with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as zip:
+            while f.tell() < size:
+                sym_file = FakeSymFile(
+                    sym_file_size, platform, seed=rng.getrandbits(64)
+                )
+                members.append(sym_file)
+                write_member(zip, sym_file)
+    return members
+
+
+def platform_for(path: str) -> Optional[str]:
+    """Return the platform for a symbols path by its debug file's extension
+
+    Returns None when the extension doesn't say, like for "firefox" or "XUL".
+
+    """
+    parts = path.split(",", 1)[-1].split("/")
+    if parts and parts[0] == "v1":
+        parts = parts[1:]
+    if len(parts) < 3:
+        return None
+    extension = os.path.splitext(parts[0])[1]
+    for platform, debug_extension in FakeSymFile.DEBUG_FILE_EXTENSIONS.items():
+        if extension == debug_extension:
+            return platform
+    return None
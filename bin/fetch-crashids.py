@@ -6,17 +6,25 @@
 
 # Fetch crash ids for Firefox nightly from Crash Stats.
 #
-# Usage: ./bin/fetch-crashids.py
+# Usage: ./bin/fetch-crashids.py [--num-results N] [--parallel N] [--rate R]
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 import click
-import requests
+
+from crashstats import RateLimiter, new_session
+from httpcache import cache_options, cache_summary, open_cache
 
 
 CRASHSTATS = "https://crash-stats.mozilla.org/"
 MAX_PAGE = 1000
 
+# Meh crash reports are skipped, so this many times as many results as were
+# asked for are fetched ahead; more are fetched as needed
+RESULTS_MARGIN = 1.5
+
 # Indicators that the crash report probably doesn't have a good stack for
 # symbolication
 MEH_INDICATORS = [
@@ -34,33 +42,81 @@ def is_meh(signature):
     return False
 
 
-def fetch_supersearch(url, params):
-    headers = {"User-Agent": "tecken-systemtests"}
-    # Set up first page
-    params["_results_offset"] = 0
-    params["_results_number"] = MAX_PAGE
+def fetch_page(session, url, params, offset, number, rate_limiter=None):
+    """Fetch one page of Super Search results
 
-    crashids_count = 0
-    while True:
-        resp = requests.get(url=url, params=params, headers=headers)
-        hits = resp.json()["hits"]
+    :returns: the response JSON as a dict
 
-        yield from hits
+    """
+    params = dict(params, _results_offset=offset, _results_number=number)
+    if rate_limiter is not None:
+        rate_limiter.wait()
+    resp = session.get(url=url, params=params, timeout=60)
+    resp.raise_for_status()
+    return resp.json()
 
-        # If there are no more crash ids to get, we return
-        total = resp.json()["total"]
-        if not hits or crashids_count >= total:
-            return
 
-        # Get the next page, but only as many results as we need
-        params["_results_offset"] += MAX_PAGE
-        params["_results_number"] = min(
-            # MAX_PAGE is the maximum we can request
-            MAX_PAGE,
-            # The number of results Super Search can return to us that is
-            # hasn't returned so far
-            total - crashids_count,
+def fetch_supersearch(
+    session, url, params, parallel=4, prefetch=8, limit=None, rate_limiter=None
+):
+    """Yield Super Search hits in order
+
+    The first page says how many results there are. The rest of the pages are
+    fetched by parallel threads, up to prefetch pages ahead of the one being
+    yielded, and yielded in order as they come in. Nothing past the first page
+    is fetched until the caller has gone through it, and if the caller stops
+    early, pages that haven't been fetched yet are cancelled.
+
+    With a limit, only that many results are fetched ahead; results past it are
+    fetched a page at a time as the caller gets to them.
+
+    """
+    fetch_args = (session, url, params)
+    number = MAX_PAGE if limit is None else max(1, min(MAX_PAGE, limit))
+    data = fetch_page(*fetch_args, 0, number, rate_limiter)
+    yield from data["hits"]
+
+    total = data["total"]
+    if not data["hits"]:
+        return
+    next_offset = len(data["hits"])
+
+    executor = ThreadPoolExecutor(max_workers=parallel)
+    pending = deque()
+
+    def submit_next(ahead=True):
+        nonlocal next_offset
+        if next_offset >= total:
+            return
+        # Only ask for as many results as there are left
+        number = min(MAX_PAGE, total - next_offset)
+        if limit is not None and ahead:
+            if next_offset >= limit:
+                return
+            number = min(number, limit - next_offset)
+        pending.append(
+            executor.submit(fetch_page, *fetch_args, next_offset, number, rate_limiter)
         )
+        next_offset += number
+
+    try:
+        for _ in range(max(prefetch, parallel)):
+            submit_next()
+
+        while True:
+            if not pending:
+                submit_next(ahead=False)
+                if not pending:
+                    return
+            hits = pending.popleft().result()["hits"]
+            submit_next()
+            yield from hits
+            # The results shrank while paging, so there's nothing past an
+            # empty page
+            if not hits:
+                return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 @click.command()
@@ -75,31 +131,88 @@ def fetch_supersearch(url, params):
     type=int,
     help="Number of crash ids to return.",
 )
+@click.option(
+    "--parallel",
+    default=4,
+    type=int,
+    help="Number of Super Search pages to fetch at the same time.",
+)
+@click.option(
+    "--prefetch",
+    default=8,
+    type=int,
+    help="Number of Super Search pages to fetch ahead of the ones being printed.",
+)
+@click.option(
+    "--rate",
+    default=None,
+    type=float,
+    help="Maximum number of Super Search requests per second.",
+)
+@click.option(
+    "--api-url",
+    default=urljoin(CRASHSTATS, "/api/SuperSearch/"),
+    help="URL for the Super Search API.",
+)
+@cache_options
 @click.pass_context
-def fetch_crashids(ctx, debug, num_results):
+def fetch_crashids(
+    ctx,
+    debug,
+    num_results,
+    parallel,
+    prefetch,
+    rate,
+    api_url,
+    cache_dir,
+    cache_max_size,
+    cache_ttl,
+    offline,
+):
     params = {
         "product": "Firefox",
         "release_channel": "nightly",
         "_columns": ["uuid", "signature"],
         "_sort": ["-date"],
     }
-    url = urljoin(CRASHSTATS, "/api/SuperSearch/")
-
-    crashids = 0
-    for result in fetch_supersearch(url=url, params=params):
+    cache = open_cache(cache_dir, cache_max_size, cache_ttl, offline)
+    session = new_session(pool_size=parallel, cache=cache)
+    # Offline runs never touch the network, so there's nothing to rate limit
+    rate_limiter = RateLimiter(None if offline else rate)
+
+    seen = set()
+    results = fetch_supersearch(
+        session,
+        url=api_url,
+        params=params,
+        parallel=parallel,
+        prefetch=prefetch,
+        limit=int(num_results * RESULTS_MARGIN),
+        rate_limiter=rate_limiter,
+    )
+    for result in results:
         # Skip crash reports that probably have meh stacks
         if is_meh(result["signature"]):
             continue
 
+        # New crash reports can push results onto the next page while paging,
+        # so the same crash id can show up twice
+        if result["uuid"] in seen:
+            continue
+        seen.add(result["uuid"])
+
         if debug:
             print(result)
         else:
             print(result["uuid"])
 
-        crashids += 1
-        if crashids > num_results:
+        if len(seen) >= num_results:
             break
 
+    results.close()
+    if cache:
+        click.echo(cache_summary(session), err=True)
+
 
 if __name__ == "__main__":
     fetch_crashids()
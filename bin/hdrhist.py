@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Fixed-memory, mergeable histograms in the style of HdrHistogram.
+#
+# Values are bucketed log-linearly: every power-of-two range is split into the
+# same number of linear sub-buckets, so percentiles are accurate to the given
+# number of significant figures no matter how many values are recorded.
+
+import math
+
+
+class HistogramMismatchError(Exception):
+    pass
+
+
+class Histogram:
+    """Histogram of non-negative values with bounded relative error
+
+    :param significant_figures: decimal digits of precision to keep
+    :param scale: values are multiplied by this and rounded to integers before
+        they're bucketed; for example, use 1_000_000 to keep times in seconds
+        with microsecond resolution
+
+    """
+
+    def __init__(self, significant_figures=3, scale=1):
+        self.significant_figures = significant_figures
+        self.scale = scale
+
+        self._sub_bucket_bits = math.ceil(math.log2(2 * 10**significant_figures))
+        self._sub_bucket_count = 1 << self._sub_bucket_bits
+        self._sub_bucket_half_count = self._sub_bucket_count >> 1
+
+        # bucket index -> count; the number of buckets is bounded by the range
+        # of values rather than by how many values are recorded
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self._sub_bucket_bits)
+        return shift * self._sub_bucket_half_count + (value >> shift)
+
+    def _highest_in_bucket(self, index):
+        if index < self._sub_bucket_count:
+            return index
+        shift = (index - self._sub_bucket_count) // self._sub_bucket_half_count + 1
+        sub_bucket = index - shift * self._sub_bucket_half_count
+        return (sub_bucket << shift) + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        """Record value count times"""
+        if value < 0:
+            raise ValueError(f"can't record negative value {value!r}")
+
+        index = self._index(round(value * self.scale))
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add all values recorded in other to this histogram"""
+        if (self.significant_figures, self.scale) != (
+            other.significant_figures,
+            other.scale,
+        ):
+            raise HistogramMismatchError(
+                "can't merge histograms with different precision or scale"
+            )
+
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Return the value at or below which percent of the values fall"""
+        if not self.count:
+            return 0.0
+
+        target = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                value = self._highest_in_bucket(index) / self.scale
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Return a JSON-serializable dict of this histogram"""
+        return {
+            "significant_figures": self.significant_figures,
+            "scale": self.scale,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "counts": {str(index): count for index, count in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls(significant_figures=data["significant_figures"], scale=data["scale"])
+        hist.counts = {int(index): count for index, count in data["counts"].items()}
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        return hist
@@ -0,0 +1,158 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# On-disk cache for GET responses from the Crash Stats API.
+#
+# CachingAdapter is a requests transport adapter, so code using a session
+# doesn't change. Successful GET responses are kept in a ContentStore keyed by
+# the URL with its query parameters sorted. Entries older than the TTL are
+# fetched again. In offline mode, nothing is fetched and a request that's not
+# in the cache raises CacheMiss.
+
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import click
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from castore import ContentStore, parse_size
+
+
+class CacheMiss(requests.exceptions.ConnectionError):
+    """Raised in offline mode for requests that aren't in the cache"""
+
+
+def cache_key(url):
+    """Return the cache key for a url; the order of query parameters is ignored"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return "GET " + urlunsplit(parts._replace(query=query, fragment=""))
+
+
+class CachingAdapter(HTTPAdapter):
+    """HTTPAdapter that serves GET requests from a ContentStore
+
+    :param store: the ContentStore to keep responses in
+    :param ttl: seconds a cached response is good for; None for forever
+    :param offline: if True, only serve from the cache
+
+    Other arguments are passed to HTTPAdapter.
+
+    """
+
+    def __init__(self, store, ttl=None, offline=False, **kwargs):
+        self.store = store
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            return super().send(request, **kwargs)
+
+        key = cache_key(request.url)
+        entry = self.store.info(key)
+        if entry is not None and (self.ttl is None or entry.age() <= self.ttl):
+            data = self.store.get(key)
+            if data is not None:
+                self.hits += 1
+                return self.build_cached_response(request, data, entry.meta or {})
+
+        if self.offline:
+            raise CacheMiss(f"{request.url} is not in the cache", request=request)
+
+        self.misses += 1
+        resp = super().send(request, **kwargs)
+        if resp.status_code == 200:
+            meta = {
+                "content_type": resp.headers.get("Content-Type"),
+                "fetched": time.time(),
+            }
+            self.store.put(key, resp.content, meta=meta)
+        return resp
+
+    def build_cached_response(self, request, data, meta):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.reason = "OK"
+        resp.url = request.url
+        resp.request = request
+        resp.encoding = "utf-8"
+        resp.headers = CaseInsensitiveDict(
+            {"Content-Type": meta.get("content_type") or "application/json"}
+        )
+        resp.headers["X-Cache"] = "HIT"
+        resp._content = data
+        resp.connection = self
+        return resp
+
+
+CACHE_OPTIONS = [
+    click.option(
+        "--cache-dir",
+        default=None,
+        help="Directory to cache API responses in; no caching if not set.",
+    ),
+    click.option(
+        "--cache-max-size",
+        default=None,
+        help='Size budget for the cache, like "500M" or "2G"; no limit if not set.',
+    ),
+    click.option(
+        "--cache-ttl",
+        default=None,
+        type=float,
+        help="Seconds a cached response is used for; forever if not set.",
+    ),
+    click.option(
+        "--offline/--no-offline",
+        default=False,
+        help="Only use cached responses; requires --cache-dir.",
+    ),
+]
+
+
+def cache_options(func):
+    """Add the options for configuring a response cache to a click command
+
+    The command gets cache_dir, cache_max_size, cache_ttl, and offline
+    arguments to pass to open_cache.
+
+    """
+    for option in reversed(CACHE_OPTIONS):
+        func = option(func)
+    return func
+
+
+def open_cache(cache_dir, cache_max_size, cache_ttl, offline):
+    """Return CachingAdapter arguments for cache_options values
+
+    :returns: dict of store, ttl, and offline, or None if cache_dir isn't set
+
+    """
+    if offline and not cache_dir:
+        raise click.UsageError("--offline requires --cache-dir.")
+    if not cache_dir:
+        return None
+    return {
+        "store": ContentStore(cache_dir, max_size=parse_size(cache_max_size)),
+        "ttl": cache_ttl,
+        "offline": offline,
+    }
+
+
+def cache_summary(session):
+    """Return a line about cache hits and misses for a session, or None"""
+    adapter = session.get_adapter("https://")
+    if not isinstance(adapter, CachingAdapter):
+        return None
+    keys, _, size = adapter.store.stats()
+    return (
+        f"Cache: {adapter.hits:,} hits, {adapter.misses:,} misses; "
+        + f"{keys:,} responses, {size:,} bytes in {adapter.store.root}"
+    )
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Makes a set of upload test zips of fake symbol files, without the network.
+#
+# Bundles are sampled from symbols-uploaded/ and each zip copies a bundle's
+# profile: its size, how many files it has, which platform each file is for
+# (by the debug file's extension), and which files are sym files and which are
+# compressed binaries like "xul.pd_". The sizes of individual files aren't in
+# symbols-uploaded/, so they're drawn from a lognormal distribution and scaled
+# to add up to the bundle's size once compressed. The content comes from
+# FakeSymFile, so uploads don't clash with real symbols.
+#
+# Zips are generated in parallel, one per worker process, and a manifest.jsonl
+# in OUTPUTDIR says which bundle each one is modelled on.
+#
+# Usage: ./bin/make-fake-symbol-zips.py [OPTIONS] OUTPUTDIR
+
+from collections import Counter
+import concurrent.futures
+import json
+import os
+import time
+import zipfile
+
+import click
+
+from castore import parse_size
+from fakesyms import (
+    FILE_NAME_PREFIX,
+    SYM_COMPRESSION_RATIO,
+    FakeBinaryFile,
+    FakeSymFile,
+    Random,
+    format_file_size,
+    platform_for,
+    write_member,
+)
+from symbolsindex import SYMBOLS_UPLOADED_DIR, SymbolsIndex
+
+
+# Spread of file sizes within a bundle; bundles have a few big files, like
+# libxul's, and lots of small ones
+MEMBER_SIZE_SIGMA = 2.0
+
+# Smallest file to generate
+MIN_MEMBER_SIZE = 1024
+
+# Platform names in the "...-symbols.txt" file that bundles have
+BUNDLE_PLATFORMS = {"-Linux-": "linux", "-Darwin-": "mac", "-WINNT-": "windows"}
+
+
+def bundle_profile(bundle):
+    """Return the profile of a symbols-uploaded bundle
+
+    :returns: dict with the bundle's id, date, size, and files as
+        (kind, platform, extension, pair) tuples where kind is "sym" or
+        "binary" and pair is the index of the sym file a binary is stored next
+        to, or None
+
+    """
+    paths = bundle["content"].get("added", []) + bundle["content"].get("existed", [])
+
+    default_platform = None
+    for path in paths:
+        for marker, platform in BUNDLE_PLATFORMS.items():
+            if marker in path:
+                default_platform = platform
+    if default_platform is None:
+        known = Counter(filter(None, (platform_for(path) for path in paths)))
+        default_platform = known.most_common(1)[0][0] if known else "linux"
+
+    files = []
+    directories = []
+    for path in paths:
+        parts = path.split(",", 1)[-1].split("/")
+        if len(parts) < 4:
+            # Not a symbol file, like "v1/firefox-...-symbols.txt"
+            continue
+        extension = os.path.splitext(parts[-1])[1]
+        kind = "sym" if extension == ".sym" else "binary"
+        files.append([kind, platform_for(path) or default_platform, extension, None])
+        directories.append(tuple(parts[-3:-1]))
+
+    # Binaries go with the sym file of the same debug file and debug id
+    sym_files = {
+        directory: index
+        for index, (directory, file) in enumerate(zip(directories, files, strict=True))
+        if file[0] == "sym"
+    }
+    for directory, file in zip(directories, files, strict=True):
+        if file[0] == "binary":
+            file[3] = sym_files.get(directory)
+
+    return {
+        "id": bundle.get("id"),
+        "date": bundle["date"],
+        "size": bundle["size"],
+        "files": [tuple(file) for file in files],
+    }
+
+
+def plan_archive(profile, scale, seed):
+    """Return the plan for a zip modelled on a bundle profile
+
+    :arg scale: multiplies the bundle's size
+    :arg seed: seed for the file sizes and content
+
+    """
+    rng = Random(seed)
+    files = profile["files"]
+    weights = [rng.lognormvariate(0, MEMBER_SIZE_SIGMA) for _ in files]
+    total_weight = sum(weights) or 1
+    target_size = int(profile["size"] * scale)
+
+    members = []
+    for (kind, platform, extension, pair), weight in zip(files, weights, strict=True):
+        compressed_size = target_size * weight / total_weight
+        ratio = SYM_COMPRESSION_RATIO if kind == "sym" else 1.0
+        size = max(MIN_MEMBER_SIZE, int(compressed_size / ratio))
+        members.append((kind, size, platform, extension, rng.getrandbits(64), pair))
+
+    return {
+        "name": FILE_NAME_PREFIX + rng.hex_str(16) + ".zip",
+        "bundle_id": profile["id"],
+        "bundle_date": profile["date"],
+        "bundle_size": profile["size"],
+        "target_size": target_size,
+        "members": members,
+    }
+
+
+def make_archive(plan, outputdir):
+    """Write the zip for a plan into outputdir
+
+    This runs in the worker processes.
+
+    :returns: (size of the zip, seconds it took)
+
+    """
+    start_time = time.perf_counter()
+    filepath = os.path.join(outputdir, plan["name"])
+    partial_filepath = filepath + ".partial"
+    try:
+        with open(partial_filepath, "wb") as f:
+            with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as zip:
+                # Sym files are made first so binaries can go next to theirs
+                fake_files = [
+                    FakeSymFile(size, platform, seed=seed) if kind == "sym" else None
+                    for kind, size, platform, _, seed, _ in plan["members"]
+                ]
+                for index, member in enumerate(plan["members"]):
+                    kind, size, platform, extension, seed, pair = member
+                    if kind != "sym":
+                        fake_files[index] = FakeBinaryFile(
+                            size,
+                            platform,
+                            extension,
+                            seed=seed,
+                            paired=None if pair is None else fake_files[pair],
+                        )
+                    write_member(zip, fake_files[index])
+        os.replace(partial_filepath, filepath)
+    except BaseException:
+        if os.path.exists(partial_filepath):
+            os.remove(partial_filepath)
+        raise
+    return os.path.getsize(filepath), time.perf_counter() - start_time
+
+
+@click.command()
+@click.option(
+    "--count", default=10, type=int, help="Number of zips to make (default 10)."
+)
+@click.option(
+    "--min-size", default=None, help='Smallest bundle to sample, like "200m".'
+)
+@click.option("--max-size", default=None, help='Largest bundle to sample, like "2g".')
+@click.option(
+    "--scale",
+    default=1.0,
+    type=float,
+    help="Multiply bundle sizes by this, like 0.01 for small local runs (default 1).",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for picking bundles and generating files (default random).",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of zips to generate at the same time (default number of CPUs).",
+)
+@click.option(
+    "--symbols-dir",
+    default=SYMBOLS_UPLOADED_DIR,
+    help="Directory of symbols-uploaded .json.gz files.",
+)
+@click.argument("outputdir")
+def make_fake_symbol_zips(
+    count, min_size, max_size, scale, seed, workers, symbols_dir, outputdir
+):
+    """Make upload test zips modelled on the bundles in symbols-uploaded/."""
+    index = SymbolsIndex.open(symbols_dir)
+    rows = index.select(parse_size(min_size), parse_size(max_size))
+    if not rows:
+        raise click.UsageError("no bundles in symbols-uploaded match the sizes")
+
+    # Bundles are picked with replacement, so the set has the same mix of
+    # sizes as the bundles it's picked from
+    rng = Random(seed)
+    picked = [rng.choice(rows) for _ in range(count)]
+    profiles = {
+        row: bundle_profile(bundle) for row, bundle in index.bundles(set(picked))
+    }
+    plans = [plan_archive(profiles[row], scale, rng.getrandbits(64)) for row in picked]
+
+    os.makedirs(outputdir, exist_ok=True)
+    start_time = time.perf_counter()
+    total_size = 0
+    with open(os.path.join(outputdir, "manifest.jsonl"), "a") as manifest:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            future_to_plan = {
+                executor.submit(make_archive, plan, outputdir): plan for plan in plans
+            }
+            for i, future in enumerate(
+                concurrent.futures.as_completed(future_to_plan), 1
+            ):
+                plan = future_to_plan[future]
+                size, took = future.result()
+                total_size += size
+                manifest.write(
+                    json.dumps(
+                        {
+                            "file": plan["name"],
+                            "size": size,
+                            "files": len(plan["members"]),
+                            "bundle_id": plan["bundle_id"],
+                            "bundle_date": plan["bundle_date"],
+                            "bundle_size": plan["bundle_size"],
+                            "target_size": plan["target_size"],
+                            "seconds": round(took, 3),
+                        }
+                    )
+                    + "\n"
+                )
+                manifest.flush()
+                print(
+                    f"[{i}/{len(plans)}] {plan['name']}: "
+                    + f"{format_file_size(size)} "
+                    + f"(target {format_file_size(plan['target_size'])}), "
+                    + f"{len(plan['members']):,} files, {took:.1f}s"
+                )
+
+    took = time.perf_counter() - start_time
+    print(
+        f"Made {len(plans)} zips, {format_file_size(total_size)} in {took:.1f}s "
+        + f"({format_file_size(int(total_size / took) if took else 0)}/s)"
+    )
+
+
+if __name__ == "__main__":
+    make_fake_symbol_zips()
@@ -5,39 +5,79 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 # Fetches processed crash data for given crash ids and generates
-# stacks for use with the Symbolication API. This has two modes:
+# stacks for use with the Symbolication API. This has six modes:
 #
 # * print: prints the stack for a single crash id to stdout
 # * save: saves one or more stacks for specified crash ids to the file
 #   system
+# * bulk: converts processed crashes already on disk to stacks
+# * pack: packs a directory of stacks into a single corpus file
+# * learn: learns a model of the stacks in a stacks directory or corpus file
+# * synthesize: generates any number of stacks like the ones a model was
+#   learned from
 #
 # Usage: ./bin/make-stacks.py print [CRASHID]
 #
-# Usage: ./bin/make-stacks.py save [OUTPUTDIR] [CRASHID] [CRASHID...]
+# Usage: ./bin/make-stacks.py save [--parallel N] [--rate R] [OUTPUTDIR] [CRASHID...]
+#
+# Usage: ./bin/make-stacks.py bulk [--workers N] [INPUT...] [OUTPUT]
+#
+# Usage: ./bin/make-stacks.py pack [STACKSDIR] [CORPUSFILE]
+#
+# Usage: ./bin/make-stacks.py learn [--workers N] [STACKS] [MODELFILE]
+#
+# Usage: ./bin/make-stacks.py synthesize [--count N] [--seed N] [MODEL] [OUTPUT]
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import datetime
+import gzip
+import itertools
 import json
 import os
+import random
 import sys
+import time
 
 import click
-import requests
+
+from crashstats import RateLimiter, new_session
+from httpcache import cache_options, cache_summary, open_cache
+from stackcorpus import (
+    CorpusFormatError,
+    CorpusWriter,
+    encode_payload,
+    open_stacks,
+    pack_stacks,
+)
+from stackmodel import ModelError, StackModel, StackSynthesizer
 
 
 PROCESSED_CRASH_API = "https://crash-stats.mozilla.org/api/ProcessedCrash/"
 
+# Number of processed crashes a bulk worker converts at a time
+BULK_CHUNK_SIZE = 500
+
+# Number of stacks a synthesize worker generates at a time; each chunk has its
+# own seed, so the output doesn't depend on the number of workers
+SYNTHESIZE_CHUNK_SIZE = 1000
+
+# StackSynthesizer for synthesize workers; set up by init_synthesizer
+SYNTHESIZER = None
 
-def fetch_crash_report(crashid):
+
+def fetch_crash_report(crashid, session=None, api_url=PROCESSED_CRASH_API):
     """Fetch processed crash data from crash-stats
 
     :param crashid: the crash id
+    :param session: requests session to use; a new one is made if None
+    :param api_url: url for the ProcessedCrash API
 
     :returns: processed crash as a dict
 
     """
-    headers = {"User-Agent": "tecken-loadtests"}
-    resp = requests.get(
-        PROCESSED_CRASH_API, params={"crash_id": crashid}, headers=headers
-    )
+    session = session or new_session(pool_size=1)
+    resp = session.get(api_url, params={"crash_id": crashid}, timeout=60)
     resp.raise_for_status()
     return resp.json()
 
@@ -59,20 +99,21 @@ def build_stack(data):
         return {}
 
     modules = []
-    modules_list = []
+    module_indexes = {}
     for module in json_dump.get("modules", []):
         debug_file = module.get("debug_file", "")
         debug_id = module.get("debug_id", "")
 
+        # Keep track of which modules are at which index; if a filename shows
+        # up more than once, frames refer to the first one
+        module_indexes.setdefault(module["filename"], len(modules))
         # Add the module information to the map
         modules.append((debug_file, debug_id))
-        # Keep track of which modules are at which index
-        modules_list.append(module["filename"])
 
     stack = []
     for frame in crashing_thread.get("frames", []):
         if "module" in frame:
-            module_index = modules_list.index(frame["module"])
+            module_index = module_indexes[frame["module"]]
         else:
             # -1 indicates the module is unknown
             module_index = -1
@@ -101,12 +142,20 @@ def make_stacks_group():
 @click.option(
     "--pretty/--no-pretty", default=False, help="Whether or not to print it pretty."
 )
+@click.option(
+    "--api-url", default=PROCESSED_CRASH_API, help="URL for the ProcessedCrash API."
+)
+@cache_options
 @click.argument("crashid", nargs=1)
 @click.pass_context
-def make_stacks_print(ctx, pretty, crashid):
+def make_stacks_print(
+    ctx, pretty, api_url, cache_dir, cache_max_size, cache_ttl, offline, crashid
+):
     """Generate a stack from a processed crash and print it to stdout."""
     crashid = crashid.strip()
-    crash_report = fetch_crash_report(crashid)
+    cache = open_cache(cache_dir, cache_max_size, cache_ttl, offline)
+    session = new_session(pool_size=1, cache=cache)
+    crash_report = fetch_crash_report(crashid, session=session, api_url=api_url)
     stack = build_stack(crash_report)
     if pretty:
         kwargs = {"indent": 2}
@@ -115,12 +164,91 @@ def make_stacks_print(ctx, pretty, crashid):
     print(json.dumps(stack, **kwargs))
 
 
+def save_stack(crashid, outputdir, session, rate_limiter, api_url):
+    """Fetch a processed crash and save its stack to outputdir
+
+    The stack is written to a temporary file and moved into place, so an
+    existing {crashid}.json is always complete.
+
+    :returns: manifest entry for the crash id
+
+    """
+    rate_limiter.wait()
+    start_time = time.monotonic()
+    entry = {"crashid": crashid}
+    try:
+        crash_report = fetch_crash_report(crashid, session=session, api_url=api_url)
+        data = build_stack(crash_report)
+    except Exception as exc:
+        entry["status"] = "error"
+        entry["error"] = repr(exc)
+    else:
+        if not data or not data["stacks"][0]:
+            entry["status"] = "empty"
+        else:
+            path = os.path.join(outputdir, f"{crashid}.json")
+            with open(path + ".tmp", "w") as fp:
+                json.dump(data, fp, indent=2)
+            os.replace(path + ".tmp", path)
+            entry["status"] = "saved"
+    entry["time"] = round(time.monotonic() - start_time, 3)
+    return entry
+
+
 @make_stacks_group.command("save")
+@click.option(
+    "--parallel",
+    default=4,
+    type=int,
+    help="Number of processed crashes to fetch at the same time.",
+)
+@click.option(
+    "--rate",
+    default=None,
+    type=float,
+    help="Maximum number of processed crash requests per second.",
+)
+@click.option(
+    "--force/--no-force",
+    default=False,
+    help="Fetch crash ids again even if their stack file exists.",
+)
+@click.option(
+    "--manifest",
+    default=None,
+    help=(
+        "File to append a JSON line per crash id with its status to; defaults to "
+        + "OUTPUTDIR/manifest.jsonl."
+    ),
+)
+@click.option(
+    "--api-url", default=PROCESSED_CRASH_API, help="URL for the ProcessedCrash API."
+)
+@cache_options
 @click.argument("outputdir")
 @click.argument("crashids", nargs=-1)
 @click.pass_context
-def make_stacks_save(ctx, outputdir, crashids):
-    """Generate stacks from processed crashes and save to file-system."""
+def make_stacks_save(
+    ctx,
+    parallel,
+    rate,
+    force,
+    manifest,
+    api_url,
+    cache_dir,
+    cache_max_size,
+    cache_ttl,
+    offline,
+    outputdir,
+    crashids,
+):
+    """Generate stacks from processed crashes and save to file-system.
+
+    Crash ids that already have a stack file in OUTPUTDIR are skipped, so an
+    interrupted run can be started again with the same crash ids to pick up
+    where it left off.
+
+    """
     # Handle crash ids from stdin or command line
     if not crashids and not sys.stdin.isatty():
         crashids = list(click.get_text_stream("stdin").readlines())
@@ -138,27 +266,410 @@ def make_stacks_save(ctx, outputdir, crashids):
             param_hint="outputdir",
         )
 
+    # Drop comments and duplicates, keeping the order
+    crashids = [crashid.strip() for crashid in crashids]
+    crashids = [
+        crashid for crashid in dict.fromkeys(crashids) if not crashid.startswith("#")
+    ]
+    crashids = [crashid for crashid in crashids if crashid]
+
+    manifest = manifest or os.path.join(outputdir, "manifest.jsonl")
+    cache = open_cache(cache_dir, cache_max_size, cache_ttl, offline)
+
     print(f"Creating stacks and saving them to {outputdir!r}...")
-    for crashid in crashids:
-        crashid = crashid.strip()
-        if crashid.startswith("#"):
+    counts = {"saved": 0, "skipped": 0, "empty": 0, "error": 0}
+    session = new_session(pool_size=parallel, cache=cache)
+    # Offline runs never touch the network, so there's nothing to rate limit
+    rate_limiter = RateLimiter(None if offline else rate)
+    executor = ThreadPoolExecutor(max_workers=parallel)
+    with open(manifest, "a") as manifest_fp:
+
+        def record(entry):
+            entry["ts"] = datetime.datetime.now().isoformat()
+            manifest_fp.write(json.dumps(entry) + "\n")
+            manifest_fp.flush()
+            counts[entry["status"]] += 1
+            done = sum(counts.values())
+            line = f"[{done}/{len(crashids)}] {entry['crashid']}: {entry['status']}"
+            if "error" in entry:
+                line += f" {entry['error']}"
+            print(line)
+
+        futures = []
+        for crashid in crashids:
+            if not force and os.path.exists(os.path.join(outputdir, f"{crashid}.json")):
+                record({"crashid": crashid, "status": "skipped"})
+                continue
+            futures.append(
+                executor.submit(
+                    save_stack, crashid, outputdir, session, rate_limiter, api_url
+                )
+            )
+
+        try:
+            for future in as_completed(futures):
+                record(future.result())
+        except KeyboardInterrupt:
+            print("Stopping; run again to pick up where this left off.")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    print(
+        f"Saved {counts['saved']:,}, skipped {counts['skipped']:,} existing, "
+        + f"{counts['empty']:,} with no stack, {counts['error']:,} errors."
+    )
+    print(f"Manifest: {manifest}")
+    if cache:
+        print(cache_summary(session))
+    print("Done!")
+
+
+def iter_processed_crashes(inputs):
+    """Yield processed crashes to convert from NDJSON files and directories
+
+    Yields (source, data) tuples. For files in directories, source is the path
+    of the .json file and data is None. For NDJSON files, which can be gzipped,
+    source is "PATH:LINENO" and data is the line as bytes. Parsing is left to
+    the bulk workers.
+
+    """
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for name in sorted(os.listdir(input_path)):
+                if name.endswith(".json"):
+                    yield os.path.join(input_path, name), None
             continue
 
-        print(f"{crashid}...")
-        crash_report = fetch_crash_report(crashid)
+        opener = gzip.open if input_path.endswith(".gz") else open
+        with opener(input_path, "rb") as fp:
+            for lineno, line in enumerate(fp, start=1):
+                if line.strip():
+                    yield f"{input_path}:{lineno}", line
+
+
+def convert_processed_crashes(items, outputdir):
+    """Convert a chunk of processed crashes to stacks
+
+    This runs in a bulk worker process on items from iter_processed_crashes.
+
+    :param outputdir: directory to save stacks to; if None, the encoded
+        payloads are returned instead
+
+    :returns: list of (status, name, encoded payload or error); name is the
+        crash id, or the source if the processed crash couldn't be read
+
+    """
+    results = []
+    for source, data in items:
+        name = source
         try:
-            data = build_stack(crash_report)
+            if data is None:
+                name = os.path.basename(source)[: -len(".json")]
+                with open(source, "rb") as fp:
+                    crash_report = json.load(fp)
+            else:
+                crash_report = json.loads(data)
+            name = crash_report.get("uuid") or name
+            stack = build_stack(crash_report)
         except Exception as exc:
-            print(f"Exception thrown: {exc!r}")
-            data = None
-
-        if not data or not data["stacks"][0]:
-            print("Nothing to save.")
+            results.append(("error", name, repr(exc)))
             continue
 
-        with open(os.path.join(outputdir, f"{crashid}.json"), "w") as fp:
-            json.dump(data, fp, indent=2)
+        if not stack or not stack["stacks"][0]:
+            results.append(("empty", name, None))
+        elif outputdir is not None:
+            with open(os.path.join(outputdir, f"{name}.json"), "w") as fp:
+                json.dump(stack, fp, indent=2)
+            results.append(("saved", name, None))
+        else:
+            results.append(("saved", name, encode_payload(stack)))
+    return results
+
+
+@make_stacks_group.command("bulk")
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes converting processed crashes.",
+)
+@click.argument("inputs", nargs=-1, required=True)
+@click.argument("output")
+@click.pass_context
+def make_stacks_bulk(ctx, workers, inputs, output):
+    """Convert processed crashes on disk to stacks.
+
+    INPUTS are NDJSON files with one processed crash per line (gzipped if they
+    end in .gz) or directories of processed crash .json files. If OUTPUT is a
+    directory, stacks are saved to it as CRASHID.json files. Otherwise, they're
+    written to OUTPUT as a packed corpus.
+
+    """
+    for input_path in inputs:
+        if not os.path.exists(input_path):
+            raise click.BadParameter(
+                f"{input_path!r} does not exist.",
+                ctx=ctx,
+                param="inputs",
+                param_hint="inputs",
+            )
+
+    outputdir = output if os.path.isdir(output) else None
+    writer = None if outputdir else CorpusWriter(output)
+    if outputdir:
+        print(f"Converting processed crashes and saving stacks to {output!r}...")
+    else:
+        print(f"Converting processed crashes and packing stacks into {output!r}...")
+
+    counts = {"saved": 0, "empty": 0, "error": 0}
+    start_time = time.monotonic()
+
+    def handle(results):
+        for status, name, value in results:
+            counts[status] += 1
+            if status == "error":
+                print(f"{name}: error {value}")
+            elif writer is not None and status == "saved":
+                writer.add_bytes(f"{name}.json", value)
+
+        done = sum(counts.values())
+        if done % (BULK_CHUNK_SIZE * 20) < len(results):
+            rate = done / (time.monotonic() - start_time)
+            print(f"{done:,} processed crashes converted ({rate:,.0f}/s)...")
+
+    items = iter_processed_crashes(inputs)
+    chunks = iter(lambda: list(itertools.islice(items, BULK_CHUNK_SIZE)), [])
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a window of chunks in flight and handle results in order so
+            # the corpus order matches the input order
+            pending = deque()
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(convert_processed_crashes, chunk, outputdir)
+                )
+                if len(pending) >= workers * 2:
+                    handle(pending.popleft().result())
+            while pending:
+                handle(pending.popleft().result())
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.close()
+
+    print(
+        f"Saved {counts['saved']:,} stacks, {counts['empty']:,} with no stack, "
+        + f"{counts['error']:,} errors."
+    )
+    print("Done!")
+
+
+@make_stacks_group.command("pack")
+@click.argument("stacksdir")
+@click.argument("corpusfile")
+@click.pass_context
+def make_stacks_pack(ctx, stacksdir, corpusfile):
+    """Pack a directory of stacks into a corpus file for the drivers."""
+    if not os.path.isdir(stacksdir):
+        raise click.BadParameter(
+            "Stacksdir does not exist.",
+            ctx=ctx,
+            param="stacksdir",
+            param_hint="stacksdir",
+        )
+
+    print(f"Packing stacks in {stacksdir!r} into {corpusfile!r}...")
+    count = pack_stacks(stacksdir, corpusfile)
+    print(f"Packed {count:,} stacks.")
+    print("Done!")
+
+
+@make_stacks_group.command("learn")
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes reading stacks.",
+)
+@click.argument("stacks")
+@click.argument("modelfile")
+@click.pass_context
+def make_stacks_learn(ctx, workers, stacks, modelfile):
+    """Learn a model of stacks for synthesize.
+
+    STACKS is a stacks directory or packed corpus file. The model has the
+    distributions of frames per stack and modules per job, module popularity,
+    and module offset ranges. It's saved to MODELFILE as JSON.
+
+    """
+    if not os.path.exists(stacks):
+        raise click.BadParameter(
+            f"{stacks!r} does not exist.",
+            ctx=ctx,
+            param="stacks",
+            param_hint="stacks",
+        )
+
+    start_time = time.monotonic()
+    count = len(open_stacks(stacks))
+    print(f"Learning a model of {count:,} stacks in {stacks!r}...")
+    model = StackModel.learn(stacks, count, workers=workers)
+    model.save(modelfile)
+    print(
+        f"Learned {len(model.modules):,} modules in "
+        + f"{time.monotonic() - start_time:,.1f}s; saved to {modelfile!r}."
+    )
+    print("Done!")
+
+
+def init_synthesizer(model_data):
+    global SYNTHESIZER
+    SYNTHESIZER = StackSynthesizer(StackModel.from_dict(model_data))
+
+
+def synthesize_stacks(seed, chunk_number, start, end, outputdir):
+    """Generate stacks start to end
+
+    This runs in a synthesize worker process.
+
+    :param outputdir: directory to save stacks to; if None, the encoded
+        payloads are returned instead
+
+    :returns: list of (name, encoded payload or None)
+
+    """
+    rng = random.Random(f"{seed}:{chunk_number}")
+    results = []
+    for number in range(start, end):
+        name = f"synthetic-{number:09d}"
+        stack = SYNTHESIZER.payload(rng)
+        if outputdir is not None:
+            with open(os.path.join(outputdir, f"{name}.json"), "w") as fp:
+                json.dump(stack, fp, indent=2)
+            results.append((name, None))
+        else:
+            results.append((name, encode_payload(stack)))
+    return results
+
+
+def load_model(source, workers):
+    """Return a StackModel from a model file or learned from stacks"""
+    try:
+        stacks = open_stacks(source)
+    except CorpusFormatError:
+        return StackModel.load(source)
+    print(f"Learning a model of {len(stacks):,} stacks in {source!r}...")
+    return StackModel.learn(source, len(stacks), workers=workers)
+
+
+@make_stacks_group.command("synthesize")
+@click.option(
+    "--count",
+    default=10_000,
+    type=int,
+    help="Number of stacks to generate.",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for generating stacks; the same seed and model make the same stacks.",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes generating stacks.",
+)
+@click.argument("model")
+@click.argument("output")
+@click.pass_context
+def make_stacks_synthesize(ctx, count, seed, workers, model, output):
+    """Generate synthetic stacks like the ones a model was learned from.
+
+    MODEL is a model file made with learn, or a stacks directory or packed
+    corpus file to learn one from. Synthetic stacks use the modules in the
+    model, so they can be symbolicated. If OUTPUT is a directory, stacks are
+    saved to it as synthetic-NUMBER.json files. Otherwise, they're written to
+    OUTPUT as a packed corpus.
+
+    """
+    if not os.path.exists(model):
+        raise click.BadParameter(
+            f"{model!r} does not exist.",
+            ctx=ctx,
+            param="model",
+            param_hint="model",
+        )
+    try:
+        stack_model = load_model(model, workers)
+        # Check the model can be used before starting workers
+        StackSynthesizer(stack_model)
+    except ModelError as exc:
+        raise click.BadParameter(
+            str(exc), ctx=ctx, param="model", param_hint="model"
+        ) from None
+
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    outputdir = output if os.path.isdir(output) else None
+    writer = None if outputdir else CorpusWriter(output)
+    print(
+        f"Generating {count:,} stacks with seed {seed} from a model of "
+        + f"{stack_model.payloads:,} stacks into {output!r}..."
+    )
 
+    done = 0
+    start_time = time.monotonic()
+
+    def handle(results):
+        nonlocal done
+        if writer is not None:
+            for name, value in results:
+                writer.add_bytes(f"{name}.json", value)
+        done += len(results)
+        if done % (SYNTHESIZE_CHUNK_SIZE * 100) < len(results):
+            rate = done / (time.monotonic() - start_time)
+            print(f"{done:,} stacks generated ({rate:,.0f}/s)...")
+
+    ranges = [
+        (chunk_number, start, min(start + SYNTHESIZE_CHUNK_SIZE, count))
+        for chunk_number, start in enumerate(range(0, count, SYNTHESIZE_CHUNK_SIZE))
+    ]
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_synthesizer,
+            initargs=(stack_model.to_dict(),),
+        ) as executor:
+            # Keep a window of chunks in flight and handle results in order so
+            # the corpus order matches the stack numbers
+            pending = deque()
+            for chunk_number, start, end in ranges:
+                pending.append(
+                    executor.submit(
+                        synthesize_stacks, seed, chunk_number, start, end, outputdir
+                    )
+                )
+                if len(pending) >= workers * 2:
+                    handle(pending.popleft().result())
+            while pending:
+                handle(pending.popleft().result())
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.close()
+
+    took = time.monotonic() - start_time
+    print(f"Generated {done:,} stacks in {took:,.1f}s ({done / took:,.0f}/s).")
     print("Done!")
 
 
@@ -12,22 +12,26 @@ However, since all files in there are public, a bunch of these queries
 have already been made and saved into ./symbols-uploaded/.
 """
 
-import tempfile
+import contextlib
 import os
+import queue
 import random
+import shutil
+import tempfile
+import threading
 import time
 import zipfile
-import glob
-import gzip
-import json
 import re
 import multiprocessing
 import concurrent.futures
 from urllib.parse import urlparse
 
 import click
-import deco
 import requests
+from requests.adapters import HTTPAdapter
+
+from symbolsindex import SYMBOLS_UPLOADED_DIR, SymbolsIndex
+from symbolstore import SymbolStore
 
 
 SYMBOLS_DIR = (
@@ -36,6 +40,23 @@ SYMBOLS_DIR = (
 
 ZIPS_DIR = "upload-zips"
 
+# Most bundles to list to pick from
+LIST_LIMIT = 50
+
+# Downloads are streamed in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+# Each download is spooled to its own file, in memory up to this size and to a
+# temporary file next to the zip beyond that. Finished downloads wait for the
+# zip writer, but at most max concurrency of them, so memory use is bounded by
+# 2 * max concurrency * SPOOL_SIZE.
+SPOOL_SIZE = 1024 * 1024
+
+# Times a download is tried before it's left out of the zip
+MAX_ATTEMPTS = 3
+
+# Statuses worth trying again after backing off
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 compression = zipfile.ZIP_DEFLATED
 
@@ -79,109 +100,359 @@ def time_fmt(secs):
     return "{:.2f}s".format(secs)
 
 
-@deco.concurrent
-def download(uri, save_dir, store):
-    store[uri] = _download(uri, save_dir)
-
-
-def _download(uri, save_dir):
-    url = SYMBOLS_DIR + uri.split(",", 1)[1]
-    t0 = time.time()
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(
-            "Got {} trying to download {}".format(response.status_code, url)
+class AdaptiveLimit:
+    """Concurrency limit that adapts with additive increase, multiplicative decrease
+
+    Every successful download raises the limit by 1/limit, so it goes up by
+    about one per round of downloads. Every failure halves it. The limit stays
+    between minimum and maximum.
+
+    """
+
+    def __init__(self, initial, maximum, minimum=1, adaptive=True):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.adaptive = adaptive
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, success):
+        with self._cond:
+            self.active -= 1
+            if self.adaptive:
+                if success:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                else:
+                    self.limit = max(self.minimum, self.limit / 2)
+            self._cond.notify_all()
+
+
+class Stopped(Exception):
+    """Raised in download threads when the zip writer has stopped"""
+
+
+class Download:
+    """A symbol file download, spooled to its own file for the zip writer"""
+
+    def __init__(self, uri, symbols_url, stop, attempt=1):
+        self.uri = uri
+        self.url = symbols_url + uri.split(",", 1)[1]
+        self.path = uri.split(",", 1)[1].replace("v1/", "")
+        self.attempt = attempt
+        self.stop = stop
+        # The spooled file once the download has finished
+        self.file = None
+        self.status_code = None
+        self.error = None
+        self.retryable = False
+        self.size = 0
+        self.t0 = None
+        self.t1 = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _put_ready(ready, download):
+    """Put a finished or failed download on the ready queue for the writer
+
+    :raises Stopped: if the writer stops while the queue is full
+
+    """
+    while True:
+        try:
+            ready.put(download, timeout=0.5)
+            return
+        except queue.Full:
+            if download.stop.is_set():
+                raise Stopped() from None
+
+
+def _spool_download(session, download, spool_dir=None, store=None):
+    """Download a file to its own spooled file, or set why it failed"""
+    spool = None
+    store_writer = None
+    try:
+        download.t0 = time.time()
+        response = session.get(download.url, stream=True, timeout=60)
+        download.status_code = response.status_code
+        if response.status_code != 200:
+            download.error = "Got {} trying to download {}".format(
+                response.status_code, download.url
+            )
+            download.retryable = response.status_code in RETRY_STATUSES
+            response.close()
+            return
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=spool_dir)
+        if store is not None:
+            store_writer = store.writer(download.path)
+        with response:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if download.stop.is_set():
+                    raise Stopped()
+                spool.write(chunk)
+                if store_writer is not None:
+                    store_writer.write(chunk)
+            # Bytes on the wire, which are fewer than the bytes written to
+            # the zip if the file was served compressed
+            download.size = response.raw.tell()
+        download.t1 = time.time()
+        if store_writer is not None:
+            store_writer.commit()
+            store_writer = None
+        download.file, spool = spool, None
+    except Stopped:
+        download.error = "stopped"
+    except Exception as exc:
+        download.error = repr(exc)
+        download.retryable = True
+    finally:
+        if store_writer is not None:
+            store_writer.abort()
+        if spool is not None:
+            spool.close()
+
+
+def stream_download(session, limit, download, ready, spool_dir=None, store=None):
+    """Download a file to its own spooled file and pass it to the writer
+
+    The download is put on the ready queue once it's finished or has failed,
+    so a slow zip writer doesn't hold up the connection. Its concurrency slot
+    is released before then.
+
+    :param store: SymbolStore to also save the file to, or None
+
+    """
+    if download.attempt > 1:
+        # Back off before trying again
+        time.sleep(download.attempt - 1)
+    limit.acquire()
+    try:
+        _spool_download(session, download, spool_dir=spool_dir, store=store)
+    finally:
+        # A 404 isn't a reason to slow down
+        limit.release(download.file is not None or download.status_code == 404)
+
+    try:
+        _put_ready(ready, download)
+    except Stopped:
+        download.close()
+
+
+def write_entry(zf, download):
+    """Add a finished download's spooled file to zf as a new entry"""
+    spool = download.file
+    size = spool.tell()
+    spool.seek(0)
+    zinfo = zipfile.ZipInfo(download.path, date_time=time.localtime()[:6])
+    zinfo.compress_type = compression
+    zinfo.file_size = size
+    force_zip64 = size >= zipfile.ZIP64_LIMIT
+    try:
+        with zf.open(zinfo, mode="w", force_zip64=force_zip64) as dest:
+            shutil.copyfileobj(spool, dest, CHUNK_SIZE)
+    finally:
+        download.close()
+
+
+def download_to_zip(
+    uris,
+    zf,
+    symbols_url,
+    concurrency,
+    max_concurrency,
+    adaptive=True,
+    store=None,
+    offline=False,
+):
+    """Download symbol files and stream them into zf
+
+    Downloads run in parallel, each to its own spooled file. Finished files
+    are added one at a time, in the order downloads finish. Failed downloads
+    are retried with less concurrency.
+
+    With a store, files in it are copied from it instead of downloaded, and
+    downloaded files are saved to it. With offline, only files in the store
+    are added.
+
+    :returns: dict of uri -> (path, seconds, size) for the files downloaded,
+        dict of uri -> (path, size) for the files copied from the store, and the
+        final concurrency limit
+
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    limit = AdaptiveLimit(concurrency, max_concurrency, adaptive=adaptive)
+    stop = threading.Event()
+    ready = queue.Queue(maxsize=max_concurrency)
+    downloaded = {}
+    from_store = {}
+    stored_paths = {}
+    remaining = 0
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+    spool_dir = os.path.dirname(os.path.abspath(zf.filename)) if zf.filename else None
+
+    def submit(download):
+        executor.submit(
+            stream_download, session, limit, download, ready, spool_dir, store
         )
-    path = uri.split(",", 1)[1].replace("v1/", "")
-    dirname = os.path.join(save_dir, os.path.dirname(path))
-    os.makedirs(dirname, exist_ok=True)
-    basename = os.path.basename(path)
-    fullpath = os.path.join(dirname, basename)
-    with open(fullpath, "wb") as f:
-        f.write(response.content)
-    t1 = time.time()
-    size = int(response.headers["Content-Length"])
-    print(
-        response.status_code,
-        sizeof_fmt(size).ljust(8),
-        seconds_fmt(t1 - t0).ljust(8),
-        (sizeof_fmt(size / (t1 - t0)) + "/s").ljust(8),
-        urlparse(url).path.split("/v1")[1],
-    )
-    return fullpath, t1 - t0, int(response.headers["Content-Length"])
-
 
-def _get_index(save_dir, days=0, max_size=None, silent=False):
-    # Pick a random file from the ./symbols-uploaded/ directory
-    symbols_uploaded_dir = "symbols-uploaded"
-    symbols_uploaded_file = random.choice(
-        glob.glob(os.path.join(symbols_uploaded_dir, "*.json.gz"))
-    )
-    print("SYMBOLS_UPLOADED_FILE:", symbols_uploaded_file)
-    with gzip.open(symbols_uploaded_file, "rb") as f:
-        uploaded = json.loads(f.read().decode("utf-8"))
-    all_uploads = uploaded["hits"]
-    possible = {}
-    for i, bundle in enumerate(all_uploads):
-        if max_size is not None and bundle["size"] > max_size:
+    for uri in uris:
+        if uri.endswith("/"):
+            print("Bad URL (ignoring) {}".format(uri))
             continue
-        wouldbe_name = _make_filepath(save_dir, bundle)
-        saved_already = os.path.isfile(wouldbe_name)
-        if not silent:
-            print(
-                str(i + 1).ljust(4),
-                bundle["date"].ljust(37),
-                sizeof_fmt(bundle["size"]).ljust(10),
-                "saved already" if saved_already else "",
-            )
-        if not saved_already:
-            possible[i] = (bundle["date"], bundle["size"])
+        stored_path = store.get_path(uri) if store is not None else None
+        if stored_path:
+            stored_paths[uri] = stored_path
+        elif offline:
+            print("Nothing in the store for {}".format(uri))
+        else:
+            submit(Download(uri, symbols_url, stop))
+            remaining += 1
+
+    try:
+        # Copy files from the store while the downloads get going
+        for uri, stored_path in stored_paths.items():
+            download = Download(uri, symbols_url, stop)
+            zf.write(stored_path, arcname=download.path, compress_type=compression)
+            size = os.stat(stored_path).st_size
+            from_store[uri] = (download.path, size)
+            print("STORE", sizeof_fmt(size).ljust(8), download.path)
+
+        while remaining:
+            download = ready.get()
+            if download.error is None:
+                write_entry(zf, download)
+                remaining -= 1
+                took = download.t1 - download.t0
+                downloaded[download.uri] = (download.path, took, download.size)
+                print(
+                    download.status_code,
+                    sizeof_fmt(download.size).ljust(8),
+                    seconds_fmt(took).ljust(8),
+                    (sizeof_fmt(download.size / took) + "/s").ljust(8),
+                    urlparse(download.url).path.split("/v1")[1],
+                )
+                continue
 
+            if download.retryable and download.attempt < MAX_ATTEMPTS:
+                print("Retrying ({}) {}".format(download.error, download.url))
+                submit(Download(download.uri, symbols_url, stop, download.attempt + 1))
+            else:
+                remaining -= 1
+                print(
+                    "Nothing downloaded for {} ({})".format(
+                        download.uri, download.error
+                    )
+                )
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        session.close()
+        # Spooled files of downloads that weren't added
+        while not ready.empty():
+            ready.get().close()
+
+    return downloaded, from_store, limit.limit
+
+
+def _bundle_urls(bundle):
+    return bundle["content"].get("added", []) + bundle["content"].get("existed", [])
+
+
+def _has_stored_files(store, bundle):
+    for uri in _bundle_urls(bundle):
+        with contextlib.suppress(ValueError):
+            if uri in store:
+                return True
+    return False
+
+
+def _stored_bundles(index, rows, store, limit):
+    """Return up to limit random rows whose bundles have files in the store
+
+    Checking a bundle means loading it, so bundles are loaded a source file at a
+    time, with each file read once, and this stops once it has enough.
+
+    """
+    rows = list(rows)
+    random.shuffle(rows)
+    by_source = {}
+    for row in rows:
+        by_source.setdefault(index.source[row], []).append(row)
+    found = []
+    for source_rows in by_source.values():
+        for row, bundle in index.bundles(source_rows):
+            if _has_stored_files(store, bundle):
+                found.append(row)
+                if len(found) == limit:
+                    return found
+    return found
+
+
+def _get_index(save_dir, max_size=None, silent=False, min_size=None, store=None):
+    # Pick a bundle from any of the files in the ./symbols-uploaded/ directory.
+    # With a store, only bundles that have files in it are picked.
+    index = SymbolsIndex.open(SYMBOLS_UPLOADED_DIR)
+    rows = index.select(min_size=min_size, max_size=max_size)
+    print(
+        "SYMBOLS_UPLOADED:",
+        "{} of {} bundles in {} files".format(
+            len(rows), len(index), len(index.sources)
+        ),
+    )
+    possible = [
+        row
+        for row in rows
+        if not os.path.isfile(_make_filepath(save_dir, {"date": index.date_str(row)}))
+    ]
+    if store is not None:
+        possible = _stored_bundles(index, possible, store, 1 if silent else LIST_LIMIT)
+        if not possible:
+            raise Exception("No possible zip files with files in the store")
     if not possible:
         raise Exception("No possible zip files")
+
     if silent:
         preferred = None
     else:
+        # Too many to list them all, so list a sample
+        listed = random.sample(possible, min(LIST_LIMIT, len(possible)))
+        listed.sort(key=lambda row: index.date[row])
+        for i, row in enumerate(listed):
+            print(
+                str(i + 1).ljust(4),
+                index.date_str(row).ljust(37),
+                sizeof_fmt(index.size[row]).ljust(10),
+                "{} files".format(index.file_count[row]),
+            )
+        if len(possible) > len(listed):
+            print("({} more not listed)".format(len(possible) - len(listed)))
         preferred = input("Which one? [blank for random]: ")
     if not preferred:
-        preferred = random.choice(list(possible.keys()))
+        row = random.choice(possible)
     else:
-        preferred = int(preferred) - 1
+        row = listed[int(preferred) - 1]
     print(
-        "Picking {} ({})".format(
-            possible[preferred][0], sizeof_fmt(possible[preferred][1])
+        "Picking {} ({}) from {}".format(
+            index.date_str(row), sizeof_fmt(index.size[row]), index.source_path(row)
         )
     )
     print()
-    return all_uploads[preferred]
-
-
-@deco.synchronized
-def download_all(urls, save_dir):
-    print("Downloading into", save_dir)
-    downloaded = {x: False for x in urls}
-    for url in urls:
-        if url.endswith("/"):
-            print("Bad URL (ignoring) {}".format(url))
-        else:
-            download(url, save_dir, downloaded)
-    return downloaded
-
-
-def download_all_threads(urls, save_dir):
-    print("Downloading into", save_dir)
-    futures = {}
-    downloaded = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        for url in urls:
-            if url.endswith("/"):
-                print("Bad URL (ignoring) {}".format(url))
-                continue
-            futures[executor.submit(_download, url, save_dir)] = url
-        for future in concurrent.futures.as_completed(futures):
-            url = futures[future]
-            downloaded[url] = future.result()
-    return downloaded
+    return index.bundle(row)
 
 
 def _make_filepath(save_dir, bundle):
@@ -197,17 +468,82 @@ def _make_filepath(save_dir, bundle):
     "--max-size",
     help="Max size of files to upload (default is no limit)",
 )
+@click.option(
+    "--min-size",
+    help="Min size of files to upload (default is no limit)",
+)
 @click.option(
     "--silent",
     help="Will not prompt for an input and use random choice if need be",
     is_flag=True,
 )
 @click.option(
-    "--use-threads",
-    help=("Use concurrent.futures.ThreadPoolExecutor instead of multiprocessing"),
+    "--concurrency",
+    default=8,
+    type=int,
+    help="Number of files to download at the same time to start with (default 8)",
+)
+@click.option(
+    "--max-concurrency",
+    default=32,
+    type=int,
+    help="Most files to download at the same time (default 32)",
+)
+@click.option(
+    "--adaptive/--no-adaptive",
+    default=True,
+    help=(
+        "Raise concurrency towards --max-concurrency while downloads succeed and "
+        "halve it when they fail (default adaptive)"
+    ),
+)
+@click.option(
+    "--store-dir",
+    help=(
+        "Directory of a local symbol store; files in it aren't downloaded again "
+        "and downloaded files are added to it (default no store)"
+    ),
+)
+@click.option(
+    "--store-max-size",
+    help="Size budget for the symbol store, like 20g (default no limit)",
+)
+@click.option(
+    "--verify/--no-verify",
+    default=True,
+    help="Check files from the symbol store against their sha256 (default verify)",
+)
+@click.option(
+    "--offline",
     is_flag=True,
+    help="Only use files from the symbol store; requires --store-dir",
+)
+@click.option(
+    "--symbols-url",
+    default=SYMBOLS_DIR,
+    help="Base URL to download symbol files from (default {})".format(SYMBOLS_DIR),
 )
-def run(save_dir=None, max_size=None, silent=False, use_threads=False):
+def run(
+    save_dir=None,
+    max_size=None,
+    min_size=None,
+    silent=False,
+    concurrency=8,
+    max_concurrency=32,
+    adaptive=True,
+    store_dir=None,
+    store_max_size=None,
+    verify=True,
+    offline=False,
+    symbols_url=SYMBOLS_DIR,
+):
+    if offline and not store_dir:
+        raise click.UsageError("--offline requires --store-dir")
+    store = None
+    if store_dir:
+        if store_max_size:
+            store_max_size = parse_file_size(store_max_size)
+        store = SymbolStore(store_dir, max_size=store_max_size, verify=verify)
     if max_size:
         max_size = parse_file_size(max_size)
         print(
@@ -217,91 +553,109 @@ def run(save_dir=None, max_size=None, silent=False, use_threads=False):
     save_dir = save_dir or ZIPS_DIR
     if not os.path.isdir(save_dir):
         os.makedirs(save_dir, exist_ok=True)
-    bundle = _get_index(save_dir, max_size=max_size, silent=silent)
-    all_symbol_urls = []
-    all_symbol_urls.extend(bundle["content"].get("added", []))
-    all_symbol_urls.extend(bundle["content"].get("existed", []))
+    max_concurrency = max(max_concurrency, concurrency)
+    if min_size:
+        min_size = parse_file_size(min_size)
+        print(
+            "Min. size filter:",
+            sizeof_fmt(min_size),
+        )
+    bundle = _get_index(
+        save_dir,
+        max_size=max_size,
+        silent=silent,
+        min_size=min_size,
+        store=store if offline else None,
+    )
+    all_symbol_urls = _bundle_urls(bundle)
     print(len(all_symbol_urls), "URLs to download")
-    with tempfile.TemporaryDirectory(prefix="symbols") as tmpdirname:
-        t0 = time.time()
-        if use_threads:
-            downloaded = download_all_threads(all_symbol_urls, tmpdirname)
-        else:
-            downloaded = download_all(all_symbol_urls, tmpdirname)
-        if isinstance(downloaded, bool):
-            print("all_symbol_urls", all_symbol_urls)
-            raise Exception(
-                "The downloaded dict became a boolean! ({!r})".format(
-                    downloaded,
-                )
+
+    save_filepath = _make_filepath(save_dir, bundle)
+    # Write to a temporary name so an interrupted run doesn't leave a partial
+    # zip that looks like it's been saved already
+    partial_filepath = save_filepath + ".partial"
+    t0 = time.time()
+    try:
+        with zipfile.ZipFile(partial_filepath, mode="w") as zf:
+            downloaded, from_store, final_concurrency = download_to_zip(
+                all_symbol_urls,
+                zf,
+                symbols_url=symbols_url,
+                concurrency=concurrency,
+                max_concurrency=max_concurrency,
+                adaptive=adaptive,
+                store=store,
+                offline=offline,
             )
-        t1 = time.time()
-        save_filepath = _make_filepath(save_dir, bundle)
-        total_time_took = 0.0
-        total_size = 0
-        sizes = []
-        times = []
-
-        with zipfile.ZipFile(save_filepath, mode="w") as zf:
-            for uri, download_result in downloaded.items():
-                if not download_result:
-                    print("Nothing downloaded for {}".format(uri))
-                    continue
-                fullpath, time_took, size = download_result
-                total_time_took += time_took
-                times.append(time_took)
-                total_size += size
-                sizes.append(size)
-                if fullpath:
-                    path = uri.split(",")[1].replace("v1/", "")
-                    assert os.path.isfile(fullpath)
-                    zf.write(
-                        fullpath,
-                        arcname=path,
-                        compress_type=zipfile.ZIP_DEFLATED,
-                    )
+            if not downloaded and not from_store:
+                raise Exception("No files were added to the zip")
+    except BaseException:
+        if os.path.exists(partial_filepath):
+            os.remove(partial_filepath)
+        raise
+    os.replace(partial_filepath, save_filepath)
+    t1 = time.time()
 
-        print()
-        P = 30
-        print("TO".ljust(P), save_filepath)
-        print(
-            "# CPUS:".ljust(P),
-            multiprocessing.cpu_count(),
-        )
+    times = [took for _, took, _ in downloaded.values()]
+    sizes = [size for _, _, size in downloaded.values()]
+    total_time_took = sum(times)
+    total_size = sum(sizes)
+
+    print()
+    P = 30
+    print("TO".ljust(P), save_filepath)
+    print(
+        "# CPUS:".ljust(P),
+        multiprocessing.cpu_count(),
+    )
+    print(
+        "Concurrency:".ljust(P),
+        "{} to start, {:.1f} at the end".format(concurrency, final_concurrency),
+    )
+    if times:
         print(
             "Sum time took:".ljust(P),
             time_fmt(total_time_took).ljust(P),
             "Download speed:".ljust(P),
-            sizeof_fmt(sum(sizes) / sum(times)) + "/s",
-        )
-        download_speed = sum(sizes) / (t1 - t0)
-        print(
-            "Total time took:".ljust(P),
-            time_fmt(t1 - t0).ljust(P),
-            "Download speed:".ljust(P),
-            sizeof_fmt(download_speed) + "/s",
-        )
-        with open(".downloadspeeds.log", "a") as f:
-            f.write(
-                "{}\t{}\n".format(
-                    download_speed, use_threads and "threads" or "multiprocessing"
-                )
-            )
-        print(
-            "Total size (files):".ljust(P),
-            total_size,
-            "({})".format(sizeof_fmt(total_size)),
+            sizeof_fmt(total_size / total_time_took) + "/s",
         )
+    download_speed = total_size / (t1 - t0)
+    print(
+        "Total time took:".ljust(P),
+        time_fmt(t1 - t0).ljust(P),
+        "Download speed:".ljust(P),
+        sizeof_fmt(download_speed) + "/s",
+    )
+    with open(".downloadspeeds.log", "a") as f:
+        f.write("{}\t{}\n".format(download_speed, "streaming"))
+    if store is not None:
+        store_size = sum(size for _, size in from_store.values())
+        store_files, _, store_bytes = store.stats()
         print(
-            "Total size:".ljust(P),
-            os.stat(save_filepath).st_size,
-            "({})".format(sizeof_fmt(os.stat(save_filepath).st_size)),
+            "From the store:".ljust(P),
+            "{} files ({})".format(len(from_store), sizeof_fmt(store_size)),
         )
         print(
-            "Bundle size:".ljust(P),
-            bundle["size"],
-            "({})".format(sizeof_fmt(bundle["size"])),
+            "Store:".ljust(P),
+            "{} files ({}) in {}".format(
+                store_files, sizeof_fmt(store_bytes), store_dir
+            ),
         )
+    print(
+        "Total size (files):".ljust(P),
+        total_size,
+        "({})".format(sizeof_fmt(total_size)),
+    )
+    print(
+        "Total size:".ljust(P),
+        os.stat(save_filepath).st_size,
+        "({})".format(sizeof_fmt(os.stat(save_filepath).st_size)),
+    )
+    print(
+        "Bundle size:".ljust(P),
+        bundle["size"],
+        "({})".format(sizeof_fmt(bundle["size"])),
+    )
 
     return 0
 
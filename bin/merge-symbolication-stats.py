@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Merges stats files saved by symbolication.py --stats-file from several runs
+# or processes and prints one summary table.
+#
+# Usage: bin/merge-symbolication-stats.py STATSFILE [STATSFILE...]
+
+import click
+from rich.console import Console
+
+from symstats import SymbolicationStats, print_summary
+
+
+@click.command()
+@click.argument("stats_files", nargs=-1, required=True)
+def merge_stats(stats_files):
+    console = Console()
+
+    stats = SymbolicationStats()
+    for path in stats_files:
+        stats.merge(SymbolicationStats.load(path))
+
+    console.print(f"TOTAL {stats.jobs} JOBS DONE IN {len(stats_files)} RUNS")
+    if not stats.jobs:
+        return
+
+    print_summary(console, stats)
+
+
+if __name__ == "__main__":
+    merge_stats()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Runs a local stand-in for the Crash Stats API so the corpus building scripts
+# can be run and checked without a network.
+#
+# It serves /api/ProcessedCrash/ with a synthesized processed crash for any
+# crash id. The same crash id always gets the same processed crash.
+#
+# It also serves /api/SuperSearch/ with a fixed list of --total crashes that
+# can be paged through with _results_offset and _results_number.
+#
+# Usage: bin/mock-crashstats.py [--port PORT] [--latency SECONDS] [--total N]
+
+import asyncio
+import hashlib
+import random
+import time
+import uuid
+
+from aiohttp import web
+import click
+
+
+# Modules that synthesized crashes pick from: (filename, debug_file, weight)
+MODULES = [
+    ("xul.dll", "xul.pdb", 40),
+    ("ntdll.dll", "ntdll.pdb", 30),
+    ("kernelbase.dll", "kernelbase.pdb", 20),
+    ("mozglue.dll", "mozglue.pdb", 15),
+    ("nss3.dll", "nss3.pdb", 10),
+    ("firefox.exe", "firefox.pdb", 10),
+    ("libxul.so", "libxul.so", 25),
+    ("libc.so.6", "libc.so.6", 15),
+    ("libglib-2.0.so.0", "libglib-2.0.so.0", 5),
+    ("XUL", "XUL", 20),
+    ("libsystem_kernel.dylib", "libsystem_kernel.dylib", 10),
+]
+
+
+# Signatures that fetch-crashids.py skips; some crashes get one of these
+MEH_SIGNATURES = [
+    "IPCError-browser | ShutDownKill",
+    "OOM | small | ntdll.dll",
+    "libc.so.6@0x8a5f0",
+]
+
+# SuperSearch won't return more than this many results per page
+MAX_PAGE = 1000
+
+
+def crash_rng(crashid):
+    seed = int.from_bytes(hashlib.sha256(crashid.encode("utf-8")).digest()[:8])
+    return random.Random(seed)
+
+
+def debug_id_for(debug_file, rng):
+    # Most crashes share a handful of builds of each module
+    build = rng.randrange(4)
+    digest = hashlib.md5(f"{debug_file}/{build}".encode("utf-8")).hexdigest()
+    return digest.upper() + "0"
+
+
+def crashid_for(index):
+    """Return the crash id for the crash at index in SuperSearch results"""
+    digest = hashlib.md5(f"crash/{index}".encode("utf-8")).digest()
+    return str(uuid.UUID(bytes=digest))
+
+
+def signature_for(crashid):
+    rng = random.Random(crashid)
+    if rng.random() < 0.1:
+        return rng.choice(MEH_SIGNATURES)
+    return f"mock_signature_{rng.randrange(500)}"
+
+
+def make_processed_crash(crashid):
+    """Return a synthesized processed crash for a crash id"""
+    rng = crash_rng(crashid)
+
+    module_count = rng.randint(5, 60)
+    chosen = rng.choices(MODULES, weights=[m[2] for m in MODULES], k=module_count)
+    modules = []
+    seen = set()
+    for filename, debug_file, _ in chosen:
+        if filename in seen:
+            continue
+        seen.add(filename)
+        modules.append(
+            {
+                "filename": filename,
+                "debug_file": debug_file,
+                "debug_id": debug_id_for(debug_file, rng),
+            }
+        )
+    for i in range(module_count - len(modules)):
+        modules.append(
+            {
+                "filename": f"module{i}.dll",
+                "debug_file": f"module{i}.pdb",
+                "debug_id": debug_id_for(f"module{i}.pdb", rng),
+            }
+        )
+
+    frames = []
+    for frame_index in range(rng.randint(1, 100)):
+        frame = {"frame": frame_index}
+        # Some frames aren't in any known module
+        if rng.random() < 0.95:
+            frame["module"] = rng.choice(modules)["filename"]
+            frame["module_offset"] = hex(rng.randrange(0x1000, 0x4000000))
+        frames.append(frame)
+
+    return {
+        "uuid": crashid,
+        "signature": signature_for(crashid),
+        "json_dump": {
+            "modules": modules,
+            "crashing_thread": {"frames": frames},
+        },
+    }
+
+
+class MockCrashStats:
+    def __init__(self, latency, error_rate, seed, total):
+        self.latency = latency
+        self.total = total
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    async def respond(self):
+        """Simulate latency; returns an error response sometimes"""
+        if self.latency:
+            await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        if self.rng.random() < self.error_rate:
+            return web.json_response({"error": "mock error"}, status=503)
+        return None
+
+    async def handle_processed_crash(self, request):
+        crashid = request.query.get("crash_id")
+        if not crashid:
+            return web.json_response({"error": "crash_id is required"}, status=400)
+
+        error_resp = await self.respond()
+        if error_resp is not None:
+            return error_resp
+        return web.json_response(make_processed_crash(crashid))
+
+    async def handle_supersearch(self, request):
+        try:
+            offset = int(request.query.get("_results_offset", 0))
+            number = int(request.query.get("_results_number", 100))
+        except ValueError:
+            return web.json_response({"error": "bad paging parameters"}, status=400)
+        if offset < 0 or not 0 <= number <= MAX_PAGE:
+            return web.json_response({"error": "bad paging parameters"}, status=400)
+
+        error_resp = await self.respond()
+        if error_resp is not None:
+            return error_resp
+
+        hits = []
+        for index in range(offset, min(offset + number, self.total)):
+            crashid = crashid_for(index)
+            hits.append({"uuid": crashid, "signature": signature_for(crashid)})
+        return web.json_response({"hits": hits, "total": self.total, "facets": {}})
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on.")
+@click.option("--port", default=8060, type=int, help="Port to listen on.")
+@click.option(
+    "--latency",
+    default=0.1,
+    type=float,
+    help="Average seconds to wait before responding.",
+)
+@click.option(
+    "--error-rate",
+    default=0.0,
+    type=float,
+    help="Fraction of requests that get an HTTP 503.",
+)
+@click.option(
+    "--total",
+    default=50_000,
+    type=int,
+    help="Number of crashes SuperSearch has.",
+)
+@click.option("--seed", default=None, type=int, help="Seed for latency and errors.")
+def mock_crashstats(host, port, latency, error_rate, total, seed):
+    mock = MockCrashStats(
+        latency=latency, error_rate=error_rate, seed=seed, total=total
+    )
+
+    app = web.Application()
+    app.router.add_get("/api/ProcessedCrash/", mock.handle_processed_crash)
+    app.router.add_get("/api/SuperSearch/", mock.handle_supersearch)
+
+    click.echo(f"{time.strftime('%H:%M:%S')} mock Crash Stats on http://{host}:{port}/")
+    web.run_app(app, host=host, port=port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    mock_crashstats()
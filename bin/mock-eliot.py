@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Runs a local stand-in for the Eliot symbolication API so the load test drivers
+# can be benchmarked and checked without a network or an Eliot deployment.
+#
+# It serves /symbolicate/v5 and /symbolicate/v4 and returns responses that
+# validate against the schemas in schemas/. With a "Debug: true" header, v5
+# responses include a debug block like Eliot's with simulated cache lookups,
+# downloads, parsing, and symcache saving.
+#
+# Timings can be configured per module with a JSON config file like this:
+#
+#     {
+#       "default": {"hit_ratio": 0.8, "size": 50000000},
+#       "modules": {
+#         "xul.pdb": {"hit_ratio": 0.5, "size": 900000000, "found": true}
+#       }
+#     }
+#
+# Module settings are looked up by debug file name. See DEFAULT_MODULE for the
+# available settings.
+#
+# With --cache-size, cache hits come from an LRU cache of that many modules
+# rather than each module's hit_ratio, so the hit ratio depends on which stacks
+# were sent before, like it does in Eliot.
+#
+# Usage: bin/mock-eliot.py [--port PORT] [--config FILE] [--time-scale SCALE]
+#            [--cache-size N]
+
+import asyncio
+import collections
+import json
+import random
+import time
+
+from aiohttp import web
+import click
+
+
+# Settings for a module which aren't set in the config file
+DEFAULT_MODULE = {
+    # Chance that a module is in the symcache already
+    "hit_ratio": 0.8,
+    # Uncompressed size of the sym file in bytes
+    "size": 50_000_000,
+    # Download speed in bytes/s
+    "download_speed": 100_000_000,
+    # Parse speed in bytes/s
+    "parse_speed": 200_000_000,
+    # Seconds to save a symcache after parsing
+    "save_time": 0.05,
+    # Seconds for a cache lookup
+    "lookup_time": 0.002,
+    # Whether the symbols server has the sym file
+    "found": True,
+}
+
+# Seconds of overhead per job on top of module work
+JOB_TIME = 0.005
+
+
+class MockEliot:
+    def __init__(self, config, time_scale, jitter, seed, cache_size=None):
+        self.default = dict(DEFAULT_MODULE, **config.get("default", {}))
+        self.modules = config.get("modules", {})
+        self.time_scale = time_scale
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+    def module_settings(self, debug_file):
+        return dict(self.default, **self.modules.get(debug_file, {}))
+
+    def cache_hit(self, module_key, settings):
+        """Return whether module_key is in the symcache and note the lookup"""
+        if self.cache_size is None:
+            return self.rng.random() < settings["hit_ratio"]
+
+        if module_key in self.cache:
+            self.cache.move_to_end(module_key)
+            return True
+        self.cache[module_key] = None
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return False
+
+    def vary(self, value):
+        """Return value with log-normal jitter applied"""
+        if not self.jitter:
+            return value
+        return value * self.rng.lognormvariate(0, self.jitter)
+
+    def symbolicate_job(self, job, debug):
+        """Return v5 result for a job and add its costs to debug"""
+        memory_map = job.get("memoryMap", [])
+        job_time = self.vary(JOB_TIME)
+
+        found_modules = {}
+        for debug_file, debug_id in memory_map:
+            module_key = f"{debug_file}/{debug_id}"
+            settings = self.module_settings(debug_file)
+            debug["modules"]["count"] += 1
+
+            lookup_time = self.vary(settings["lookup_time"])
+            debug["cache_lookups"]["count"] += 1
+            debug["cache_lookups"]["time"] += lookup_time
+            job_time += lookup_time
+
+            if not settings["found"]:
+                fail_time = self.vary(settings["size"] / settings["download_speed"])
+                fail_time = min(fail_time, 0.5)
+                debug["downloads"]["fail_time_per_module"][module_key] = fail_time
+                job_time += fail_time
+                found_modules[module_key] = False
+                continue
+
+            found_modules[module_key] = True
+            if self.cache_hit(module_key, settings):
+                debug["cache_lookups"]["hits"] += 1
+                continue
+
+            size = int(self.vary(settings["size"]))
+            download_time = size / self.vary(settings["download_speed"])
+            parse_time = size / self.vary(settings["parse_speed"])
+            save_time = self.vary(settings["save_time"])
+
+            downloads = debug["downloads"]
+            downloads["count"] += 1
+            downloads["size"] += size
+            downloads["time"] += download_time
+            downloads["size_per_module"][module_key] = size
+            downloads["time_per_module"][module_key] = download_time
+            debug["parse_sym"]["time"] += parse_time
+            debug["parse_sym"]["time_per_module"][module_key] = parse_time
+            debug["save_symcache"]["time"] += save_time
+            debug["save_symcache"]["time_per_module"][module_key] = save_time
+            job_time += download_time + parse_time + save_time
+
+        stacks = []
+        for stack in job.get("stacks", []):
+            frames = []
+            for frame_index, (module_index, module_offset) in enumerate(stack):
+                frame = {"frame": frame_index, "module_offset": hex(module_offset)}
+                if 0 <= module_index < len(memory_map):
+                    debug_file, debug_id = memory_map[module_index]
+                    frame["module"] = debug_file
+                    if found_modules.get(f"{debug_file}/{debug_id}"):
+                        frame["function"] = f"fun_{module_offset & ~0xFF:x}"
+                        frame["function_offset"] = hex(module_offset & 0xFF)
+                frames.append(frame)
+            stacks.append(frames)
+
+        if memory_map:
+            debug["modules"]["stacks_per_module"] = len(stacks) / len(memory_map)
+        debug["time"] += job_time
+        return {"stacks": stacks, "found_modules": found_modules}, job_time
+
+    async def simulate(self, seconds):
+        if self.time_scale:
+            await asyncio.sleep(seconds * self.time_scale)
+
+    async def handle_v5(self, request):
+        payload = await request.json()
+        jobs = payload["jobs"] if "jobs" in payload else [payload]
+
+        debug = new_debug()
+        results = []
+        total_time = 0.0
+        for job in jobs:
+            result, job_time = self.symbolicate_job(job, debug)
+            results.append(result)
+            total_time += job_time
+
+        await self.simulate(total_time)
+
+        response = {"results": results}
+        if request.headers.get("Debug") == "true":
+            response["debug"] = debug
+        return web.json_response(response)
+
+    async def handle_v4(self, request):
+        payload = await request.json()
+
+        debug = new_debug()
+        result, job_time = self.symbolicate_job(payload, debug)
+        await self.simulate(job_time)
+
+        symbolicated_stacks = []
+        for stack in result["stacks"]:
+            frames = []
+            for frame in stack:
+                if "function" in frame:
+                    frames.append(f"{frame['function']} (in {frame['module']})")
+                else:
+                    frames.append(frame["module_offset"])
+            symbolicated_stacks.append(frames)
+
+        known_modules = [
+            result["found_modules"].get(f"{debug_file}/{debug_id}")
+            for debug_file, debug_id in payload.get("memoryMap", [])
+        ]
+        return web.json_response(
+            {"symbolicatedStacks": symbolicated_stacks, "knownModules": known_modules}
+        )
+
+
+def new_debug():
+    return {
+        "time": 0.0,
+        "modules": {
+            "stacks_per_module": 0,
+            "count": 0,
+        },
+        "cache_lookups": {
+            "count": 0,
+            "hits": 0,
+            "time": 0.0,
+        },
+        "downloads": {
+            "count": 0,
+            "time": 0.0,
+            "size": 0,
+            "size_per_module": {},
+            "time_per_module": {},
+            "fail_time_per_module": {},
+        },
+        "parse_sym": {
+            "time": 0.0,
+            "time_per_module": {},
+            "fail_time_per_module": {},
+        },
+        "save_symcache": {
+            "time": 0.0,
+            "time_per_module": {},
+        },
+    }
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on.")
+@click.option("--port", default=8050, type=int, help="Port to listen on.")
+@click.option(
+    "--config",
+    "config_path",
+    default=None,
+    help="JSON file with default and per-module settings.",
+)
+@click.option(
+    "--time-scale",
+    default=1.0,
+    type=float,
+    help=(
+        "Multiply simulated times by this before sleeping; 0 responds right away "
+        + "which is helpful for measuring client throughput."
+    ),
+)
+@click.option(
+    "--jitter",
+    default=0.3,
+    type=float,
+    help="Sigma of the log-normal jitter applied to simulated values; 0 for none.",
+)
+@click.option("--seed", default=None, type=int, help="Seed for the simulation.")
+@click.option(
+    "--cache-size",
+    default=None,
+    type=int,
+    help=(
+        "Simulate an LRU symcache of this many modules instead of using each "
+        + "module's hit_ratio."
+    ),
+)
+def mock_eliot(host, port, config_path, time_scale, jitter, seed, cache_size):
+    if config_path:
+        with open(config_path) as fp:
+            config = json.load(fp)
+    else:
+        config = {}
+
+    mock = MockEliot(
+        config, time_scale=time_scale, jitter=jitter, seed=seed, cache_size=cache_size
+    )
+
+    app = web.Application(client_max_size=10 * 1024 * 1024)
+    app.router.add_post("/symbolicate/v5", mock.handle_v5)
+    app.router.add_post("/symbolicate/v4", mock.handle_v4)
+
+    click.echo(f"{time.strftime('%H:%M:%S')} mock Eliot on http://{host}:{port}/")
+    web.run_app(app, host=host, port=port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    mock_eliot()
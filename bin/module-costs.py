@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Reports which modules symbolication spent its time on, from the debug blocks
+# in result logs (or old text logs) of symbolication.py runs. See
+# bin/modulestats.py for what's counted.
+#
+# Logs are read in parallel, one per worker process, and their stats merged.
+#
+# Usage: bin/module-costs.py [--top N] [--sort KEY] [--by-debug-file] LOG [LOG...]
+
+import concurrent.futures
+import os
+import time
+
+import click
+from rich.console import Console
+
+from modulestats import SORT_KEYS, ModuleStats, print_module_summary
+from resultlog import iter_responses
+
+
+def read_module_stats(path, by_debug_file=False):
+    """Return ModuleStats for all the responses in a log"""
+    stats = ModuleStats(by_debug_file=by_debug_file)
+    for response in iter_responses(path):
+        stats.add(response["debug"])
+    return stats
+
+
+@click.command()
+@click.option(
+    "--top",
+    default=20,
+    type=int,
+    help="Number of modules to show; 0 for all of them; default=20",
+)
+@click.option(
+    "--sort",
+    default="cost",
+    type=click.Choice(list(SORT_KEYS)),
+    help="What to rank modules by; default=cost (total seconds)",
+)
+@click.option(
+    "--by-debug-file/--by-module",
+    default=False,
+    help='Group by debug file, like "xul.pdb", rather than debug file and id',
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of logs to read at the same time; default=number of CPUs",
+)
+@click.argument("logs", nargs=-1, required=True)
+def module_costs(top, sort, by_debug_file, workers, logs):
+    console = Console()
+    start_time = time.perf_counter()
+
+    stats = ModuleStats(by_debug_file=by_debug_file)
+    if workers > 1 and len(logs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for log_stats in executor.map(
+                read_module_stats, logs, [by_debug_file] * len(logs)
+            ):
+                stats.merge(log_stats)
+    else:
+        for path in logs:
+            stats.merge(read_module_stats(path, by_debug_file=by_debug_file))
+
+    took = time.perf_counter() - start_time
+    console.print(
+        f"Read {stats.responses:,} responses from {len(logs)} logs in {took:.2f}s"
+    )
+    if not stats.responses:
+        return
+
+    print_module_summary(console, stats, top=top, sort=sort)
+
+
+if __name__ == "__main__":
+    module_costs()
@@ -0,0 +1,219 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Per-module cost statistics for symbolication runs.
+#
+# The debug block of a symbolication response has download sizes and times,
+# parse times, and symcache save times for each module it had to fetch. This
+# adds those up per module so it's clear which modules cold-cache latency is
+# spent on. Times are kept in the same fixed-memory histograms as
+# SymbolicationStats, so stats can be updated one response at a time and
+# merged across processes and runs.
+
+import json
+import operator
+
+from rich import box
+from rich.table import Table
+
+from hdrhist import Histogram
+from symstats import TIME_SCALE, sizeof_fmt, time_fmt
+
+
+# Per-module dicts in the debug block: (section, key in the section, name)
+PER_MODULE_TIMES = [
+    ("downloads", "time_per_module", "download"),
+    ("parse_sym", "time_per_module", "parse"),
+    ("save_symcache", "time_per_module", "save"),
+]
+PER_MODULE_FAILURES = [
+    ("downloads", "fail_time_per_module", "download"),
+    ("parse_sym", "fail_time_per_module", "parse"),
+]
+
+PHASES = [name for _, _, name in PER_MODULE_TIMES]
+
+PERCENTILES = [50, 99]
+
+
+class ModuleCost:
+    """Counts, bytes, and time histograms for one module"""
+
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.failures = 0
+        self.times = {phase: Histogram(scale=TIME_SCALE) for phase in PHASES}
+
+    def cost(self):
+        """Return the total seconds spent on this module"""
+        return sum(hist.total for hist in self.times.values())
+
+    def speed(self):
+        """Return the effective download speed in bytes/s"""
+        download_time = self.times["download"].total
+        return self.size / download_time if download_time else 0.0
+
+    def merge(self, other):
+        self.count += other.count
+        self.size += other.size
+        self.failures += other.failures
+        for phase, hist in other.times.items():
+            self.times[phase].merge(hist)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "size": self.size,
+            "failures": self.failures,
+            "times": {phase: hist.to_dict() for phase, hist in self.times.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        cost = cls()
+        cost.count = data["count"]
+        cost.size = data["size"]
+        cost.failures = data["failures"]
+        for phase, hist_data in data["times"].items():
+            cost.times[phase] = Histogram.from_dict(hist_data)
+        return cost
+
+
+# Orders the report can be sorted by
+SORT_KEYS = {
+    "cost": ModuleCost.cost,
+    "count": operator.attrgetter("count"),
+    "bytes": operator.attrgetter("size"),
+    **{phase: (lambda cost, phase=phase: cost.times[phase].total) for phase in PHASES},
+}
+
+
+class ModuleStats:
+    """Aggregates per-module costs from symbolication response debug blocks
+
+    :param by_debug_file: group modules by debug file, like "xul.pdb", instead
+        of by debug file and debug id
+
+    """
+
+    def __init__(self, by_debug_file=False):
+        self.by_debug_file = by_debug_file
+        self.responses = 0
+        self.modules = {}
+
+    def _module(self, key, touched):
+        if self.by_debug_file:
+            key = key.split("/", 1)[0]
+        if key not in self.modules:
+            self.modules[key] = ModuleCost()
+        touched.add(key)
+        return self.modules[key]
+
+    def add(self, debug):
+        """Add the debug block of one response"""
+        self.responses += 1
+        # Modules this response spent anything on, counted once each
+        touched = set()
+
+        downloads = debug.get("downloads") or {}
+        for key, size in (downloads.get("size_per_module") or {}).items():
+            module = self._module(key, touched)
+            module.size += size
+
+        for section, field, phase in PER_MODULE_TIMES:
+            per_module = (debug.get(section) or {}).get(field) or {}
+            for key, value in per_module.items():
+                module = self._module(key, touched)
+                module.times[phase].record(value)
+
+        for section, field, _ in PER_MODULE_FAILURES:
+            per_module = (debug.get(section) or {}).get(field) or {}
+            for key in per_module:
+                module = self._module(key, touched)
+                module.failures += 1
+
+        for key in touched:
+            self.modules[key].count += 1
+
+    def merge(self, other):
+        """Add everything in other to these stats"""
+        self.responses += other.responses
+        for key, cost in other.modules.items():
+            if key not in self.modules:
+                self.modules[key] = ModuleCost()
+            self.modules[key].merge(cost)
+
+    def ranked(self, sort="cost"):
+        """Return [(module, ModuleCost)] with the most expensive first"""
+        key = SORT_KEYS[sort]
+        return sorted(self.modules.items(), key=lambda item: key(item[1]), reverse=True)
+
+    def to_dict(self):
+        return {
+            "by_debug_file": self.by_debug_file,
+            "responses": self.responses,
+            "modules": {key: cost.to_dict() for key, cost in self.modules.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(by_debug_file=data["by_debug_file"])
+        stats.responses = data["responses"]
+        stats.modules = {
+            key: ModuleCost.from_dict(cost_data)
+            for key, cost_data in data["modules"].items()
+        }
+        return stats
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            return cls.from_dict(json.load(fp))
+
+
+def print_module_summary(console, stats, top=20, sort="cost"):
+    """Print a table of the top modules by cost"""
+    table = Table(show_edge=False, box=box.MARKDOWN)
+    table.add_column("Module", justify="left", no_wrap=True)
+    table.add_column("Count", justify="right")
+    table.add_column("Fails", justify="right")
+    table.add_column("Bytes", justify="right")
+    for phase in PHASES:
+        for percent in PERCENTILES:
+            table.add_column(f"{phase} {percent}%", justify="right")
+    table.add_column("Speed", justify="right")
+    table.add_column("Cost", justify="right")
+    table.add_column("Share", justify="right")
+
+    total_cost = sum(cost.cost() for cost in stats.modules.values())
+    ranked = stats.ranked(sort)
+    for key, cost in ranked[:top] if top else ranked:
+        share = cost.cost() / total_cost * 100 if total_cost else 0.0
+        table.add_row(
+            key,
+            f"{cost.count:,}",
+            f"{cost.failures:,}" if cost.failures else "",
+            sizeof_fmt(cost.size),
+            *[
+                time_fmt(cost.times[phase].percentile(percent))
+                for phase in PHASES
+                for percent in PERCENTILES
+            ],
+            f"{sizeof_fmt(cost.speed())}/s" if cost.size else "",
+            time_fmt(cost.cost()),
+            f"{share:.1f}%",
+        )
+
+    console.print(table)
+    average_cost = total_cost / stats.responses if stats.responses else 0.0
+    console.print(
+        f"{len(stats.modules):,} modules in {stats.responses:,} responses; "
+        + f"{time_fmt(total_cost)} spent on them, "
+        + f"{time_fmt(average_cost)} per response"
+    )
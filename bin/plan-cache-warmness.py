@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Plans an order of stacks that keeps Eliot's symcache hit ratio near a target,
+# so cold-path and hot-path capacity can be benchmarked separately.
+#
+# The target is "cold" (0), "warm" (1), "mixed" (0.8), or a ratio. The hit
+# ratio is simulated with an LRU cache of --cache-size modules, so set that to
+# about how many symcaches the server (or one node, if requests are spread
+# over several) can hold. See bin/cacheplan.py for how the order is picked.
+#
+# The order file lists one stack name per line and is sent with
+# "symbolication.py --order FILE" or the Locust test's --order option.
+#
+# Usage: bin/plan-cache-warmness.py --target TARGET --cache-size N [--count N]
+#            [--reuse] [--seed N] INPUTDIR OUTPUTFILE
+
+import os
+import random
+import time
+
+import click
+from rich.console import Console
+
+from cacheplan import TARGETS, WINDOW, ModuleIndex, OrderError, plan_order, write_order
+from stackcorpus import open_stacks
+
+
+def parse_target(ctx, param, value):
+    if value in TARGETS:
+        return TARGETS[value]
+    try:
+        target = float(value)
+    except ValueError:
+        raise click.BadParameter(
+            f"{value!r} isn't one of {', '.join(TARGETS)} or a ratio"
+        ) from None
+    if not 0 <= target <= 1:
+        raise click.BadParameter("ratio must be between 0 and 1")
+    return target
+
+
+def hit_ratio(hits, lookups):
+    return sum(hits) / sum(lookups) if sum(lookups) else 0.0
+
+
+@click.command()
+@click.option(
+    "--target",
+    required=True,
+    callback=parse_target,
+    help="Hit ratio to aim for: cold, warm, mixed (0.8), or a ratio like 0.5",
+)
+@click.option(
+    "--cache-size",
+    required=True,
+    type=int,
+    help="Number of modules the server's symcache is assumed to hold",
+)
+@click.option(
+    "--count",
+    default=None,
+    type=int,
+    help="Number of stacks in the order; default=number of stacks",
+)
+@click.option(
+    "--reuse/--no-reuse",
+    default=False,
+    help="Allow stacks to be in the order more than once; default=no",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for picking stacks; default=random",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of processes to read stacks with; default=number of CPUs",
+)
+@click.argument("input_dir")
+@click.argument("outputfile")
+def plan_cache_warmness(
+    target, cache_size, count, reuse, seed, workers, input_dir, outputfile
+):
+    console = Console()
+    if cache_size < 1:
+        raise click.BadParameter("cache size must be at least 1")
+
+    stacks = open_stacks(input_dir)
+    start_time = time.perf_counter()
+    index = ModuleIndex.build(input_dir, len(stacks), workers=workers)
+    console.print(
+        f"Indexed {len(index.modules):,} modules in {len(index):,} stacks in "
+        + f"{time.perf_counter() - start_time:.2f}s"
+    )
+
+    if count is None:
+        count = len(index)
+    try:
+        order, hits = plan_order(
+            index, target, cache_size, count, random.Random(seed), reuse=reuse
+        )
+    except OrderError as exc:
+        raise click.BadParameter(str(exc)) from None
+
+    lookups = [len(index.stack_modules[stack]) for stack in order]
+    overall = hit_ratio(hits, lookups)
+    steady = hit_ratio(hits[WINDOW:], lookups[WINDOW:])
+    distinct = len({module for stack in order for module in index.stack_modules[stack]})
+
+    write_order(
+        outputfile,
+        stacks,
+        order,
+        input=input_dir,
+        target=target,
+        cache_size=cache_size,
+        reuse=reuse,
+        seed=seed,
+        expected_hit_ratio=round(overall, 4),
+        planned=time.time(),
+    )
+
+    console.print(
+        f"Planned {len(order):,} stacks ({len(set(order)):,} distinct) with "
+        + f"{sum(lookups):,} module lookups of {distinct:,} modules"
+    )
+    console.print(f"Expected hit ratio: {overall:.3f} (target {target:.3f})")
+    if len(order) > WINDOW:
+        console.print(f"Expected hit ratio after {WINDOW} stacks: {steady:.3f}")
+    console.print(f"Order saved to {outputfile}")
+
+
+if __name__ == "__main__":
+    plan_cache_warmness()
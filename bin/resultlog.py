@@ -0,0 +1,278 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Structured result logs for symbolication runs.
+#
+# A result log is a JSONL file with one record per request. Records are
+# written in blocks and each block is compressed on its own (a gzip member or
+# a zstd frame), so the whole file is still a valid .gz or .zst file. A sidecar
+# index file (PATH.idx) holds the record number and byte offset where each
+# block starts, so readers can seek to any record without decompressing
+# everything before it.
+#
+# Compression is picked by extension: ".gz" for gzip, ".zst" for zstd, and
+# anything else is uncompressed.
+
+from array import array
+import bisect
+import gzip
+import hashlib
+import io
+import json
+import os
+
+import zstandard
+
+
+INDEX_MAGIC = b"RLIDX001"
+
+# A block is written out when it has this many records or this many bytes,
+# whichever comes first
+BLOCK_RECORDS = 256
+BLOCK_BYTES = 1024 * 1024
+
+# Most compressed bytes for split_blocks to put in one range
+RANGE_BYTES = 64 * 1024 * 1024
+
+COMPRESSION_EXTENSIONS = {
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+    "none": ".jsonl",
+}
+
+
+def compression_for_path(path):
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def index_path_for(path):
+    return path + ".idx"
+
+
+def payload_hash(payload):
+    """Return a stable hash of a JSON payload or an encoded request body
+
+    A payload dict hashes the same as its compact, key-sorted encoding.
+
+    """
+    if isinstance(payload, bytes):
+        data = payload
+    else:
+        data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _compress_block(compression, data):
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+class ResultLogWriter:
+    """Writes records to a result log and its index
+
+    Use it as a context manager so the last block is written when done.
+
+    """
+
+    def __init__(self, path, block_records=BLOCK_RECORDS, block_bytes=BLOCK_BYTES):
+        self.path = path
+        self.compression = compression_for_path(path)
+        self.block_records = block_records
+        self.block_bytes = block_bytes
+
+        self.records = 0
+        self._block = []
+        self._block_size = 0
+        self._block_first_record = 0
+
+        self._fp = open(path, "wb")
+        self._index_fp = open(index_path_for(path), "wb")
+        self._index_fp.write(INDEX_MAGIC)
+
+    def write(self, record):
+        """Write a record dict"""
+        self.write_line(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+
+    def write_line(self, line):
+        """Write a record that's already been encoded as a JSON bytes line"""
+        self._block.append(line)
+        self._block_size += len(line) + 1
+        self.records += 1
+        if (
+            len(self._block) >= self.block_records
+            or self._block_size >= self.block_bytes
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write out the current block and its index entry"""
+        if not self._block:
+            return
+
+        offset = self._fp.tell()
+        data = b"\n".join(self._block) + b"\n"
+        self._fp.write(_compress_block(self.compression, data))
+        self._fp.flush()
+
+        self._index_fp.write(array("Q", [self._block_first_record, offset]).tobytes())
+        self._index_fp.flush()
+
+        self._block = []
+        self._block_size = 0
+        self._block_first_record = self.records
+
+    def close(self):
+        self.flush()
+        self._fp.close()
+        self._index_fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def load_index(path):
+    """Return list of (first record number, byte offset) for each block"""
+    with open(index_path_for(path), "rb") as fp:
+        if fp.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"{index_path_for(path)} is not a result log index")
+        entries = array("Q")
+        entries.frombytes(fp.read())
+    return list(zip(entries[::2], entries[1::2], strict=True))
+
+
+def _open_stream(fp, compression):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fp, mode="rb")
+    if compression == "zstd":
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(fp, read_across_frames=True)
+        )
+    return fp
+
+
+def _decompress_block(compression, data):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def iter_records(path, start=0):
+    """Stream records from a result log starting with record number start
+
+    If start is past the first block, this uses the index to skip ahead.
+
+    """
+    compression = compression_for_path(path)
+    offset = 0
+    first_record = 0
+    if start and os.path.exists(index_path_for(path)):
+        for block_first_record, block_offset in load_index(path):
+            if block_first_record > start:
+                break
+            first_record, offset = block_first_record, block_offset
+
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        stream = _open_stream(fp, compression)
+        for record_number, line in enumerate(stream, start=first_record):
+            if record_number >= start:
+                yield json.loads(line)
+
+
+def split_blocks(path, parts, max_bytes=RANGE_BYTES):
+    """Split a result log into (start, end) byte ranges of whole blocks
+
+    Returns about parts ranges, more if that's needed to keep each range under
+    max_bytes, so they can be read by iter_records_between in parallel. Logs
+    without an index are one range. An end of None is the end of the file.
+
+    """
+    if not os.path.exists(index_path_for(path)):
+        return [(0, None)]
+    offsets = [offset for _, offset in load_index(path)]
+    if not offsets:
+        return [(0, None)]
+
+    size = os.path.getsize(path)
+    parts = max(parts, -(-size // max_bytes))
+    target = size / parts
+    ranges = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= target:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, None))
+    return ranges
+
+
+def iter_records_between(path, start, end=None):
+    """Stream records from the blocks between byte offsets start and end"""
+    with open(path, "rb") as fp:
+        fp.seek(start)
+        data = fp.read() if end is None else fp.read(end - start)
+    stream = _open_stream(io.BytesIO(data), compression_for_path(path))
+    for line in stream:
+        yield json.loads(line)
+
+
+def read_record(path, record_number):
+    """Return a single record by seeking to and decompressing only its block"""
+    index = load_index(path)
+    i = bisect.bisect_right([entry[0] for entry in index], record_number) - 1
+    if i < 0:
+        raise IndexError(record_number)
+
+    block_first_record, block_offset = index[i]
+    if i + 1 < len(index):
+        block_end = index[i + 1][1]
+    else:
+        block_end = os.path.getsize(path)
+
+    with open(path, "rb") as fp:
+        fp.seek(block_offset)
+        data = fp.read(block_end - block_offset)
+
+    lines = _decompress_block(compression_for_path(path), data).splitlines()
+    line_number = record_number - block_first_record
+    if line_number < 0 or line_number >= len(lines):
+        raise IndexError(record_number)
+    return json.loads(lines[line_number])
+
+
+def is_result_log(path):
+    return path.endswith((".jsonl", ".jsonl.gz", ".jsonl.zst"))
+
+
+def iter_responses(path):
+    """Stream symbolication responses from a result log or an old text log
+
+    Each response is a dict with at least a "debug" key. Old text logs are the
+    ones with FILE:, PAYLOAD:, and RESPONSE: lines.
+
+    """
+    if is_result_log(path):
+        for record in iter_records(path):
+            response = dict(record.get("response") or {})
+            response["debug"] = record.get("debug") or {}
+            yield response
+        return
+
+    with open(path, "r") as fp:
+        for line in fp:
+            if line.startswith("RESPONSE: "):
+                yield json.loads(line[len("RESPONSE: ") :])
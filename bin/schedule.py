@@ -0,0 +1,101 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Recorded request schedules, for replaying the same traffic.
+#
+# A schedule is a JSONL file (gzipped if the name ends in ".gz"). The first
+# line is a header that says which stacks it was recorded with. Every other
+# line is one request as [send offset in seconds, [stack indexes]], where the
+# stack indexes are the batch of stacks sent together.
+
+import gzip
+import hashlib
+import json
+import os
+
+
+SCHEDULE_VERSION = 1
+
+
+class ScheduleMismatchError(Exception):
+    pass
+
+
+def stacks_digest(stacks):
+    """Return a hash of the stack names, to check a replay uses the same stacks
+
+    Names don't include the directory, so a stacks directory, a copy of it
+    somewhere else, and a corpus packed from it all match.
+
+    """
+    hasher = hashlib.sha256()
+    for index in range(len(stacks)):
+        hasher.update(os.path.basename(stacks.name(index)).encode("utf-8"))
+        hasher.update(b"\n")
+    return hasher.hexdigest()
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class ScheduleWriter:
+    """Writes a schedule as requests are sent
+
+    Use it as a context manager so the file is closed when done.
+
+    """
+
+    def __init__(self, path, stacks, **info):
+        self.path = path
+        self.requests = 0
+        self._fp = _open(path, "w")
+        header = {
+            "version": SCHEDULE_VERSION,
+            "stacks": len(stacks),
+            "stacks_digest": stacks_digest(stacks),
+            **info,
+        }
+        self._fp.write(json.dumps(header) + "\n")
+
+    def add(self, offset, indexes):
+        """Add a request sent offset seconds from the start with these stacks"""
+        self._fp.write(json.dumps([round(offset, 6), list(indexes)]) + "\n")
+        self.requests += 1
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def load_schedule(path, stacks=None):
+    """Return (header, [(offset, indexes)]) for a schedule, in order by offset
+
+    :param stacks: if given, check that the schedule was recorded with the same
+        stacks
+
+    """
+    with _open(path, "r") as fp:
+        header = json.loads(fp.readline())
+        if header.get("version") != SCHEDULE_VERSION:
+            raise ScheduleMismatchError(f"{path} isn't a version 1 schedule")
+        entries = [tuple(json.loads(line)) for line in fp if line.strip()]
+
+    if stacks is not None and (
+        header["stacks"] != len(stacks)
+        or header["stacks_digest"] != stacks_digest(stacks)
+    ):
+        raise ScheduleMismatchError(
+            f"{path} was recorded with different stacks ({header['stacks']:,} stacks)"
+        )
+
+    entries.sort(key=lambda entry: entry[0])
+    return header, entries
@@ -0,0 +1,228 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Packed stack corpus files.
+#
+# A stacks directory has one JSON file per stack, which is slow to load when
+# there are a lot of them. A packed corpus is a single file with every stack
+# already encoded as a request body plus an offset table. Drivers memory-map
+# it, so they start right away, processes on the same machine share the pages,
+# and payloads are sent as-is without re-encoding.
+#
+# Layout (all integers are little-endian unsigned 64-bit):
+#
+#     MAGIC
+#     payload bytes, one after another
+#     name bytes, one after another
+#     payload offsets: count + 1 integers
+#     name offsets: count + 1 integers
+#     footer: count, position of payload offsets, position of name offsets, MAGIC
+#
+# Build one from a stacks directory with ``bin/make-stacks.py pack``.
+
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b"STKCORP1"
+FOOTER = struct.Struct("<QQQ8s")
+
+
+class CorpusFormatError(Exception):
+    pass
+
+
+def encode_payload(payload):
+    """Encode a stack as a compact request body
+
+    The "version" key is dropped. Keys are sorted so the same stack always
+    encodes to the same bytes.
+
+    """
+    payload = {key: val for key, val in payload.items() if key != "version"}
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def jobs_body(payloads):
+    """Return a v5 request body for a list of encoded payloads"""
+    return b'{"jobs":[' + b",".join(payloads) + b"]}"
+
+
+class CorpusWriter:
+    """Writes a packed corpus one stack at a time
+
+    The corpus is written to a temporary file and moved into place when it's
+    closed, so readers never see a partial corpus. Use it as a context manager.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = path + ".tmp"
+        self._fp = open(self._tmp_path, "wb")
+        self._fp.write(MAGIC)
+        self._payload_offsets = array("Q", [len(MAGIC)])
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name, payload):
+        """Add a stack payload dict"""
+        self.add_bytes(name, encode_payload(payload))
+
+    def add_bytes(self, name, data):
+        """Add a stack payload that's already encoded"""
+        self._fp.write(data)
+        self._payload_offsets.append(self._payload_offsets[-1] + len(data))
+        self._names.append(name.encode("utf-8"))
+
+    def _write_table(self, table):
+        # Keep tables 8-byte aligned
+        padding = -self._fp.tell() % 8
+        self._fp.write(b"\0" * padding)
+        position = self._fp.tell()
+        if sys.byteorder != "little":
+            table.byteswap()
+        self._fp.write(table.tobytes())
+        return position
+
+    def close(self):
+        name_offsets = array("Q", [self._fp.tell()])
+        for name in self._names:
+            self._fp.write(name)
+            name_offsets.append(name_offsets[-1] + len(name))
+
+        payload_offsets_position = self._write_table(self._payload_offsets)
+        name_offsets_position = self._write_table(name_offsets)
+        self._fp.write(
+            FOOTER.pack(
+                len(self._names),
+                payload_offsets_position,
+                name_offsets_position,
+                MAGIC,
+            )
+        )
+        self._fp.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._fp.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class StackCorpus:
+    """Read-only, memory-mapped packed corpus"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < len(MAGIC) + FOOTER.size or self._mmap[:8] != MAGIC:
+            raise CorpusFormatError(f"{path} is not a packed stack corpus")
+
+        count, payload_offsets_position, name_offsets_position, magic = (
+            FOOTER.unpack_from(self._mmap, len(self._mmap) - FOOTER.size)
+        )
+        if magic != MAGIC:
+            raise CorpusFormatError(f"{path} is truncated")
+
+        self._count = count
+        self._payload_offsets = self._table(payload_offsets_position, count + 1)
+        self._name_offsets = self._table(name_offsets_position, count + 1)
+
+    def _table(self, position, length):
+        view = memoryview(self._mmap)[position : position + length * 8]
+        if sys.byteorder == "little":
+            return view.cast("Q")
+        table = array("Q", view.tobytes())
+        table.byteswap()
+        return table
+
+    def __len__(self):
+        return self._count
+
+    def name(self, index):
+        start, end = self._name_offsets[index], self._name_offsets[index + 1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def payload_bytes(self, index):
+        """Return the encoded payload for the stack at index"""
+        start, end = self._payload_offsets[index], self._payload_offsets[index + 1]
+        return self._mmap[start:end]
+
+    def payload(self, index):
+        return json.loads(self.payload_bytes(index))
+
+
+class StacksDir:
+    """Stacks directory with the same interface as StackCorpus
+
+    :param preload: encode all the stacks up front rather than reading each
+        file when it's needed
+
+    """
+
+    def __init__(self, path, preload=False):
+        self.path = path
+        self._names = sorted(
+            name for name in os.listdir(path) if name.endswith(".json")
+        )
+        self._payloads = None
+        if preload:
+            self._payloads = [self._read(index) for index in range(len(self._names))]
+
+    def _read(self, index):
+        with open(os.path.join(self.path, self._names[index])) as fp:
+            return encode_payload(json.load(fp))
+
+    def __len__(self):
+        return len(self._names)
+
+    def name(self, index):
+        return os.path.join(self.path, self._names[index])
+
+    def payload_bytes(self, index):
+        if self._payloads is not None:
+            return self._payloads[index]
+        return self._read(index)
+
+    def payload(self, index):
+        return json.loads(self.payload_bytes(index))
+
+
+def open_stacks(path, preload=False):
+    """Open a packed corpus file or a stacks directory"""
+    if os.path.isdir(path):
+        return StacksDir(path, preload=preload)
+    return StackCorpus(path)
+
+
+def pack_stacks(stacks_dir, path):
+    """Pack the stacks in stacks_dir into a corpus file
+
+    :returns: number of stacks packed
+
+    """
+    stacks = StacksDir(stacks_dir)
+    with CorpusWriter(path) as writer:
+        for index in range(len(stacks)):
+            writer.add_bytes(
+                os.path.basename(stacks.name(index)), stacks.payload_bytes(index)
+            )
+    return len(stacks)
@@ -0,0 +1,281 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Statistical model of a stacks corpus for generating synthetic stacks.
+#
+# The model has the distributions of stacks per job, frames per stack, and
+# modules per job, how many stacks each module is in (its popularity), how many
+# frames point into it, and the range of module offsets seen for it. Synthetic
+# stacks pick modules by popularity and frames by frame counts, with offsets
+# drawn from each module's range, so they use real (debug_file, debug_id)
+# pairs that the symbols server has and cost about the same to symbolicate as
+# the stacks the model was learned from.
+#
+# A model is saved as JSON, so it can be learned where the crash data is and
+# shared without it.
+
+import bisect
+import collections
+import concurrent.futures
+import itertools
+import json
+
+from stackcorpus import open_stacks
+
+
+MODEL_VERSION = 1
+
+# Give up picking distinct modules by popularity after this many tries per
+# module and fill the rest of the memoryMap uniformly
+MAX_TRIES_PER_MODULE = 20
+
+
+class ModelError(Exception):
+    pass
+
+
+class ModuleCounts:
+    """What's been seen of one module"""
+
+    __slots__ = ["stacks", "frames", "min_offset", "max_offset"]
+
+    def __init__(self, stacks=0, frames=0, min_offset=None, max_offset=None):
+        self.stacks = stacks
+        self.frames = frames
+        self.min_offset = min_offset
+        self.max_offset = max_offset
+
+    def add_offset(self, offset):
+        if self.min_offset is None or offset < self.min_offset:
+            self.min_offset = offset
+        if self.max_offset is None or offset > self.max_offset:
+            self.max_offset = offset
+
+    def merge(self, other):
+        self.stacks += other.stacks
+        self.frames += other.frames
+        if other.min_offset is not None:
+            self.add_offset(other.min_offset)
+            self.add_offset(other.max_offset)
+
+    def to_list(self):
+        return [self.stacks, self.frames, self.min_offset, self.max_offset]
+
+
+class StackModel:
+    """Distributions learned from a stacks corpus"""
+
+    def __init__(self):
+        self.payloads = 0
+        self.stacks_per_job = collections.Counter()
+        self.frames_per_stack = collections.Counter()
+        self.modules_per_job = collections.Counter()
+        # (debug_file, debug_id) -> ModuleCounts
+        self.modules = {}
+        # Frames with no module; they get offsets from this
+        self.unknown = ModuleCounts()
+
+    def add(self, payload):
+        """Add what's in one payload to the model"""
+        self.payloads += 1
+        jobs = payload["jobs"] if "jobs" in payload else [payload]
+        for job in jobs:
+            memory_map = [tuple(module) for module in job.get("memoryMap", [])]
+            stacks = job.get("stacks", [])
+            self.stacks_per_job[len(stacks)] += 1
+            self.modules_per_job[len(memory_map)] += 1
+
+            # A module can be in a memoryMap more than once; count it once
+            for key in dict.fromkeys(memory_map):
+                if key not in self.modules:
+                    self.modules[key] = ModuleCounts()
+                self.modules[key].stacks += 1
+            counts = [self.modules[key] for key in memory_map]
+
+            for stack in stacks:
+                self.frames_per_stack[len(stack)] += 1
+                for module_index, module_offset in stack:
+                    if 0 <= module_index < len(counts):
+                        module_counts = counts[module_index]
+                    else:
+                        module_counts = self.unknown
+                    module_counts.frames += 1
+                    if module_offset >= 0:
+                        module_counts.add_offset(module_offset)
+
+    def merge(self, other):
+        self.payloads += other.payloads
+        self.stacks_per_job.update(other.stacks_per_job)
+        self.frames_per_stack.update(other.frames_per_stack)
+        self.modules_per_job.update(other.modules_per_job)
+        for key, counts in other.modules.items():
+            if key not in self.modules:
+                self.modules[key] = ModuleCounts()
+            self.modules[key].merge(counts)
+        self.unknown.merge(other.unknown)
+
+    @classmethod
+    def learn(cls, path, stacks_count, workers=1, chunk_size=1000):
+        """Learn a model from the stacks at path, reading them in parallel"""
+        model = cls()
+        ranges = [
+            (start, min(start + chunk_size, stacks_count))
+            for start in range(0, stacks_count, chunk_size)
+        ]
+        if workers > 1 and len(ranges) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                for chunk_model in pool.map(
+                    learn_chunk, [path] * len(ranges), *zip(*ranges, strict=True)
+                ):
+                    model.merge(chunk_model)
+        else:
+            for start, end in ranges:
+                model.merge(learn_chunk(path, start, end))
+        return model
+
+    def to_dict(self):
+        return {
+            "version": MODEL_VERSION,
+            "payloads": self.payloads,
+            "stacks_per_job": sorted(self.stacks_per_job.items()),
+            "frames_per_stack": sorted(self.frames_per_stack.items()),
+            "modules_per_job": sorted(self.modules_per_job.items()),
+            "modules": [
+                [debug_file, debug_id, *counts.to_list()]
+                for (debug_file, debug_id), counts in self.modules.items()
+            ],
+            "unknown": self.unknown.to_list(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != MODEL_VERSION:
+            raise ModelError(f"not a version {MODEL_VERSION} stack model")
+        model = cls()
+        model.payloads = data["payloads"]
+        model.stacks_per_job = collections.Counter(dict(data["stacks_per_job"]))
+        model.frames_per_stack = collections.Counter(dict(data["frames_per_stack"]))
+        model.modules_per_job = collections.Counter(dict(data["modules_per_job"]))
+        model.modules = {
+            (debug_file, debug_id): ModuleCounts(*counts)
+            for debug_file, debug_id, *counts in data["modules"]
+        }
+        model.unknown = ModuleCounts(*data["unknown"])
+        return model
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            try:
+                return cls.from_dict(json.load(fp))
+            except (ValueError, KeyError, TypeError) as exc:
+                raise ModelError(f"{path} isn't a stack model: {exc!r}") from None
+
+
+def learn_chunk(path, start, end):
+    """Return a StackModel of stacks start to end; run in worker processes"""
+    stacks = open_stacks(path)
+    model = StackModel()
+    for index in range(start, end):
+        model.add(stacks.payload(index))
+    return model
+
+
+class Distribution:
+    """Draws values with the frequencies they were counted with
+
+    Values are sorted, so a seeded draw doesn't depend on the order they were
+    counted in.
+
+    """
+
+    def __init__(self, counts):
+        items = sorted(counts.items())
+        self.values = [value for value, _ in items]
+        self.cumulative = list(itertools.accumulate(count for _, count in items))
+
+    def __len__(self):
+        return len(self.values)
+
+    def sample_index(self, rng):
+        return bisect.bisect_right(self.cumulative, rng.random() * self.cumulative[-1])
+
+    def sample(self, rng):
+        return self.values[self.sample_index(rng)]
+
+    def samples(self, rng, count):
+        """Return a list of count values, which is faster than sampling each"""
+        return rng.choices(self.values, cum_weights=self.cumulative, k=count)
+
+
+class StackSynthesizer:
+    """Generates payloads with a StackModel's distributions"""
+
+    def __init__(self, model):
+        if not model.modules or not model.frames_per_stack:
+            raise ModelError("the model has no modules or stacks")
+        self.stacks_per_job = Distribution(model.stacks_per_job)
+        self.frames_per_stack = Distribution(model.frames_per_stack)
+        self.modules_per_job = Distribution(model.modules_per_job)
+        self.modules = list(model.modules)
+        self.module_counts = [model.modules[key] for key in self.modules]
+        self.popularity = Distribution(
+            {index: counts.stacks for index, counts in enumerate(self.module_counts)}
+        )
+        self.unknown = model.unknown
+
+    def pick_modules(self, count, rng):
+        """Return count distinct module numbers, picked by popularity"""
+        count = min(count, len(self.modules))
+        picked = {}
+        tries = count * MAX_TRIES_PER_MODULE
+        while len(picked) < count and tries > 0:
+            # Draw as many as are missing at once; duplicates are dropped
+            needed = count - len(picked)
+            picked.update(dict.fromkeys(self.popularity.samples(rng, needed)))
+            tries -= needed
+        while len(picked) < count:
+            picked[rng.randrange(len(self.modules))] = None
+        return list(picked)
+
+    def offset(self, counts, rng):
+        if counts.min_offset is None:
+            return -1
+        return rng.randint(counts.min_offset, counts.max_offset)
+
+    def payload(self, rng):
+        """Return a synthetic payload like make-stacks.py makes"""
+        module_numbers = self.pick_modules(self.modules_per_job.sample(rng), rng)
+        # Frames go to modules in the memoryMap by how many frames they had and
+        # to no module as often as frames had no module
+        frame_weights = {
+            index: self.module_counts[number].frames
+            for index, number in enumerate(module_numbers)
+        }
+        frame_weights[-1] = self.unknown.frames
+        if not any(frame_weights.values()):
+            frame_weights = dict.fromkeys(frame_weights, 1)
+        frame_modules = Distribution(frame_weights)
+
+        stacks = []
+        for _ in range(self.stacks_per_job.sample(rng)):
+            stack = []
+            frames = self.frames_per_stack.sample(rng)
+            for module_index in frame_modules.samples(rng, frames):
+                if module_index < 0:
+                    counts = self.unknown
+                else:
+                    counts = self.module_counts[module_numbers[module_index]]
+                stack.append((module_index, self.offset(counts, rng)))
+            stacks.append(stack)
+
+        return {
+            "stacks": stacks,
+            "memoryMap": [self.modules[number] for number in module_numbers],
+            "version": 5,
+        }
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Sweeps symbolicate/v5 batch sizes and concurrencies to find where bundling
+# more jobs per request stops paying off.
+#
+# The same slice of stacks is sent, closed-loop, at every combination of batch
+# size and concurrency. Each point reports jobs/s, per-job latency (a job's
+# latency is the latency of the request it was in), and the server's
+# debug.time per request and per job. By default, the slice is sent once
+# before the sweep so every point sees the same warm cache rather than the
+# first point paying for all the downloads.
+#
+# Usage: bin/sweep-batch-sizes.py [--batch-sizes 1,2,4,8] [--concurrencies 1,4,16]
+#            [--stacks N] [--seed N] [--csv FILE] INPUTDIR URL
+
+import asyncio
+import csv
+import random
+import time
+
+import click
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from hdrhist import Histogram
+from stackcorpus import open_stacks
+from symbolication import drive, iter_batches, split_batches, symbolicate_url
+from symstats import TIME_SCALE, time_fmt
+
+
+PERCENTILES = [50, 90, 99]
+
+# The table has fewer columns than the CSV so it fits in a terminal
+TABLE_PERCENTILES = [50, 99]
+
+# A batch size is "enough" once it gets within this fraction of the best jobs/s
+# at the same concurrency
+KNEE_FRACTION = 0.95
+
+CSV_FIELDS = [
+    "batch_size",
+    "concurrency",
+    "requests",
+    "jobs",
+    "failures",
+    "seconds",
+    "jobs_per_second",
+    "requests_per_second",
+    *[f"latency_p{percent}" for percent in PERCENTILES],
+    *[f"server_time_p{percent}" for percent in PERCENTILES],
+    "server_time_per_job",
+]
+
+
+def parse_int_list(ctx, param, value):
+    try:
+        values = sorted({int(item) for item in value.split(",") if item.strip()})
+    except ValueError:
+        raise click.BadParameter(f"{value!r} isn't a list of numbers") from None
+    if not values or values[0] < 1:
+        raise click.BadParameter("values must be at least 1")
+    return values
+
+
+def run_point(url, stacks, order, batch_size, concurrency, console):
+    """Send order in batches of batch_size and return the point's results"""
+    batches = split_batches(order, batch_size)
+    latency = Histogram(scale=TIME_SCALE)
+    server_time = Histogram(scale=TIME_SCALE)
+    requests = jobs = 0
+
+    def on_result(names, body, delta, resp, wait):
+        nonlocal requests, jobs
+        requests += 1
+        jobs += len(names)
+        # Every job in the request waited for the whole response
+        latency.record(delta, count=len(names))
+        debug = resp.get("debug") or {}
+        if "time" in debug:
+            server_time.record(debug["time"])
+
+    start_time = time.perf_counter()
+    failures = asyncio.run(
+        drive(url, iter_batches(stacks, batches), concurrency, on_result, console)
+    )
+    took = time.perf_counter() - start_time
+
+    point = {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "jobs": jobs,
+        "failures": failures,
+        "seconds": took,
+        "jobs_per_second": jobs / took if took else 0.0,
+        "requests_per_second": requests / took if took else 0.0,
+    }
+    for percent in PERCENTILES:
+        point[f"latency_p{percent}"] = latency.percentile(percent)
+        point[f"server_time_p{percent}"] = server_time.percentile(percent)
+    point["server_time_per_job"] = server_time.total / jobs if jobs else 0.0
+    return point
+
+
+def knees(points):
+    """Return {concurrency: smallest batch size within KNEE_FRACTION of the best}"""
+    best = {}
+    for point in points:
+        concurrency = point["concurrency"]
+        best[concurrency] = max(best.get(concurrency, 0.0), point["jobs_per_second"])
+
+    result = {}
+    for point in sorted(points, key=lambda point: point["batch_size"]):
+        concurrency = point["concurrency"]
+        if concurrency in result or not best[concurrency]:
+            continue
+        if point["jobs_per_second"] >= best[concurrency] * KNEE_FRACTION:
+            result[concurrency] = point["batch_size"]
+    return result
+
+
+def print_sweep(console, points):
+    table = Table(show_edge=False, box=box.MARKDOWN)
+    table.add_column("Batch", justify="right")
+    table.add_column("Conc.", justify="right")
+    table.add_column("Jobs", justify="right")
+    table.add_column("Fails", justify="right")
+    table.add_column("Jobs/s", justify="right")
+    table.add_column("vs batch 1", justify="right")
+    for percent in TABLE_PERCENTILES:
+        table.add_column(f"latency {percent}%", justify="right")
+    for percent in TABLE_PERCENTILES:
+        table.add_column(f"server {percent}%", justify="right")
+    table.add_column("server/job", justify="right")
+
+    baseline = {
+        point["concurrency"]: point["jobs_per_second"]
+        for point in points
+        if point["batch_size"] == 1
+    }
+    for point in sorted(points, key=lambda p: (p["concurrency"], p["batch_size"])):
+        base = baseline.get(point["concurrency"])
+        table.add_row(
+            str(point["batch_size"]),
+            str(point["concurrency"]),
+            f"{point['jobs']:,}",
+            f"{point['failures']:,}" if point["failures"] else "",
+            f"{point['jobs_per_second']:,.2f}",
+            f"{point['jobs_per_second'] / base:.2f}x" if base else "",
+            *[time_fmt(point[f"latency_p{percent}"]) for percent in TABLE_PERCENTILES],
+            *[
+                time_fmt(point[f"server_time_p{percent}"])
+                for percent in TABLE_PERCENTILES
+            ],
+            time_fmt(point["server_time_per_job"]),
+        )
+    console.print(table)
+
+    for concurrency, batch_size in sorted(knees(points).items()):
+        console.print(
+            f"Concurrency {concurrency}: batch size {batch_size} gets within "
+            + f"{1 - KNEE_FRACTION:.0%} of the best jobs/s"
+        )
+
+
+def write_csv(path, points):
+    with open(path, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for point in points:
+            writer.writerow(point)
+
+
+@click.command()
+@click.option(
+    "--batch-sizes",
+    default="1,2,4,8,16",
+    callback=parse_int_list,
+    help="Comma-separated jobs per request to try; default=1,2,4,8,16",
+)
+@click.option(
+    "--concurrencies",
+    default="1,4,16",
+    callback=parse_int_list,
+    help="Comma-separated requests in flight to try; default=1,4,16",
+)
+@click.option(
+    "--stacks",
+    "stacks_limit",
+    default=None,
+    type=int,
+    help="Number of stacks in the slice sent at every point; default=all of them",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for picking and ordering the slice of stacks; default=random",
+)
+@click.option(
+    "--warmup/--no-warmup",
+    default=True,
+    help="Send the slice once before the sweep so every point sees a warm cache",
+)
+@click.option(
+    "--csv",
+    "csv_path",
+    default=None,
+    help="Also write the throughput curve to this CSV file",
+)
+@click.argument("input_dir")
+@click.argument("url")
+def sweep(
+    batch_sizes, concurrencies, stacks_limit, seed, warmup, csv_path, input_dir, url
+):
+    console = Console()
+    url = symbolicate_url(url)
+
+    stacks = open_stacks(input_dir)
+    order = list(range(len(stacks)))
+    random.Random(seed).shuffle(order)
+    if stacks_limit is not None:
+        order = order[:stacks_limit]
+    if len(order) < batch_sizes[-1]:
+        raise click.BadParameter(
+            f"the slice has {len(order)} stacks; it needs at least {batch_sizes[-1]}"
+        )
+    console.print(
+        f"Sweeping {len(order)} of {len(stacks)} stacks at batch sizes "
+        + f"{batch_sizes} and concurrencies {concurrencies}"
+    )
+
+    if warmup:
+        console.print("Warming up...")
+        run_point(url, stacks, order, batch_sizes[-1], concurrencies[-1], console)
+
+    points = []
+    try:
+        for concurrency in concurrencies:
+            for batch_size in batch_sizes:
+                point = run_point(url, stacks, order, batch_size, concurrency, console)
+                points.append(point)
+                console.print(
+                    f"batch {batch_size:>4} concurrency {concurrency:>4}: "
+                    + f"{point['jobs_per_second']:,.2f} jobs/s, "
+                    + f"latency 50% {time_fmt(point['latency_p50'])}"
+                )
+    except KeyboardInterrupt:
+        console.print("Keyboard interrupt...")
+
+    if not points:
+        return
+
+    console.print()
+    print_sweep(console, points)
+    if csv_path:
+        write_csv(csv_path, points)
+        console.print(f"Throughput curve saved to {csv_path}")
+
+
+if __name__ == "__main__":
+    sweep()
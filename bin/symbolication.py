@@ -4,28 +4,48 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-# Usage: bin/symbolication.py STACKSDIR HOST/URL
+# Usage: bin/symbolication.py [--concurrency N] [--workers N] STACKSDIR|CORPUSFILE HOST/URL
+#
+# Usage: bin/symbolication.py --record SCHEDULE [OPTIONS] STACKSDIR|CORPUSFILE HOST/URL
+#        bin/symbolication.py --replay SCHEDULE [--speed N] STACKSDIR|CORPUSFILE HOST/URL
 
+import asyncio
+import contextlib
 import copy
 import datetime
 import json
-import os
+import multiprocessing
+import queue
 import random
-import statistics
 import time
 from urllib.parse import urlparse
 
+import aiohttp
 import click
-import requests
-from requests.exceptions import ConnectionError
-from rich import box
 from rich.console import Console
 from rich.progress import Progress
-from rich.table import Table
+
+from cacheplan import OrderError, load_order
+from modulestats import ModuleStats, print_module_summary
+from resultlog import COMPRESSION_EXTENSIONS, ResultLogWriter, payload_hash
+from schedule import ScheduleMismatchError, ScheduleWriter, load_schedule
+from stackcorpus import jobs_body, open_stacks
+from symstats import SymbolicationStats, print_summary, time_fmt
 
 
 TIMEOUT = 120
 
+# How long idle connections are kept in the pool for re-use
+KEEPALIVE_TIMEOUT = 30
+
+# With --workers, workers send results to the coordinator in batches of this
+# many results or after this many seconds, whichever comes first
+WORKER_BATCH_RESULTS = 100
+WORKER_BATCH_SECONDS = 0.25
+
+# Seconds the workers get to start up before they start sending together
+WORKER_START_DELAY = 1.0
+
 EMPTY_DEBUG = {
     "time": 0,
     "modules": {
@@ -57,79 +77,464 @@ EMPTY_DEBUG = {
 }
 
 
-def sizeof_fmt(num, suffix="b"):
-    for unit in ["", "k", "m", "g", "t", "p", "e", "z"]:
-        if abs(num) < 1024.0:
-            return f"{num:,.2f} {unit}{suffix}"
-        num /= 1024.0
-    return f"{num:,.2f} Yi{suffix}"
+class BadResponseError(aiohttp.ClientError):
+    pass
 
 
-def time_fmt(num):
-    return f"{num:,.3f} s"
+async def post_patiently(console, session, url, body, attempts=0):
+    """Return delta, data for successful post of an encoded JSON body"""
+    try:
+        start_time = time.time()
+        headers = {"Debug": "true", "Content-Type": "application/json"}
+        async with session.post(url, data=body, headers=headers) as resp:
+            if resp.status != 200:
+                content = await resp.read()
+                console.print(f"PAYLOAD: {body.decode('utf-8')}")
+                console.print(f"Got HTTP {resp.status}")
+                console.print(f"CONTENT: {content}")
+                raise BadResponseError()
+
+            data = await resp.json()
+        return time.time() - start_time, data
+
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if attempts > 3:
+            raise
+        await asyncio.sleep(2)
+        return await post_patiently(console, session, url, body, attempts=attempts + 1)
+
 
+def symbolicate_url(url):
+    """Return the symbolicate/v5 URL for a host or URL"""
+    url_parsed = urlparse(url)
+    if not url_parsed.path or url_parsed.path == "/":
+        if not url_parsed.path:
+            url += "/"
+        url += "symbolicate/v5"
 
-def number_fmt(num):
-    return f"{num:,.3f}"
+    if not urlparse(url).path.endswith("/v5"):
+        raise click.BadParameter("symbolication.py only supports v5")
+    return url
+
+
+def iter_batches(stacks, batches):
+    """Yield (names, body) for each batch of stack indexes, like from a schedule"""
+    for batch in batches:
+        names = [stacks.name(index) for index in batch]
+        yield names, jobs_body([stacks.payload_bytes(index) for index in batch])
+
+
+def summarize_debug(delta, debug):
+    """Convert a response debug block into a data item for the summary"""
+    return {
+        "time": delta,
+        "cache": {
+            "count": debug.get("cache_lookups", {}).get("count", 0),
+            "hits": debug.get("cache_lookups", {}).get("hits", 0),
+            "time": debug.get("cache_lookups", {}).get("time", 0.0),
+        },
+        "downloads": {
+            "count": debug.get("downloads", {}).get("count", 0),
+            # FIXME( the "time" and "size" fields are wrong in
+            # the debug output, so we sum them manually
+            "time": sum(
+                debug.get("downloads", {}).get("time_per_module", {}).values() or [0]
+            ),
+            "size": sum(
+                debug.get("downloads", {}).get("size_per_module", {}).values() or [0]
+            ),
+        },
+    }
+
+
+def make_result(names, body, delta, resp, wait, log_responses=False):
+    """Return (debug, result log record, data item) for a successful request"""
+    debug = resp.get("debug", copy.deepcopy(EMPTY_DEBUG))
+
+    record = {
+        "ts": time.time(),
+        "files": names,
+        "jobs": len(names),
+        "payload_sha256": payload_hash(body),
+        "time": delta,
+        "debug": debug,
+    }
+    if wait is not None:
+        record["queue_time"] = wait
+    if log_responses:
+        record["response"] = {key: val for key, val in resp.items() if key != "debug"}
+
+    data_item = summarize_debug(delta, debug)
+    if wait is not None:
+        # Time between when the request should have been sent and when it was
+        # sent
+        data_item["queue"] = {"time": wait}
+    return debug, record, data_item
+
+
+def print_result(console, debug, data_item):
+    """Print per-module downloads and a one-line summary for a response"""
+    for module in debug.get("downloads", {}).get("size_per_module", {}).keys():
+        module_size = debug["downloads"]["size_per_module"][module]
+        module_time = debug["downloads"]["time_per_module"][module]
+        speed = module_size / module_time / (1024 * 1024)
+        console.print(
+            module,
+            f"{module_size:,}",
+            f"{module_time:,.2f} s",
+            f"{speed:,.2f} mb/s",
+        )
 
+    cache_data = data_item["cache"]
+    if cache_data["count"]:
+        _cache_lookups = (
+            f"{cache_data['count']} cache lookups "
+            + f"({cache_data['hits']}/{cache_data['count']}  {cache_data['time']:,.2f} s)"
+        )
+    else:
+        _cache_lookups = "no cache data"
 
-def listify(d):
-    for key, value in d.items():
-        if isinstance(value, dict):
-            listify(value)
-        else:
-            d[key] = [value]
+    download_data = data_item["downloads"]
+    if download_data["count"]:
+        _downloads = (
+            f"{download_data['count']} downloads "
+            + f"({download_data['size']:,} b  {download_data['time']:,.2f} s)"
+        )
+    else:
+        _downloads = "no download data"
 
+    delta_time = time_fmt(data_item["time"])
 
-def appendify(source, dest):
-    for key, value in source.items():
-        if isinstance(value, dict):
-            appendify(value, dest.setdefault(key, {}))
-        else:
-            dest.setdefault(key, []).append(value)
+    console.print(f"{_cache_lookups:<40}{_downloads:<40}{delta_time}")
 
 
-def _stats(r):
-    """Takes out 0s and then returns avg, 50%, and stddev of a sequence"""
-    r = [item for item in r if item]
-    if len(r) == 0:
-        return 0.0, 0.0, 0.0
+def iter_arrivals(rate, arrival, rng=None):
+    """Yield send offsets in seconds from the start of an open-loop run
 
-    if len(r) == 1:
-        return r[0], r[0], 0.0
+    :param rate: requests per second
+    :param arrival: "poisson" for exponentially distributed gaps between
+        requests or "fixed" for evenly spaced requests
+    :param rng: random.Random to draw gaps from; default is the random module
 
-    r = list(sorted(r))
-    return (
-        statistics.mean(r),
-        r[len(r) // 2],
-        statistics.stdev(r),
+    """
+    rng = rng or random
+    offset = 0.0
+    while True:
+        yield offset
+        if arrival == "poisson":
+            offset += rng.expovariate(rate)
+        else:
+            offset += 1.0 / rate
+
+
+async def drive(
+    url,
+    bundles,
+    concurrency,
+    on_result,
+    console,
+    rate=None,
+    arrival="poisson",
+    offsets=None,
+    start_time=None,
+    on_send=None,
+    rng=None,
+):
+    """Send bundles to url with up to concurrency requests in flight
+
+    All requests share one keep-alive connection pool which is bounded by
+    concurrency. For every successful request, calls
+    ``on_result(names, body, delta, resp, wait)``.
+
+    Without a rate or offsets, this is closed-loop: each connection sends the
+    next bundle when the previous response comes back and ``wait`` is None.
+
+    With a rate, this is open-loop: bundles are sent on an arrival schedule
+    (drawn from rng) regardless of how quickly the server responds. ``delta``
+    is measured from the intended send time so time spent waiting for a
+    connection (or for the event loop) counts as latency and ``wait`` is that
+    portion of it. With offsets, it's open-loop with bundles sent those many
+    seconds from the start, like when replaying a schedule.
+
+    The run starts at start_time, if it's given, or right away. For every
+    bundle sent, calls ``on_send(names, offset)`` with the seconds from the
+    start that it was (or was meant to be) sent.
+
+    :returns: number of bundles that failed after retrying
+
+    """
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, keepalive_timeout=KEEPALIVE_TIMEOUT
     )
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    failures = 0
 
+    # Open-loop requests wait here for a free connection
+    connection_slots = asyncio.Semaphore(concurrency)
 
-def post_patiently(console, url, **kwargs):
-    """Return delta, data for successful post"""
-    attempts = kwargs.pop("attempts", 0)
-    payload = kwargs["json"]
-    try:
+    async def send(session, names, body):
+        nonlocal failures
+        if on_send is not None:
+            on_send(names, time.time() - start_time)
+        try:
+            delta, resp = await post_patiently(console, session, url, body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            console.print(f"Failed {', '.join(names)}: {exc!r}")
+            failures += 1
+            return
+        on_result(names, body, delta, resp, None)
+
+    async def send_scheduled(session, names, body, intended_time):
+        nonlocal failures
+        async with connection_slots:
+            wait = time.time() - intended_time
+            try:
+                _, resp = await post_patiently(console, session, url, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                console.print(f"Failed {', '.join(names)}: {exc!r}")
+                failures += 1
+                return
+        on_result(names, body, time.time() - intended_time, resp, wait)
+
+    async def worker(session):
+        # All workers pull from the same iterator, so each bundle is sent once
+        for names, body in bundles:
+            await send(session, names, body)
+
+    async def scheduler(session):
+        in_flight = set()
+        arrivals = offsets if offsets is not None else iter_arrivals(rate, arrival, rng)
+        for (names, body), offset in zip(bundles, arrivals, strict=False):
+            intended_time = start_time + offset
+            delay = intended_time - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if on_send is not None:
+                on_send(names, offset)
+            task = asyncio.create_task(
+                send_scheduled(session, names, body, intended_time)
+            )
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    if start_time is None:
         start_time = time.time()
-        options = {
-            "headers": {"Debug": "true"},
-            "timeout": TIMEOUT,
-        }
-        resp = requests.post(url, json=payload, **options)
-        if resp.status_code != 200:
-            console.print(f"PAYLOAD: {json.dumps(payload)}")
-            console.print(f"Got HTTP {resp.status_code}")
-            console.print(f"CONTENT: {resp.content}")
-            raise ConnectionError()
-
-        return time.time() - start_time, resp.json()
-
-    except ConnectionError:
-        if attempts > 3:
-            raise
-        time.sleep(2)
-        return post_patiently(console, url, attempts=attempts + 1, **kwargs)
+    elif start_time > time.time():
+        await asyncio.sleep(start_time - time.time())
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if rate or offsets is not None:
+            await scheduler(session)
+        else:
+            await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+
+    return failures
+
+
+def split_batches(order, batch_size):
+    """Split order into batches of stack indexes
+
+    Stacks that don't fill a complete batch at the end are dropped.
+
+    """
+    return [
+        order[start : start + batch_size]
+        for start in range(0, len(order) - batch_size + 1, batch_size)
+    ]
+
+
+def run_worker(
+    worker,
+    input_dir,
+    url,
+    batches,
+    offsets,
+    start_time,
+    concurrency,
+    rate,
+    arrival,
+    seed,
+    log_responses,
+    module_report,
+    record,
+    results,
+):
+    """Send a shard of the batches and stream the results to the coordinator
+
+    This runs in a worker process. It puts ``("results", lines, stats,
+    module_stats, sent)`` messages on the results queue with encoded result log
+    lines and the stats for those requests (module_stats is None without
+    module_report) and, with record, the (offset, indexes) of the batches sent.
+    It puts ``("done", worker, failures)`` when it's finished.
+
+    """
+    console = Console(stderr=True)
+    stacks = open_stacks(input_dir)
+    name_to_index = (
+        {stacks.name(index): index for batch in batches for index in batch}
+        if record
+        else None
+    )
+
+    lines = []
+    sent = []
+    batch_stats = SymbolicationStats()
+    batch_modules = ModuleStats() if module_report else None
+    last_sent = time.monotonic()
+
+    def send():
+        nonlocal lines, sent, batch_stats, batch_modules, last_sent
+        if lines or sent:
+            results.put(("results", lines, batch_stats, batch_modules, sent))
+        lines = []
+        sent = []
+        batch_stats = SymbolicationStats()
+        batch_modules = ModuleStats() if module_report else None
+        last_sent = time.monotonic()
+
+    def on_send(names, offset):
+        sent.append((offset, [name_to_index[name] for name in names]))
+
+    def on_result(names, body, delta, resp, wait):
+        debug, record, data_item = make_result(
+            names, body, delta, resp, wait, log_responses=log_responses
+        )
+        lines.append(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+        batch_stats.add(data_item)
+        if batch_modules is not None:
+            batch_modules.add(debug)
+        if (
+            len(lines) >= WORKER_BATCH_RESULTS
+            or time.monotonic() - last_sent >= WORKER_BATCH_SECONDS
+        ):
+            send()
+
+    failures = 0
+    try:
+        failures = asyncio.run(
+            drive(
+                url,
+                iter_batches(stacks, batches),
+                concurrency,
+                on_result,
+                console,
+                rate=rate,
+                arrival=arrival,
+                offsets=offsets,
+                start_time=start_time,
+                on_send=on_send if record else None,
+                rng=random.Random(f"{seed}:{worker}") if seed is not None else None,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        send()
+        results.put(("done", worker, failures))
+
+
+def run_workers(
+    console,
+    progress,
+    task_id,
+    logfile,
+    stats,
+    workers,
+    input_dir,
+    url,
+    batches,
+    concurrency,
+    rate,
+    arrival,
+    log_responses,
+    offsets=None,
+    seed=None,
+    module_stats=None,
+    schedule=None,
+):
+    """Deal batches out to worker processes and collect their results
+
+    Workers split concurrency and rate, or the offsets to send batches at,
+    between them, and start at the same time. Their results are written to
+    logfile and merged into stats, and module_stats if it's given, as they come
+    in. The batches they send are added to schedule if it's given.
+
+    :returns: number of bundles that failed after retrying
+
+    """
+    results = multiprocessing.Queue()
+    # Give the workers time to load the stacks so they start together
+    start_time = time.time() + WORKER_START_DELAY
+    processes = {}
+    for worker in range(workers):
+        worker_concurrency = concurrency // workers + (
+            1 if worker < concurrency % workers else 0
+        )
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(
+                worker,
+                input_dir,
+                url,
+                batches[worker::workers],
+                offsets[worker::workers] if offsets is not None else None,
+                start_time,
+                worker_concurrency,
+                rate / workers if rate else None,
+                arrival,
+                seed,
+                log_responses,
+                module_stats is not None,
+                schedule is not None,
+                results,
+            ),
+            daemon=True,
+        )
+        process.start()
+        processes[worker] = process
+
+    failures = 0
+    running = set(processes)
+    with progress:
+        while running:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                # Workers always say they're done unless they crash
+                for worker in list(running):
+                    exitcode = processes[worker].exitcode
+                    if exitcode:
+                        console.print(f"Worker {worker} exited with code {exitcode}")
+                        running.discard(worker)
+                continue
+            except KeyboardInterrupt:
+                # The workers are interrupted too; keep collecting what they
+                # send until they're done
+                console.print("Keyboard interrupt...")
+                continue
+
+            if message[0] == "results":
+                _, lines, batch_stats, batch_modules, sent = message
+                for line in lines:
+                    logfile.write_line(line)
+                stats.merge(batch_stats)
+                if module_stats is not None:
+                    module_stats.merge(batch_modules)
+                if schedule is not None:
+                    for offset, indexes in sent:
+                        schedule.add(offset, indexes)
+                progress.advance(task_id, batch_stats.jobs)
+            else:
+                _, worker, worker_failures = message
+                failures += worker_failures
+                running.discard(worker)
+
+    for process in processes.values():
+        process.join()
+    return failures
 
 
 @click.command()
@@ -147,126 +552,266 @@ def post_patiently(console, url, **kwargs):
     type=int,
     help="Number of jobs to bundle per symbolication; default=1",
 )
+@click.option(
+    "--concurrency",
+    "-c",
+    default=1,
+    type=int,
+    help="Number of symbolication requests to keep in flight; default=1",
+)
+@click.option(
+    "--rate",
+    "-r",
+    default=None,
+    type=float,
+    help=(
+        "Send requests open-loop at this many requests/s; --concurrency caps the "
+        + "connections used; default=closed-loop"
+    ),
+)
+@click.option(
+    "--arrival",
+    default="poisson",
+    type=click.Choice(["poisson", "fixed"]),
+    help="Distribution of gaps between requests with --rate; default=poisson",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    type=int,
+    help=(
+        "Number of processes to send requests from; they split --concurrency and "
+        + "--rate between them; default=1"
+    ),
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for the order of stacks and the arrival schedule; default=random",
+)
+@click.option(
+    "--record",
+    default=None,
+    help=(
+        "Save the schedule of requests sent to this file (.gz to compress it) so "
+        + "it can be replayed with --replay"
+    ),
+)
+@click.option(
+    "--replay",
+    default=None,
+    help=(
+        "Send the requests in a schedule saved with --record, with the same "
+        + "stacks and timing; --concurrency caps the connections used"
+    ),
+)
+@click.option(
+    "--order",
+    default=None,
+    help=(
+        "Send stacks in the order listed in this file, like one made with "
+        + "plan-cache-warmness.py, rather than shuffled"
+    ),
+)
+@click.option(
+    "--speed",
+    default=1.0,
+    type=float,
+    help="With --replay, send requests this many times faster; default=1",
+)
+@click.option(
+    "--module-report",
+    default=0,
+    type=int,
+    help=(
+        "Add up download, parse, and save costs per module and print the N most "
+        + "expensive ones at the end; default=0 (off)"
+    ),
+)
+@click.option(
+    "--stats-file",
+    default=None,
+    help=(
+        "Save summary stats to this file so they can be merged with other runs "
+        + "using merge-symbolication-stats.py"
+    ),
+)
+@click.option(
+    "--log-compression",
+    default="gzip",
+    type=click.Choice(["gzip", "zstd", "none"]),
+    help="Compression for the result log; default=gzip",
+)
+@click.option(
+    "--log-responses/--no-log-responses",
+    default=False,
+    help="Include symbolicated stacks in the result log; default=no",
+)
 @click.argument("input_dir")
 @click.argument("url")
-def run(input_dir, url, limit=None, batch_size=1):
+def run(
+    input_dir,
+    url,
+    limit=None,
+    batch_size=1,
+    concurrency=1,
+    rate=None,
+    arrival=None,
+    workers=1,
+    seed=None,
+    record=None,
+    replay=None,
+    order=None,
+    speed=1.0,
+    module_report=0,
+    stats_file=None,
+    log_compression="gzip",
+    log_responses=False,
+):
     console = Console()
 
-    url_parsed = urlparse(url)
-    if not url_parsed.path or url_parsed.path == "/":
-        if not url_parsed.path:
-            url += "/"
-        url += "symbolicate/v5"
+    url = symbolicate_url(url)
 
-    if not urlparse(url).path.endswith("/v5"):
-        raise click.BadParameter("symbolication.py only supports v5")
+    if concurrency < 1:
+        raise click.BadParameter("concurrency must be at least 1")
 
-    data = []
+    if rate is not None and rate <= 0:
+        raise click.BadParameter("rate must be greater than 0")
 
-    files = [os.path.join(input_dir, x) for x in os.listdir(input_dir)]
-    console.print(f"Got {len(files)} files")
-    random.shuffle(files)
+    if workers < 1:
+        raise click.BadParameter("workers must be at least 1")
 
-    if limit is not None:
-        console.print(f"Limiting to {limit * batch_size} files")
-        files = files[: limit * batch_size]
+    if concurrency < workers:
+        raise click.BadParameter("concurrency must be at least the number of workers")
+
+    if replay and rate is not None:
+        raise click.BadParameter("--rate can't be used with --replay")
+
+    if replay and order:
+        raise click.BadParameter("--order can't be used with --replay")
+
+    if speed <= 0:
+        raise click.BadParameter("speed must be greater than 0")
+
+    stats = SymbolicationStats()
+    module_stats = ModuleStats() if module_report else None
+
+    rng = random.Random(seed)
+    stacks = open_stacks(input_dir)
+    console.print(f"Got {len(stacks)} stacks")
+
+    offsets = None
+    if replay:
+        try:
+            _, entries = load_schedule(replay, stacks)
+        except ScheduleMismatchError as exc:
+            raise click.BadParameter(str(exc)) from None
+        if limit is not None:
+            entries = entries[:limit]
+        batches = [indexes for _, indexes in entries]
+        offsets = [offset / speed for offset, _ in entries]
+        console.print(f"Replaying {len(batches)} requests from {replay} at {speed}x")
+    else:
+        if order:
+            try:
+                indexes = load_order(order, stacks)
+            except OrderError as exc:
+                raise click.BadParameter(str(exc)) from None
+            console.print(f"Sending {len(indexes)} stacks in the order in {order}")
+        else:
+            indexes = list(range(len(stacks)))
+            rng.shuffle(indexes)
+
+        if limit is not None:
+            console.print(f"Limiting to {limit * batch_size} stacks")
+            indexes = indexes[: limit * batch_size]
+        batches = split_batches(indexes, batch_size)
 
     now = datetime.datetime.now().strftime("%Y%m%d")
-    logfile_path = f"symbolication-{now}.log"
+    logfile_path = f"symbolication-{now}{COMPRESSION_EXTENSIONS[log_compression]}"
     console.print(f"All verbose logging goes into: {logfile_path}")
     console.print()
 
-    with open(logfile_path, "w") as logfile:
-        try:
-            bundle = []
-            progress = Progress(expand=True, transient=True)
-            with progress:
-                for filename in progress.track(
-                    files,
-                    description="Processing ...",
-                ):
-                    with open(filename) as f:
-                        payload = json.loads(f.read())
-                        payload.pop("version", None)
-                        bundle.append(payload)
-                        if len(bundle) < batch_size:
-                            continue
-                        else:
-                            payload = {"jobs": list(bundle)}
-                            bundle = []
-
-                    print(f"FILE: {filename}", file=logfile)
-                    print(f"PAYLOAD: {json.dumps(payload)}", file=logfile)
-
-                    delta, resp = post_patiently(progress.console, url, json=payload)
-
-                    print(f"RESPONSE: {json.dumps(resp)}", file=logfile)
-
-                    debug = resp.get("debug", copy.deepcopy(EMPTY_DEBUG))
-                    # progress.console.print(debug)
-                    for module in (
-                        debug.get("downloads", {}).get("size_per_module", {}).keys()
-                    ):
-                        module_size = debug["downloads"]["size_per_module"][module]
-                        module_time = debug["downloads"]["time_per_module"][module]
-                        speed = module_size / module_time / (1024 * 1024)
-                        progress.print(
-                            module,
-                            f"{module_size:,}",
-                            f"{module_time:,.2f} s",
-                            f"{speed:,.2f} mb/s",
-                        )
+    if record:
+        schedule = ScheduleWriter(
+            record,
+            stacks,
+            input=input_dir,
+            concurrency=concurrency,
+            rate=rate,
+            arrival=arrival,
+            seed=seed,
+            workers=workers,
+            replay=replay,
+            recorded=time.time(),
+        )
+    else:
+        schedule = contextlib.nullcontext()
+
+    failures = 0
+    with ResultLogWriter(logfile_path) as logfile, schedule:
+        progress = Progress(expand=True, transient=True)
+        task_id = progress.add_task("Processing ...", total=len(batches))
+
+        name_to_index = {}
+        if record and workers == 1:
+            name_to_index = {
+                stacks.name(index): index for batch in batches for index in batch
+            }
+
+        def on_send(names, offset):
+            schedule.add(offset, [name_to_index[name] for name in names])
+
+        def on_result(names, body, delta, resp, wait):
+            debug, record, data_item = make_result(
+                names, body, delta, resp, wait, log_responses=log_responses
+            )
+            logfile.write(record)
+            stats.add(data_item)
+            if module_stats is not None:
+                module_stats.add(debug)
+            print_result(progress.console, debug, data_item)
+            progress.advance(task_id)
 
-                    data_item = {
-                        "time": delta,
-                        "cache": {
-                            "count": debug.get("cache_lookups", {}).get("count", 0),
-                            "hits": debug.get("cache_lookups", {}).get("hits", 0),
-                            "time": debug.get("cache_lookups", {}).get("time", 0.0),
-                        },
-                        "downloads": {
-                            "count": debug.get("downloads", {}).get("count", 0),
-                            # FIXME( the "time" and "size" fields are wrong in
-                            # the debug output, so we sum them manually
-                            "time": sum(
-                                debug.get("downloads", {})
-                                .get("time_per_module", {})
-                                .values()
-                                or [0]
-                            ),
-                            "size": sum(
-                                debug.get("downloads", {})
-                                .get("size_per_module", {})
-                                .values()
-                                or [0]
-                            ),
-                        },
-                    }
-                    data.append(data_item)
-
-                    cache_data = data_item["cache"]
-                    if cache_data["count"]:
-                        _cache_lookups = (
-                            f"{cache_data['count']} cache lookups "
-                            + f"({cache_data['hits']}/{cache_data['count']}  {cache_data['time']:,.2f} s)"
-                        )
-                    else:
-                        _cache_lookups = "no cache data"
-
-                    download_data = data_item["downloads"]
-                    if download_data["count"]:
-                        _downloads = (
-                            f"{download_data['count']} downloads "
-                            + f"({download_data['size']:,} b  {download_data['time']:,.2f} s)"
+        try:
+            if workers > 1:
+                # Only the progress bar is shown; each result isn't printed
+                failures = run_workers(
+                    console,
+                    progress,
+                    task_id,
+                    logfile,
+                    stats,
+                    workers,
+                    input_dir,
+                    url,
+                    batches,
+                    concurrency,
+                    rate,
+                    arrival,
+                    log_responses,
+                    offsets=offsets,
+                    seed=seed,
+                    module_stats=module_stats,
+                    schedule=schedule if record else None,
+                )
+            else:
+                with progress:
+                    failures = asyncio.run(
+                        drive(
+                            url,
+                            iter_batches(stacks, batches),
+                            concurrency,
+                            on_result,
+                            progress.console,
+                            rate=rate,
+                            arrival=arrival,
+                            offsets=offsets,
+                            on_send=on_send if record else None,
+                            rng=rng,
                         )
-                    else:
-                        _downloads = "no download data"
-
-                    # progress.console.print(debug)
-                    delta_time = time_fmt(delta)
-
-                    progress.console.print(
-                        f"{_cache_lookups:<40}{_downloads:<40}{delta_time}"
                     )
 
         except KeyboardInterrupt:
@@ -274,79 +819,28 @@ def run(input_dir, url, limit=None, batch_size=1):
 
     # Display summary data and conclusion
     console.print("\n")
-    if len(data) == (len(files) * batch_size):
-        console.print(f"TOTAL {len(data)} JOBS DONE")
+    if stats.jobs == len(batches):
+        console.print(f"TOTAL {stats.jobs} JOBS DONE")
     else:
-        console.print(f"TOTAL SO FAR {len(data)} JOBS DONE")
-
-    one = copy.deepcopy(data[0])
-    listify(one)
-    for item in data[1:]:
-        appendify(item, one)
-
-    # console.print(one)
-
-    table = Table(show_edge=False, box=box.MARKDOWN)
-    table.add_column("Key", justify="left")
-    table.add_column("Sum", justify="right")
-    table.add_column("Avg", justify="right")
-    table.add_column("50%", justify="right")
-    table.add_column("StdDev", justify="right")
-
-    def printify(objects, p=30, n=10, prefix=""):
-        for key in sorted(objects):
-            value = objects.get(key, None)
-            if isinstance(value, dict):
-                printify(value, p=p, n=n, prefix=prefix + key + ".")
-            else:
-                value = value or 0.0
-                average, median, stddev = _stats(value)
-                if key.endswith("time"):
-                    table.add_row(
-                        prefix + key,
-                        time_fmt(sum(value)),
-                        time_fmt(average),
-                        time_fmt(median),
-                        number_fmt(stddev),
-                    )
+        console.print(f"TOTAL SO FAR {stats.jobs} JOBS DONE")
+    if failures:
+        console.print(f"{failures} JOBS FAILED")
 
-                elif key.endswith("size"):
-                    table.add_row(
-                        prefix + key,
-                        sizeof_fmt(sum(value)),
-                        sizeof_fmt(average),
-                        sizeof_fmt(median),
-                        number_fmt(stddev),
-                    )
+    if record:
+        console.print(f"Schedule of {schedule.requests} requests saved to: {record}")
 
-                else:
-                    table.add_row(
-                        prefix + key,
-                        number_fmt(sum(value)),
-                    )
+    if stats_file:
+        stats.save(stats_file)
+        console.print(f"Stats saved to: {stats_file}")
 
-    printify(one)
+    if not stats.jobs:
+        return
 
-    console.print(table)
+    print_summary(console, stats)
 
-    console.print("\n")
-    console.print("In conclusion...")
-    if one["downloads"]["count"] and sum(one["downloads"]["time"]):
-        downloads_speed = sizeof_fmt(
-            sum(one["downloads"]["size"]) / sum(one["downloads"]["time"])
-        )
-        console.print(f"Final Average Download Speed:    {downloads_speed}/s")
-    total_time_everything_else = (
-        sum(one["time"]) - sum(one["downloads"]["time"]) - sum(one["cache"]["time"])
-    )
-    console.print(
-        "Total time NOT downloading or querying cache:    "
-        + time_fmt(total_time_everything_else)
-    )
-    console.print(
-        "Average time NOT downloading or querying cache:  "
-        + time_fmt(total_time_everything_else / len(one["time"]))
-    )
+    if module_stats is not None:
+        console.print("\n")
+        print_module_summary(console, module_stats, top=module_report)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Builds and queries the index over the uploaded symbol bundles in
+# symbols-uploaded/. See bin/symbolsindex.py for what's in it.
+#
+# The index is built automatically when it's needed, so "build" is only needed
+# to build it ahead of time.
+#
+# Usage: ./bin/symbols-index.py build
+#
+# Usage: ./bin/symbols-index.py query [--min-size SIZE] [--max-size SIZE] [--top N]
+
+import os
+import time
+
+import click
+
+from castore import parse_size
+from symbolsindex import INDEX_FILENAME, SYMBOLS_UPLOADED_DIR, SymbolsIndex
+from symstats import sizeof_fmt
+
+
+@click.group()
+def symbols_index_group():
+    """Index of the uploaded symbol bundles in symbols-uploaded/."""
+
+
+@symbols_index_group.command("build")
+@click.option(
+    "--symbols-dir",
+    default=SYMBOLS_UPLOADED_DIR,
+    help="Directory of symbols-uploaded .json.gz files.",
+)
+def symbols_index_build(symbols_dir):
+    """Build the index."""
+    start_time = time.perf_counter()
+    index = SymbolsIndex.build(symbols_dir)
+    index.save(os.path.join(symbols_dir, INDEX_FILENAME))
+    took = time.perf_counter() - start_time
+    print(
+        f"Indexed {len(index):,} bundles from {len(index.sources)} files "
+        + f"in {took:.2f}s."
+    )
+
+
+@symbols_index_group.command("query")
+@click.option(
+    "--symbols-dir",
+    default=SYMBOLS_UPLOADED_DIR,
+    help="Directory of symbols-uploaded .json.gz files.",
+)
+@click.option("--min-size", default=None, help='Smallest bundle size, like "200m".')
+@click.option("--max-size", default=None, help='Largest bundle size, like "500m".')
+@click.option(
+    "--top",
+    default=None,
+    type=int,
+    help="Only show the N bundles with the most files, most first.",
+)
+def symbols_index_query(symbols_dir, min_size, max_size, top):
+    """List bundles by size range and number of files."""
+    index = SymbolsIndex.open(symbols_dir)
+
+    start_time = time.perf_counter()
+    rows = index.select(parse_size(min_size), parse_size(max_size))
+    if top is not None:
+        rows = index.top_by_file_count(top, rows)
+    took = time.perf_counter() - start_time
+
+    for row in rows:
+        print(
+            index.date_str(row).ljust(34),
+            sizeof_fmt(index.size[row]).rjust(12),
+            f"{index.file_count[row]:,} files".rjust(12),
+            index.sources[index.source[row]][0],
+        )
+    print(f"{len(rows):,} of {len(index):,} bundles ({took * 1000:.2f}ms)")
+
+
+if __name__ == "__main__":
+    symbols_index_group()
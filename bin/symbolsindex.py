@@ -0,0 +1,270 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Index over the uploaded symbol bundles in symbols-uploaded/.
+#
+# Each bundle (a hit in one of the *.json.gz files) is a row with its upload
+# date, size, number of files, which .json.gz file it's in, and where it is
+# in that file once decompressed. Rows are sorted by size and kept in arrays,
+# so size range queries are a binary search, and there's a precomputed order
+# by file count for top-N queries. Loading a bundle decompresses its file up to
+# the end of the bundle and decodes just the bundle's bytes.
+#
+# Layout (all integers are little-endian):
+#
+#     MAGIC
+#     header length (uint64) and header JSON: row count and the source files
+#       with their sizes and modification times
+#     columns, each padded to 8 bytes: date (int64 microseconds since the
+#       epoch), size (uint64), file count (uint32), source file (uint16),
+#       start and end byte offsets of the bundle's JSON in the decompressed
+#       file (uint64 each),
+#       rows in order by file count, most files first (uint32)
+#
+# The index is rebuilt when the files in symbols-uploaded/ change.
+
+from array import array
+import bisect
+import datetime
+import glob
+import gzip
+import json
+import os
+import struct
+import sys
+
+
+MAGIC = b"SYMIDX02"
+HEADER_LENGTH = struct.Struct("<Q")
+
+SYMBOLS_UPLOADED_DIR = "symbols-uploaded"
+INDEX_FILENAME = "index.idx"
+
+# Column name -> array typecode, in the order they're stored
+COLUMNS = [
+    ("date", "q"),
+    ("size", "Q"),
+    ("file_count", "I"),
+    ("source", "H"),
+    ("start", "Q"),
+    ("end", "Q"),
+    ("by_file_count", "I"),
+]
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+def _source_files(symbols_dir):
+    """Return [name, size, mtime_ns] for the *.json.gz files in symbols_dir"""
+    sources = []
+    for path in sorted(glob.glob(os.path.join(symbols_dir, "*.json.gz"))):
+        stat = os.stat(path)
+        sources.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return sources
+
+
+def _iter_hits(data):
+    """Yield (hit, start, end) for each hit in a symbols-uploaded JSON document
+
+    :param data: the document as UTF-8 bytes; start and end are offsets in it
+
+    """
+    text = data.decode("utf-8")
+    decoder = json.JSONDecoder()
+    # Offsets in text are characters; count the bytes up to them as they go by
+    # unless every character is one byte
+    one_byte = len(text) == len(data)
+    last_pos = last_offset = 0
+
+    def byte_offset(pos):
+        nonlocal last_pos, last_offset
+        if one_byte:
+            return pos
+        last_offset += len(text[last_pos:pos].encode("utf-8"))
+        last_pos = pos
+        return last_offset
+
+    pos = text.index("[", text.index('"hits"')) + 1
+    while True:
+        while text[pos] in " \t\r\n,":
+            pos += 1
+        if text[pos] == "]":
+            return
+        hit, end = decoder.raw_decode(text, pos)
+        yield hit, byte_offset(pos), byte_offset(end)
+        pos = end
+
+
+def _read_bytes(path):
+    with gzip.open(path, "rb") as fp:
+        return fp.read()
+
+
+def parse_date(value):
+    """Return microseconds since the epoch for an ISO 8601 date"""
+    date = datetime.datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return round(date.timestamp() * 1_000_000)
+
+
+def format_date(micros):
+    return datetime.datetime.fromtimestamp(
+        micros / 1_000_000, datetime.timezone.utc
+    ).isoformat()
+
+
+class SymbolsIndex:
+    """Array-backed index of the bundles in symbols-uploaded/"""
+
+    def __init__(self, symbols_dir, sources, columns):
+        self.symbols_dir = symbols_dir
+        self.sources = sources
+        for name, _ in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.size)
+
+    @classmethod
+    def build(cls, symbols_dir=SYMBOLS_UPLOADED_DIR):
+        sources = _source_files(symbols_dir)
+        if len(sources) > 0xFFFF:
+            raise IndexFormatError("too many files to index")
+
+        rows = []
+        for source_id, (name, _, _) in enumerate(sources):
+            data = _read_bytes(os.path.join(symbols_dir, name))
+            for hit, start, end in _iter_hits(data):
+                content = hit.get("content") or {}
+                file_count = len(content.get("added", [])) + len(
+                    content.get("existed", [])
+                )
+                date = parse_date(hit["date"])
+                rows.append((hit["size"], date, file_count, source_id, start, end))
+
+        rows.sort()
+        columns = {
+            "size": array("Q", (row[0] for row in rows)),
+            "date": array("q", (row[1] for row in rows)),
+            "file_count": array("I", (row[2] for row in rows)),
+            "source": array("H", (row[3] for row in rows)),
+            "start": array("Q", (row[4] for row in rows)),
+            "end": array("Q", (row[5] for row in rows)),
+        }
+        file_counts = columns["file_count"]
+        columns["by_file_count"] = array(
+            "I", sorted(range(len(rows)), key=lambda row: -file_counts[row])
+        )
+        return cls(symbols_dir, sources, columns)
+
+    def save(self, path):
+        header = json.dumps({"count": len(self), "sources": self.sources})
+        header = header.encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(HEADER_LENGTH.pack(len(header)))
+            fp.write(header)
+            for name, _ in COLUMNS:
+                fp.write(b"\0" * (-fp.tell() % 8))
+                column = getattr(self, name)
+                if sys.byteorder != "little":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                fp.write(column.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, symbols_dir=SYMBOLS_UPLOADED_DIR):
+        with open(path, "rb") as fp:
+            data = fp.read()
+        if data[: len(MAGIC)] != MAGIC:
+            raise IndexFormatError(f"{path} is not a symbols-uploaded index")
+
+        pos = len(MAGIC)
+        (header_length,) = HEADER_LENGTH.unpack_from(data, pos)
+        pos += HEADER_LENGTH.size
+        header = json.loads(data[pos : pos + header_length])
+        pos += header_length
+
+        count = header["count"]
+        columns = {}
+        for name, typecode in COLUMNS:
+            pos += -pos % 8
+            column = array(typecode)
+            length = count * column.itemsize
+            if pos + length > len(data):
+                raise IndexFormatError(f"{path} is truncated")
+            column.frombytes(data[pos : pos + length])
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns[name] = column
+            pos += length
+        return cls(symbols_dir, header["sources"], columns)
+
+    @classmethod
+    def open(cls, symbols_dir=SYMBOLS_UPLOADED_DIR, path=None):
+        """Load the index for symbols_dir, building it first if it's stale"""
+        path = path or os.path.join(symbols_dir, INDEX_FILENAME)
+        try:
+            index = cls.load(path, symbols_dir=symbols_dir)
+        except (FileNotFoundError, IndexFormatError):
+            index = None
+        if index is None or index.sources != _source_files(symbols_dir):
+            index = cls.build(symbols_dir)
+            index.save(path)
+        return index
+
+    def select(self, min_size=None, max_size=None):
+        """Return the range of rows with sizes between min_size and max_size"""
+        lo = 0 if min_size is None else bisect.bisect_left(self.size, min_size)
+        hi = len(self) if max_size is None else bisect.bisect_right(self.size, max_size)
+        return range(lo, max(lo, hi))
+
+    def top_by_file_count(self, n, rows=None):
+        """Return up to n rows with the most files, most first
+
+        :param rows: only consider these rows, like the result of select()
+
+        """
+        if rows is None:
+            return list(self.by_file_count[:n])
+        # Checking if a row is in a range doesn't go through the range
+        wanted = rows if isinstance(rows, range) else set(rows)
+        top = []
+        for row in self.by_file_count:
+            if row in wanted:
+                top.append(row)
+                if len(top) >= n:
+                    break
+        return top
+
+    def source_path(self, row):
+        return os.path.join(self.symbols_dir, self.sources[self.source[row]][0])
+
+    def date_str(self, row):
+        return format_date(self.date[row])
+
+    def bundle(self, row):
+        """Return the full bundle for a row as it appears in its source file"""
+        with gzip.open(self.source_path(row), "rb") as fp:
+            fp.seek(self.start[row])
+            return json.loads(fp.read(self.end[row] - self.start[row]))
+
+    def bundles(self, rows):
+        """Yield (row, bundle) for rows, reading each source file once
+
+        Bundles come in order by source file rather than in the order of rows.
+
+        """
+        by_source = {}
+        for row in rows:
+            by_source.setdefault(self.source[row], []).append(row)
+        for source_id in sorted(by_source):
+            data = _read_bytes(self.source_path(by_source[source_id][0]))
+            for row in by_source[source_id]:
+                yield row, json.loads(data[self.start[row] : self.end[row]])
@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Local store of symbol files for building upload zips.
+#
+# Symbol files are kept by debug_file/debug_id/filename in a ContentStore, so
+# a file shared by several uploaded bundles is downloaded and stored once, the
+# store stays within a byte budget by dropping the least recently used files,
+# and files are checked against their sha256 before they're used.
+
+from castore import ContentStore
+
+
+class SymbolStore:
+    """Symbol files by debug_file/debug_id/filename
+
+    :param root: directory for the store
+    :param max_size: byte budget; None for no budget
+    :param verify: whether to check a file's content before returning it
+
+    """
+
+    def __init__(self, root, max_size=None, verify=True):
+        self.store = ContentStore(root, max_size=max_size)
+        self.verify = verify
+
+    @staticmethod
+    def key_for(path):
+        """Return the store key for a symbols path or upload URI
+
+        Takes "debug_file/debug_id/filename", "v1/debug_file/debug_id/filename",
+        or a URI from symbols-uploaded like "BUCKET,v1/debug_file/...". Bundles
+        also have a few files that aren't symbol files, like
+        "v1/firefox-...-symbols.txt"; those are kept by their path.
+
+        """
+        path = path.split(",", 1)[-1]
+        parts = [part for part in path.split("/") if part]
+        if parts and parts[0] == "v1":
+            parts = parts[1:]
+        if not parts:
+            raise ValueError(f"{path!r} is not a symbols path")
+        return "/".join(parts)
+
+    def __contains__(self, path):
+        return self.store.info(self.key_for(path)) is not None
+
+    def get_path(self, path):
+        """Return the path of the stored file, or None if it's not stored
+
+        Files that fail verification are dropped and treated as not stored.
+
+        """
+        return self.store.get_path(self.key_for(path), verify=self.verify)
+
+    def writer(self, path, meta=None):
+        """Return a StoreWriter to stream a symbol file into the store"""
+        return self.store.writer(self.key_for(path), meta=meta)
+
+    def stats(self):
+        """Return (number of symbol files, number of distinct files, total bytes)"""
+        return self.store.stats()
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,174 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Summary statistics for symbolication runs.
+#
+# Times and sizes are kept in fixed-memory histograms and everything else is
+# summed, so memory use doesn't grow with the length of a run. Stats can be
+# saved to a file and merged with stats from other runs or processes.
+
+import json
+
+from rich import box
+from rich.table import Table
+
+from hdrhist import Histogram
+
+
+# Times are in seconds; keep them with microsecond resolution
+TIME_SCALE = 1_000_000
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def sizeof_fmt(num, suffix="b"):
+    for unit in ["", "k", "m", "g", "t", "p", "e", "z"]:
+        if abs(num) < 1024.0:
+            return f"{num:,.2f} {unit}{suffix}"
+        num /= 1024.0
+    return f"{num:,.2f} Yi{suffix}"
+
+
+def time_fmt(num):
+    return f"{num:,.3f} s"
+
+
+def number_fmt(num):
+    return f"{num:,.3f}"
+
+
+def flatten(d, prefix=""):
+    """Yield (dotted key, value) for all the leaves of a nested dict"""
+    for key, value in d.items():
+        if isinstance(value, dict):
+            yield from flatten(value, prefix=prefix + key + ".")
+        else:
+            yield prefix + key, value
+
+
+class SymbolicationStats:
+    """Aggregates data items for symbolication requests
+
+    Keys ending in "time" or "size" are recorded in histograms. All other keys
+    are counters which are summed.
+
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.counters = {}
+        self.histograms = {}
+
+    def _histogram(self, key):
+        if key not in self.histograms:
+            scale = TIME_SCALE if key.endswith("time") else 1
+            self.histograms[key] = Histogram(scale=scale)
+        return self.histograms[key]
+
+    def add(self, data_item):
+        """Add the data item for one request"""
+        self.jobs += 1
+        for key, value in flatten(data_item):
+            if key.endswith("time") or key.endswith("size"):
+                hist = self._histogram(key)
+                # Zeros mean there was nothing to time, so they're left out of
+                # the distribution
+                if value:
+                    hist.record(value)
+            else:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def merge(self, other):
+        """Add everything in other to these stats"""
+        self.jobs += other.jobs
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, hist in other.histograms.items():
+            self._histogram(key).merge(hist)
+
+    def total(self, key):
+        if key in self.histograms:
+            return self.histograms[key].total
+        return self.counters.get(key, 0)
+
+    def to_dict(self):
+        return {
+            "jobs": self.jobs,
+            "counters": self.counters,
+            "histograms": {
+                key: hist.to_dict() for key, hist in self.histograms.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.jobs = data["jobs"]
+        stats.counters = dict(data["counters"])
+        stats.histograms = {
+            key: Histogram.from_dict(hist_data)
+            for key, hist_data in data["histograms"].items()
+        }
+        return stats
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            return cls.from_dict(json.load(fp))
+
+
+def print_summary(console, stats):
+    """Print the summary table and conclusion for stats"""
+    table = Table(show_edge=False, box=box.MARKDOWN)
+    table.add_column("Key", justify="left", no_wrap=True)
+    table.add_column("Sum", justify="right")
+    table.add_column("Avg", justify="right")
+    for percent in PERCENTILES:
+        table.add_column(f"{percent}%", justify="right")
+    table.add_column("Max", justify="right")
+
+    for key in sorted(set(stats.counters) | set(stats.histograms)):
+        if key in stats.histograms:
+            hist = stats.histograms[key]
+            fmt = time_fmt if key.endswith("time") else sizeof_fmt
+            table.add_row(
+                key,
+                fmt(hist.total),
+                fmt(hist.mean()),
+                *[fmt(hist.percentile(percent)) for percent in PERCENTILES],
+                fmt(hist.max or 0),
+            )
+        else:
+            table.add_row(key, number_fmt(stats.counters[key]))
+
+    console.print(table)
+
+    console.print("\n")
+    console.print("In conclusion...")
+    if stats.total("downloads.count") and stats.total("downloads.time"):
+        downloads_speed = sizeof_fmt(
+            stats.total("downloads.size") / stats.total("downloads.time")
+        )
+        console.print(f"Final Average Download Speed:    {downloads_speed}/s")
+    total_time_everything_else = (
+        stats.total("time") - stats.total("downloads.time") - stats.total("cache.time")
+    )
+    if "queue.time" in stats.histograms:
+        total_time_everything_else -= stats.total("queue.time")
+        console.print(
+            "Total time queued behind schedule:               "
+            + time_fmt(stats.total("queue.time"))
+        )
+    console.print(
+        "Total time NOT downloading or querying cache:    "
+        + time_fmt(total_time_everything_else)
+    )
+    console.print(
+        "Average time NOT downloading or querying cache:  "
+        + time_fmt(total_time_everything_else / stats.jobs)
+    )
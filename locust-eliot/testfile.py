@@ -2,19 +2,38 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 import json
 import pathlib
 import random
+import sys
 import time
 
+import gevent
 import jsonschema
 from locust import HttpUser, task
 from locust import events
+from locust.runners import MasterRunner, WorkerRunner
+from locust.stats import StatsError
+
+# Helpers shared with the scripts in bin/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "bin"))
+from cacheplan import load_order  # noqa: E402
+from stackcorpus import open_stacks  # noqa: E402
 
 
 TIMEOUT = 120
-SCHEMA = None
-PAYLOADS = []
+VALIDATOR = None
+VALIDATION_EXECUTOR = None
+STACKS = None
+# Stack indexes from --order, cycled through by all the users in this process
+ORDER = None
+# Numbers users in the order they start, for seeding them
+USER_NUMBERS = itertools.count()
+# Users in the whole test, for splitting --rate between them; on a worker, the
+# runner only knows its own share, so the master says
+TOTAL_USERS = None
 SCHEMADIR = "../schemas/"
 STACKSDIR = "../stacks/"
 
@@ -25,57 +44,282 @@ def load_schema(path):
     return schema
 
 
-def load_stack(path):
-    return json.loads(path.read_text())
+def init_validator(schema_path):
+    """Build the validator once; this also runs in validation processes"""
+    global VALIDATOR
+    VALIDATOR = jsonschema.Draft7Validator(load_schema(schema_path))
+
+
+def validate_content(content):
+    """Parse and validate a response body
+
+    :returns: (seconds it took, error message or None)
+
+    """
+    start_t = time.perf_counter()
+    try:
+        VALIDATOR.validate(json.loads(content))
+        error = None
+    except ValueError as exc:
+        error = f"response isn't JSON: {exc}"
+    except jsonschema.exceptions.ValidationError as exc:
+        error = f"response didn't validate: {exc.message}"
+    return time.perf_counter() - start_t, error
+
+
+def log_timing(environment, method, name, response_time, content_length, error=None):
+    """Log a timing as its own entry in the stats, outside the Aggregated row
+
+    Request events count towards the totals, which would count a request twice
+    or count things that aren't requests at all, like validations.
+
+    """
+    stats = environment.stats
+    entry = stats.get(name, method)
+    entry.log(response_time, content_length)
+    if error is not None:
+        entry.log_error(error)
+        key = StatsError.create_key(method, name, error)
+        if key not in stats.errors:
+            stats.errors[key] = StatsError(method, name, error)
+        stats.errors[key].occurred()
+
+
+def report_validation(environment, content, validate):
+    """Run validate and report its time as its own entry in the stats
+
+    This keeps validation time out of the request latency and totals.
+
+    """
+    seconds, error = validate()
+    log_timing(
+        environment,
+        "VALIDATE",
+        "symbolicate_api_response_v5",
+        seconds * 1000,
+        len(content),
+        error=AssertionError(error) if error else None,
+    )
+
+
+def submit_validation(environment, content):
+    """Validate a response body where --validate-in says to"""
+    where = environment.parsed_options.validate_in
+    if where == "inline":
+        report_validation(environment, content, lambda: validate_content(content))
+
+    elif where == "thread":
+        threadpool = gevent.get_hub().threadpool
+        gevent.spawn(
+            report_validation,
+            environment,
+            content,
+            lambda: threadpool.apply(validate_content, (content,)),
+        )
+
+    else:
+        gevent.spawn(
+            report_validation,
+            environment,
+            content,
+            lambda: VALIDATION_EXECUTOR.submit(validate_content, content).result(),
+        )
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    parser.add_argument(
+        "--stacks",
+        default=STACKSDIR,
+        help="Stacks directory or packed corpus file made with make-stacks.py pack",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help=(
+            "Send requests open-loop at this many requests/s across all users; "
+            + "0 for closed-loop"
+        ),
+    )
+    parser.add_argument(
+        "--arrival",
+        choices=["poisson", "fixed"],
+        default="poisson",
+        help="Distribution of gaps between requests with --rate",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help=(
+            "Seed for the payloads each user picks and its arrival gaps, so runs "
+            + "send the same sequence"
+        ),
+    )
+    parser.add_argument(
+        "--order",
+        default=None,
+        help=(
+            "Send stacks in the order listed in this file, like one made with "
+            + "plan-cache-warmness.py, instead of picking them at random"
+        ),
+    )
+    parser.add_argument(
+        "--validate-rate",
+        type=float,
+        default=1.0,
+        help="Fraction of responses to validate against the schema",
+    )
+    parser.add_argument(
+        "--validate-in",
+        choices=["inline", "thread", "process"],
+        default="inline",
+        help=(
+            "Validate responses in the user's greenlet, on a thread pool, or in a "
+            + "pool of processes"
+        ),
+    )
+
+
+def set_total_users(environment, msg, **kwargs):
+    global TOTAL_USERS
+    TOTAL_USERS = msg.data
+
+
+@events.test_start.add_listener
+def send_total_users(environment, **kwargs):
+    """Tell the workers how many users there are before they start them"""
+    if isinstance(environment.runner, MasterRunner):
+        environment.runner.send_message(
+            "total_users", environment.runner.target_user_count
+        )
+
+
+@events.spawning_complete.add_listener
+def update_total_users(user_count, **kwargs):
+    """Keep up with the number of users when it's changed during a test"""
+    global TOTAL_USERS
+    TOTAL_USERS = user_count
+
+
+def total_users(environment):
+    if isinstance(environment.runner, WorkerRunner):
+        return (
+            TOTAL_USERS
+            or environment.parsed_options.num_users
+            or environment.runner.target_user_count
+        )
+    return environment.runner.target_user_count
 
 
 @events.init.add_listener
 def system_setup(environment, **kwargs):
     """Set up test system."""
-    global SCHEMA
+    global ORDER, STACKS, VALIDATION_EXECUTOR
+
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message("total_users", set_total_users)
 
     # This is a copy of the one in the tecken repo
     schema_path = pathlib.Path(SCHEMADIR) / "symbolicate_api_response_v5.json"
-    SCHEMA = load_schema(schema_path)
+    init_validator(schema_path)
     print("Schema loaded.")
 
-    # Stacks are in the parent directory
-    stacks_dir = pathlib.Path(STACKSDIR)
-    for path in stacks_dir.glob("*.json"):
-        path = path.resolve()
-        stack = load_stack(path)
-        PAYLOADS.append((str(path), stack))
+    options = environment.parsed_options
+    if options.validate_in == "process" and not isinstance(
+        environment.runner, MasterRunner
+    ):
+        VALIDATION_EXECUTOR = ProcessPoolExecutor(
+            initializer=init_validator, initargs=(schema_path,)
+        )
 
-    print(f"Stacks loaded: {len(PAYLOADS)}")
+    # A packed corpus is memory-mapped so all the Locust processes on a machine
+    # share it; a stacks directory is read into memory
+    STACKS = open_stacks(environment.parsed_options.stacks, preload=True)
+    print(f"Stacks loaded: {len(STACKS)}")
+
+    if options.order:
+        # Each process sends the whole order, starting over when it gets to the
+        # end
+        ORDER = itertools.cycle(load_order(options.order, STACKS))
+        print(f"Order loaded: {options.order}")
 
 
 class WebsiteUser(HttpUser):
     # wait_time = between(5, 15)
 
+    def on_start(self):
+        options = self.environment.parsed_options
+        self.rate = options.rate
+        self.arrival = options.arrival
+        # Each user gets its own generator so what it sends doesn't depend on
+        # how the users' requests interleave
+        if options.seed is not None:
+            worker_index = getattr(self.environment.runner, "worker_index", 0)
+            user_number = next(USER_NUMBERS)
+            self.rng = random.Random(f"{options.seed}:{worker_index}:{user_number}")
+        else:
+            self.rng = random.Random()
+        # Locust runs the first task right away; wait_time is called after it
+        self.intended_t = time.time()
+
+    def next_gap(self):
+        # Each user sends its share of the total rate, out of however many users
+        # there are now; users must be able to keep up, so use enough of them
+        # to cover rate * response time
+        rate = self.rate / max(1, total_users(self.environment))
+        if self.arrival == "poisson":
+            return self.rng.expovariate(rate)
+        return 1.0 / rate
+
+    def wait_time(self):
+        if not self.rate:
+            return 0
+        # Sleep until the next intended send time; if this user is behind
+        # schedule, send right away and let the delay count as latency
+        return max(0, self.intended_t - time.time())
+
     @task
     def symbolicate(self):
         headers = {
             "User-Agent": "eliot-loadtest-locust/1.0",
             "Origin": "http://example.com",
+            "Content-Type": "application/json",
         }
 
-        payload_id = int(random.uniform(0, len(PAYLOADS)))
-        payload_path, payload = PAYLOADS[payload_id]
+        if ORDER is not None:
+            payload_id = next(ORDER)
+        else:
+            payload_id = self.rng.randrange(len(STACKS))
+        payload_path = STACKS.name(payload_id)
+        payload = STACKS.payload_bytes(payload_id)
 
         t = time.time()
         resp = self.client.post(
-            "/symbolicate/v5", headers=headers, json=payload, timeout=TIMEOUT
+            "/symbolicate/v5", headers=headers, data=payload, timeout=TIMEOUT
         )
 
         end_t = time.time()
         delta_t = int(end_t - t)
+
+        if self.rate:
+            # Report latency measured from the intended send time so that
+            # queueing delay shows up in the percentiles. It's the same request,
+            # so it isn't counted again in the totals, and failures are only
+            # counted for the request itself.
+            log_timing(
+                self.environment,
+                "POST",
+                "/symbolicate/v5 (from intended send)",
+                (end_t - self.intended_t) * 1000,
+                len(resp.content or b""),
+            )
+            self.intended_t += self.next_gap()
+
         assert (
             resp.status_code == 200
         ), f"failed with {resp.status_code}: {payload_path} ({delta_t:,}s)"
 
-        json_data = resp.json()
-
-        try:
-            jsonschema.validate(json_data, SCHEMA)
-        except jsonschema.exceptions.ValidationError as exc:
-            raise AssertionError("response didn't validate") from exc
+        if self.rng.random() < self.environment.parsed_options.validate_rate:
+            submit_validation(self.environment, resp.content)
@@ -2,22 +2,37 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+import glob
 import logging
 import os
+import pathlib
 import random
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-import textwrap
+import sys
+from tempfile import TemporaryDirectory
 import time
-from typing import BinaryIO, Optional
-import zipfile
+from typing import Optional
 
+import gevent
+import gevent.threadpool
+from gevent.queue import Empty, Queue
 from locust import HttpUser, task
 from locust import events
+from locust.runners import MasterRunner
 from requests import Session, Response
 from requests.adapters import HTTPAdapter, Retry
 
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "bin"))
+from fakesyms import (  # noqa: E402
+    FILE_NAME_PREFIX,
+    FakeSymFile,
+    Random,
+    format_file_size,
+    write_archive,
+)
+
 
 LOGGER = logging.getLogger(__name__)
 TIMEOUT = 120
@@ -29,11 +44,27 @@ HOST = os.environ["HOST"]
 ARCHIVE_SIZE = 20_000_000
 SYM_SIZE = 1_000_000
 
+# Number of processes generating archives; 0 generates them in a thread in the
+# Locust process
+ARCHIVE_WORKERS = int(os.environ.get("ARCHIVE_WORKERS", os.cpu_count() or 1))
+
+# Number of ready-made archives to keep on hand for the users
+ARCHIVE_POOL_SIZE = int(os.environ.get("ARCHIVE_POOL_SIZE", 4))
+
+# Directory of zips made ahead of time, like by bin/make-fake-symbol-zips.py, to
+# upload instead of generating archives; they're uploaded in random order and
+# aren't deleted
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")
+
 
 class AuthTokenMissing(Exception):
     pass
 
 
+class ArchivePoolStopped(Exception):
+    pass
+
+
 @dataclass
 class Environment:
     """A target environment specification."""
@@ -61,84 +92,24 @@ class Environment:
             ) from None
 
 
-FILE_NAME_PREFIX = "tecken-system-tests-"
+_EXECUTOR: Optional[Executor] = None
 
 
-class Random(random.Random):
-    def hex_str(self, length: int) -> str:
-        return self.randbytes((length + 1) // 2)[:length].hex()
+def get_archive_executor() -> Executor:
+    """Return the shared pool of archive workers
 
+    With ARCHIVE_WORKERS set to 0, that's a thread in the Locust process rather
+    than worker processes, so that generating archives doesn't block the event
+    loop.
 
-class FakeSymFile:
-    DEBUG_FILE_EXTENSIONS = {
-        "linux": ".so",
-        "mac": ".dylib",
-        "windows": ".pdb",
-    }
-    NONSENSE_DIRECTIVES = [
-        "FLIBBERWOCK",
-        "ZINDLEFUMP",
-        "GRUMBLETOCK",
-        "SNORFLEQUIN",
-        "WIBBLESNATCH",
-        "BLORPTANGLE",
-    ]
-
-    def __init__(self, size: int, platform: str, seed: Optional[int] = None):
-        self.size = size
-        self.platform = platform
-        self.seed = seed or random.getrandbits(64)
-
-        rng = Random(self.seed)
-        self.arch = rng.choice(["aarch64", "x86", "x86_64"])
-        self.debug_id = rng.hex_str(33).upper()
-        self.debug_file = (
-            FILE_NAME_PREFIX
-            + rng.hex_str(16)
-            + self.DEBUG_FILE_EXTENSIONS[self.platform]
-        )
-        self.sym_file = self.debug_file.removesuffix(".pdb") + ".sym"
-        if self.platform == "windows":
-            self.code_file = self.debug_file.removesuffix(".pdb") + ".dll"
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        if ARCHIVE_WORKERS > 0:
+            _EXECUTOR = ProcessPoolExecutor(max_workers=ARCHIVE_WORKERS)
         else:
-            self.code_file = ""
-        self.code_id = rng.hex_str(16).upper()
-        self.build_id = datetime.now().strftime("%Y%m%d%H%M%S")
-
-    def key(self) -> str:
-        return f"{self.debug_file}/{self.debug_id}/{self.sym_file}"
-
-    def code_info_key(self) -> str:
-        return f"{self.code_file}/{self.code_id}/{self.sym_file}"
-
-    def header(self) -> bytes:
-        return textwrap.dedent(f"""\
-            MODULE {self.platform} {self.arch} {self.debug_id} {self.debug_file}
-            INFO CODE_ID {self.code_id} {self.code_file}
-            INFO RELEASECHANNEL nightly
-            INFO VERSION 130.0
-            INFO VENDOR Mozilla
-            INFO PRODUCTNAME Firefox
-            INFO BUILDID {self.build_id}
-            INFO GENERATOR tecken-system-tests 1.0
-            """).encode()
-
-    def write(self, file: BinaryIO):
-        header = self.header()
-        file.write(header)
-        written = len(header)
-        rng = Random(self.seed)
-        while written < self.size:
-            line = f"{rng.choice(self.NONSENSE_DIRECTIVES)} {rng.hex_str(16_384)}\n".encode()
-            file.write(line)
-            written += len(line)
-
-
-def _format_file_size(size: int) -> str:
-    for factor, unit in [(2**30, "GiB"), (2**20, "MiB"), (2**10, "KiB")]:
-        if size >= factor:
-            return f"{size / factor:.1f} {unit}"
-    return f"{size} bytes"
+            _EXECUTOR = gevent.threadpool.ThreadPoolExecutor(max_workers=1)
+    return _EXECUTOR
 
 
 class FakeZipArchive:
@@ -154,24 +125,30 @@ class FakeZipArchive:
         self.members: list[FakeSymFile] = []
         self.uploaded = False
 
-    def create(self, tmp_dir: os.PathLike):
+    def create(self, tmp_dir: os.PathLike, executor: Executor) -> Future:
+        """Start writing the archive to tmp_dir
+
+        The whole archive is written by write_archive() in executor, so all the
+        compression happens there.
+
+        :returns: a future for the archive's members
+
+        """
         LOGGER.info(
-            "Generating zip archive with a size of %s", _format_file_size(self.size)
+            "Generating zip archive with a size of %s", format_file_size(self.size)
         )
         rng = Random(self.seed)
         self.file_name = os.path.join(
             tmp_dir, FILE_NAME_PREFIX + rng.hex_str(16) + ".zip"
         )
-        with open(self.file_name, "wb") as f:
-            with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as zip:
-                while f.tell() < self.size:
-                    sym_file = FakeSymFile(
-                        self.sym_file_size, self.platform, seed=rng.getrandbits(64)
-                    )
-                    self.members.append(sym_file)
-                    with NamedTemporaryFile() as sym_f:
-                        sym_file.write(sym_f)
-                        zip.write(sym_f.name, sym_file.key())
+        return executor.submit(
+            write_archive,
+            self.file_name,
+            self.size,
+            self.sym_file_size,
+            self.platform,
+            rng.getrandbits(64),
+        )
 
 
 class TeckenRetry(Retry):
@@ -227,10 +204,127 @@ class TeckenClient:
             return self.auth_request("POST", "/upload/", try_storage, files=files)
 
 
+ARCHIVE_POOL: Optional[Queue] = None
+_ARCHIVE_TMP_DIR: Optional[TemporaryDirectory] = None
+_ARCHIVE_FILLER: Optional[gevent.Greenlet] = None
+
+
+def fill_archive_pool(pool: Queue, tmp_dir: str):
+    """Keep the pool topped up with archives that are ready to upload"""
+    executor = get_archive_executor()
+    # Each worker writes a whole archive, so keep one in progress for each, but
+    # not more than the pool holds
+    in_progress = max(1, min(ARCHIVE_WORKERS, ARCHIVE_POOL_SIZE))
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < in_progress:
+                zip_archive = FakeZipArchive(
+                    size=ARCHIVE_SIZE,
+                    sym_file_size=SYM_SIZE,
+                    platform="windows",
+                )
+                pending.append(
+                    (
+                        zip_archive,
+                        zip_archive.create(tmp_dir=tmp_dir, executor=executor),
+                    )
+                )
+            zip_archive, future = pending.popleft()
+            zip_archive.members = future.result()
+            # This blocks while the pool is full
+            pool.put(zip_archive)
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+@dataclass
+class PreparedArchive:
+    """An archive from ARCHIVE_DIR"""
+
+    file_name: str
+
+
+def fill_archive_pool_from_dir(pool: Queue, archive_dir: str):
+    """Keep the pool topped up with the archives in archive_dir"""
+    file_names = sorted(glob.glob(os.path.join(archive_dir, "*.zip")))
+    if not file_names:
+        raise FileNotFoundError(f"no .zip files in {archive_dir}")
+    rng = random.Random()
+    while True:
+        rng.shuffle(file_names)
+        for file_name in file_names:
+            pool.put(PreparedArchive(file_name))
+
+
+def delete_archive(zip_archive: FakeZipArchive):
+    """Delete a generated archive file without blocking the event loop"""
+    if isinstance(zip_archive, PreparedArchive):
+        return
+    gevent.get_hub().threadpool.spawn(_remove_file, zip_archive.file_name)
+
+
+def _remove_file(file_name: str):
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        # The temporary directory is removed with everything in it on quitting
+        pass
+
+
+def log_filler_error(filler: gevent.Greenlet):
+    LOGGER.error("archive pool filler failed", exc_info=filler.exc_info)
+
+
+def get_archive():
+    """Return the next archive from the pool
+
+    :raises ArchivePoolStopped: if no more archives are being made, with the
+        error that stopped them
+
+    """
+    while True:
+        try:
+            return ARCHIVE_POOL.get(timeout=1)
+        except Empty:
+            if _ARCHIVE_FILLER is not None and _ARCHIVE_FILLER.dead:
+                raise ArchivePoolStopped(
+                    "archives aren't being made anymore"
+                ) from _ARCHIVE_FILLER.exception
+
+
 @events.init.add_listener
 def system_setup(environment, **kwargs):
     """Set up test system."""
-    pass
+    global ARCHIVE_POOL, _ARCHIVE_TMP_DIR, _ARCHIVE_FILLER
+
+    if isinstance(environment.runner, MasterRunner):
+        # Archives are only needed where the users run
+        return
+
+    ARCHIVE_POOL = Queue(maxsize=ARCHIVE_POOL_SIZE)
+    if ARCHIVE_DIR:
+        _ARCHIVE_FILLER = gevent.spawn(
+            fill_archive_pool_from_dir, ARCHIVE_POOL, ARCHIVE_DIR
+        )
+        _ARCHIVE_FILLER.link_exception(log_filler_error)
+        return
+
+    _ARCHIVE_TMP_DIR = TemporaryDirectory(ignore_cleanup_errors=True)
+    _ARCHIVE_FILLER = gevent.spawn(
+        fill_archive_pool, ARCHIVE_POOL, _ARCHIVE_TMP_DIR.name
+    )
+    _ARCHIVE_FILLER.link_exception(log_filler_error)
+
+
+@events.quitting.add_listener
+def system_teardown(environment, **kwargs):
+    """Stop generating archives and delete the ones left over."""
+    if _ARCHIVE_FILLER is not None:
+        _ARCHIVE_FILLER.kill()
+    if _ARCHIVE_TMP_DIR is not None:
+        _ARCHIVE_TMP_DIR.cleanup()
 
 
 class WebsiteUser(HttpUser):
@@ -239,14 +333,10 @@ class WebsiteUser(HttpUser):
     @task
     def symbolicate(self):
         env = Environment(name=TARGET_ENV, base_url=HOST)
-        with TemporaryDirectory() as tmp_dir:
-            zip_archive = FakeZipArchive(
-                size=ARCHIVE_SIZE,
-                sym_file_size=SYM_SIZE,
-                platform="windows",
-            )
-            zip_archive.create(tmp_dir=tmp_dir)
-
+        # Archives are made ahead of time so that generating them isn't part of
+        # the upload cycle
+        zip_archive = get_archive()
+        try:
             t = time.time()
             with open(zip_archive.file_name, "rb") as fp:
                 headers = {
@@ -265,3 +355,5 @@ class WebsiteUser(HttpUser):
                 assert (
                     resp.status_code == 201
                 ), f"failed with {resp.status_code}: ({delta_t:,}s)"
+        finally:
+            delete_archive(zip_archive)